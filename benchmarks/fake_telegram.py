@@ -0,0 +1,164 @@
+import asyncio
+import itertools
+import os
+import random
+from types import SimpleNamespace
+
+from pyrogram.errors import FloodWait
+
+# Pyrogram sleeps through FloodWaits up to this many seconds by itself and raises above it
+SLEEP_THRESHOLD = 10
+PROGRESS_STEPS = 20
+
+
+class FakeUser(object):
+    def __init__(self, user_id, first_name="bench"):
+        self.id = user_id
+        self.first_name = first_name
+        self.mention = f"[{first_name}](tg://user?id={user_id})"
+
+
+class FakeMedia(object):
+    def __init__(self, file_id, file_size):
+        self.file_id = file_id
+        self.file_size = file_size
+
+
+class FakeMessage(object):
+    def __init__(self, client, chat_id, message_id, text=None, from_user=None, reply_to_message=None):
+        self._client = client
+        self.chat = SimpleNamespace(id=chat_id)
+        self.id = message_id
+        self.text = text
+        self.from_user = from_user
+        self.reply_to_message = reply_to_message
+        self.reply_markup = None
+        for media_type in ("video", "audio", "document", "video_note", "animation", "photo", "voice"):
+            setattr(self, media_type, None)
+
+    async def reply_text(self, text, quote=None, reply_markup=None, **kwargs):
+        return await self._client.send_message(self.chat.id, text, reply_to_message_id=self.id,
+                                               reply_markup=reply_markup)
+
+    async def edit_text(self, text, reply_markup=None, **kwargs):
+        return await self._client.edit_message_text(self.chat.id, self.id, text=text, reply_markup=reply_markup)
+
+    async def edit_reply_markup(self, reply_markup=None):
+        await self._client.simulate_api_call()
+        self.reply_markup = reply_markup
+        return self
+
+
+class FakeCallbackQuery(object):
+    def __init__(self, data, from_user, message):
+        self.data = data
+        self.from_user = from_user
+        self.message = message
+        self.answers = []
+
+    async def answer(self, text=None, show_alert=None, **kwargs):
+        self.answers.append(text)
+
+
+# Stand-in for pyrogram.Client with the calls the handlers make. Records every edit and
+# upload, throttles uploads to a simulated bandwidth and injects FloodWaits at a given rate.
+class FakeClient(object):
+    def __init__(self, upload_bandwidth=0, flood_wait_rate=0.0, flood_wait_seconds=2, api_latency=0.05, seed=0):
+        self.upload_bandwidth = upload_bandwidth  # bytes per second, 0 = unlimited
+        self.flood_wait_rate = flood_wait_rate
+        self.flood_wait_seconds = flood_wait_seconds
+        self.api_latency = api_latency
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1000)
+        self._file_ids = itertools.count(1)
+        self.messages = {}
+        self.edits = 0
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.cached_sends = 0
+        self.flood_waits = 0
+        self.flood_wait_total = 0.0
+        self.deliveries = {}  # chat_id -> media messages sent
+        self.me = FakeUser(1, "benchbot")
+
+    async def simulate_api_call(self):
+        await asyncio.sleep(self.api_latency)
+        if self.flood_wait_rate and self._random.random() < self.flood_wait_rate:
+            self.flood_waits += 1
+            self.flood_wait_total += self.flood_wait_seconds
+            if self.flood_wait_seconds > SLEEP_THRESHOLD:
+                raise FloodWait(value=self.flood_wait_seconds)
+            await asyncio.sleep(self.flood_wait_seconds)
+
+    def new_message(self, chat_id, text=None, from_user=None, reply_to_message=None):
+        message = FakeMessage(self, chat_id, next(self._message_ids), text, from_user, reply_to_message)
+        self.messages[(chat_id, message.id)] = message
+        return message
+
+    async def get_me(self):
+        return self.me
+
+    async def send_message(self, chat_id, text, reply_to_message_id=None, reply_markup=None, **kwargs):
+        await self.simulate_api_call()
+        reply_to = self.messages.get((chat_id, reply_to_message_id))
+        message = self.new_message(chat_id, text, self.me, reply_to)
+        message.reply_markup = reply_markup
+        return message
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kwargs):
+        await self.simulate_api_call()
+        self.edits += 1
+        message = self.messages.get((chat_id, message_id))
+        if message is not None:
+            message.text = text
+            message.reply_markup = reply_markup
+        return message
+
+    async def _upload(self, media_type, chat_id, path, reply_to_message_id, progress, progress_args):
+        size = os.path.getsize(path)
+        step = max(1, size // PROGRESS_STEPS)
+        sent = 0
+        while sent < size:
+            chunk = min(step, size - sent)
+            if self.upload_bandwidth:
+                await asyncio.sleep(chunk / self.upload_bandwidth)
+            sent += chunk
+            if progress:
+                await progress(sent, size, *progress_args)
+        await self.simulate_api_call()
+        self.uploads += 1
+        self.uploaded_bytes += size
+        self.deliveries[chat_id] = self.deliveries.get(chat_id, 0) + 1
+        message = self.new_message(chat_id, None, self.me, self.messages.get((chat_id, reply_to_message_id)))
+        setattr(message, media_type, FakeMedia(f"bench-file-{next(self._file_ids)}", size))
+        return message
+
+    async def send_video(self, chat_id, video, reply_to_message_id=None, progress=None, progress_args=(), **kwargs):
+        return await self._upload("video", chat_id, video, reply_to_message_id, progress, progress_args)
+
+    async def send_audio(self, chat_id, audio, reply_to_message_id=None, progress=None, progress_args=(), **kwargs):
+        return await self._upload("audio", chat_id, audio, reply_to_message_id, progress, progress_args)
+
+    async def send_document(self, chat_id, document, reply_to_message_id=None, progress=None, progress_args=(), **kwargs):
+        return await self._upload("document", chat_id, document, reply_to_message_id, progress, progress_args)
+
+    async def send_video_note(self, chat_id, video_note, reply_to_message_id=None, progress=None, progress_args=(), **kwargs):
+        return await self._upload("video_note", chat_id, video_note, reply_to_message_id, progress, progress_args)
+
+    async def send_cached_media(self, chat_id, file_id, reply_to_message_id=None, **kwargs):
+        await self.simulate_api_call()
+        self.cached_sends += 1
+        self.deliveries[chat_id] = self.deliveries.get(chat_id, 0) + 1
+        message = self.new_message(chat_id, None, self.me, self.messages.get((chat_id, reply_to_message_id)))
+        message.document = FakeMedia(file_id, 0)
+        return message
+
+    def stats(self):
+        return {
+            "edits": self.edits,
+            "uploads": self.uploads,
+            "uploaded_bytes": self.uploaded_bytes,
+            "cached_sends": self.cached_sends,
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": self.flood_wait_total,
+        }
@@ -0,0 +1,60 @@
+import logging
+import os
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+WRITE_BLOCK = 1024 * 1024
+
+
+def create_media_files(directory, count, size):
+    """Write `count` synthetic media files of `size` bytes; the content only has to be unique."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"clip_{i}.mp4")
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            with open(path, "wb") as f:
+                remaining = size
+                while remaining > 0:
+                    block = min(WRITE_BLOCK, remaining)
+                    f.write(os.urandom(block))
+                    remaining -= block
+        paths.append(path)
+    return paths
+
+
+# Serves the files as plain video/mp4 with range support, so yt-dlp's generic extractor
+# treats each URL as a direct link and the segmented downloader can fetch it in parallel.
+class MediaServer(object):
+    def __init__(self, directory, host="127.0.0.1", port=0):
+        self.directory = directory
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self._runner = None
+
+    async def _serve(self, request):
+        self.requests += 1
+        path = os.path.join(self.directory, os.path.basename(request.match_info["name"]))
+        if not os.path.isfile(path):
+            raise web.HTTPNotFound()
+        return web.FileResponse(path, headers={"Content-Type": "video/mp4"})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/media/{name}", self._serve)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        logger.info(f"Benchmark media server on http://{self.host}:{self.port}/media/")
+
+    def url(self, path):
+        return f"http://{self.host}:{self.port}/media/{os.path.basename(path)}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
@@ -0,0 +1,288 @@
+"""Offline benchmark of the bot's URL -> picker -> download -> upload path.
+
+Runs the real handlers (process_url_for_qualities and ddl_call_back) against a fake
+Telegram client and a local HTTP server of synthetic media, so nothing leaves the machine.
+yt-dlp resolves the local URLs with its generic extractor. Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --jobs 40 --concurrency 8 --size-mb 20 \
+        --output results.json --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=20, help="URL messages to send")
+    parser.add_argument("--concurrency", type=int, default=4, help="jobs in flight at once")
+    parser.add_argument("--size-mb", type=float, default=10, help="size of each synthetic media file")
+    parser.add_argument("--distinct-urls", type=int, default=0,
+                        help="different files to serve (0 = one per job; fewer means file index hits)")
+    parser.add_argument("--users", type=int, default=0, help="distinct users sending jobs (0 = one per job)")
+    parser.add_argument("--upload-mbps", type=float, default=0, help="simulated Telegram upload bandwidth (0 = unlimited)")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="seconds per simulated Bot API call")
+    parser.add_argument("--floodwait-rate", type=float, default=0.0, help="probability of a FloodWait per API call")
+    parser.add_argument("--floodwait-seconds", type=int, default=2, help="FloodWait duration (above 10 s it is raised)")
+    parser.add_argument("--sample-interval", type=float, default=0.2, help="seconds between disk usage samples")
+    parser.add_argument("--workdir", help="directory for media, downloads and databases (default: a temp dir)")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def configure_environment(args, workdir):
+    # Config reads the environment at import time, so this must run before main is imported
+    os.environ["DOWNLOAD_LOCATION"] = os.path.join(workdir, "downloads") + os.sep
+    os.environ["SESSION_DB_PATH"] = os.path.join(workdir, "sessions.db")
+    os.environ["FILE_INDEX_DB_PATH"] = os.path.join(workdir, "file_index.db")
+    os.environ["JOB_JOURNAL_DB_PATH"] = os.path.join(workdir, "job_journal.db")
+    os.environ["PREFERENCES_DB_PATH"] = os.path.join(workdir, "preferences.db")
+    os.environ["METRICS_PORT"] = "0"
+    os.environ.setdefault("MAX_CONCURRENT_JOBS", str(args.concurrency))
+    os.environ.setdefault("MAX_JOBS_PER_USER", str(args.concurrency))
+    os.environ.setdefault("DISK_MIN_FREE", "0")
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return round(ordered[index], 3)
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3) if values else None,
+        "p50": percentile(values, 0.50),
+        "p99": percentile(values, 0.99),
+        "max": round(max(values), 3) if values else None,
+    }
+
+
+def directory_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass  # removed while walking
+    return total
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return {"self": own, "children": children}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class DiskSampler(object):
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            size = await asyncio.to_thread(directory_size, self.path)
+            self.peak = max(self.peak, size)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+async def run_one(bot, main, url, user, chat_id):
+    from benchmarks.fake_telegram import FakeCallbackQuery
+
+    result = {"url": url, "ok": False}
+    delivered_before = bot.deliveries.get(chat_id, 0)
+    user_message = bot.new_message(chat_id, url, user)
+    start = time.monotonic()
+    await main.process_url_for_qualities(bot, user_message)
+    result["picker_seconds"] = time.monotonic() - start
+
+    picker_message = next((m for m in bot.messages.values() if m.reply_to_message is user_message), None)
+    markup = picker_message.reply_markup if picker_message else None
+    buttons = [button for row in markup.inline_keyboard for button in row] if markup else []
+    choice = next((b.callback_data for b in buttons if b.callback_data.startswith("dl=")), None)
+    if choice is None:
+        result["error"] = picker_message.text if picker_message else "no picker shown"
+        return result
+
+    delivery_start = time.monotonic()
+    await main.ddl_call_back(bot, FakeCallbackQuery(choice, user, picker_message))
+    end = time.monotonic()
+    result["delivery_seconds"] = end - delivery_start
+    result["total_seconds"] = end - start
+    result["ok"] = bot.deliveries.get(chat_id, 0) > delivered_before
+    if not result["ok"]:
+        result["error"] = picker_message.text
+    return result
+
+
+async def run(args, workdir):
+    import main
+    from plugins.metrics import jobs_total
+    from plugins.segmented_download import close_http_session
+    from benchmarks.fake_telegram import FakeClient, FakeUser
+    from benchmarks.media_server import MediaServer, create_media_files
+
+    size = int(args.size_mb * 1024 * 1024)
+    distinct = args.distinct_urls or args.jobs
+    media_paths = create_media_files(os.path.join(workdir, "media"), distinct, size)
+    server = MediaServer(os.path.join(workdir, "media"))
+    await server.start()
+
+    bot = FakeClient(upload_bandwidth=int(args.upload_mbps * 125000), flood_wait_rate=args.floodwait_rate,
+                     flood_wait_seconds=args.floodwait_seconds, api_latency=args.api_latency, seed=args.seed)
+    users = args.users or args.jobs
+    download_dir = os.environ["DOWNLOAD_LOCATION"]
+    os.makedirs(download_dir, exist_ok=True)
+    sampler = DiskSampler(download_dir, args.sample_interval)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(i):
+        user = FakeUser(100000 + i % users)
+        async with semaphore:
+            try:
+                return await run_one(bot, main, server.url(media_paths[i % distinct]), user, user.id)
+            except Exception as e:
+                logging.exception(f"Benchmark job {i} crashed")
+                return {"ok": False, "error": repr(e)}
+
+    sampler.start()
+    start = time.monotonic()
+    try:
+        results = await asyncio.gather(*(limited(i) for i in range(args.jobs)))
+    finally:
+        elapsed = time.monotonic() - start
+        await sampler.stop()
+        await server.stop()
+        main.ydl_executor.shutdown()
+        await close_http_session()
+
+    succeeded = [r for r in results if r["ok"]]
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "parameters": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "workdir")},
+        "elapsed_seconds": round(elapsed, 3),
+        "jobs": {"total": len(results), "succeeded": len(succeeded), "failed": len(results) - len(succeeded)},
+        "outcomes": {labels[0]: value for _, labels, _, value in jobs_total.samples()},
+        "throughput": {
+            "jobs_per_second": round(len(succeeded) / elapsed, 3) if elapsed else None,
+            "megabytes_per_second": round(bot.uploaded_bytes / elapsed / 1e6, 3) if elapsed else None,
+        },
+        "latency_seconds": {
+            "picker": summarize([r["picker_seconds"] for r in results if "picker_seconds" in r]),
+            "delivery": summarize([r["delivery_seconds"] for r in succeeded]),
+            "total": summarize([r["total_seconds"] for r in succeeded]),
+        },
+        "peak_rss_bytes": peak_rss_bytes(),
+        "peak_disk_bytes": sampler.peak,
+        "telegram": bot.stats(),
+        "source_requests": server.requests,
+        "errors": sorted({r["error"] for r in results if r.get("error")})[:20],
+    }
+
+
+# Metrics compared between runs; +1 means higher is better
+COMPARED = {
+    ("throughput", "jobs_per_second"): 1,
+    ("throughput", "megabytes_per_second"): 1,
+    ("latency_seconds", "picker", "p50"): -1,
+    ("latency_seconds", "picker", "p99"): -1,
+    ("latency_seconds", "delivery", "p50"): -1,
+    ("latency_seconds", "delivery", "p99"): -1,
+    ("latency_seconds", "total", "p50"): -1,
+    ("latency_seconds", "total", "p99"): -1,
+    ("peak_rss_bytes", "self"): -1,
+    ("peak_disk_bytes",): -1,
+    ("telegram", "edits"): -1,
+    ("jobs", "failed"): -1,
+}
+
+
+def _lookup(results, path):
+    for key in path:
+        if not isinstance(results, dict):
+            return None
+        results = results.get(key)
+    return results
+
+
+def compare(results, baseline):
+    """Relative change of each compared metric against `baseline`, marked better/worse."""
+    comparison = {}
+    for path, direction in COMPARED.items():
+        old, new = _lookup(baseline, path), _lookup(results, path)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else (0.0 if new == old else None)
+        verdict = "same"
+        if change is None or abs(change) >= 0.05:
+            verdict = "better" if (new - old) * direction > 0 else "worse"
+        comparison[".".join(path)] = {"baseline": old, "current": new,
+                                      "change": round(change, 4) if change is not None else None, "verdict": verdict}
+    return comparison
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    with tempfile.TemporaryDirectory(prefix="ytbot-bench-") as tmp:
+        workdir = args.workdir or tmp
+        configure_environment(args, workdir)
+        # main's own logging.basicConfig is a no-op after this one, so the run stays quiet
+        results = asyncio.run(run(args, workdir))
+
+    if args.compare:
+        with open(args.compare) as f:
+            results["comparison"] = compare(results, json.load(f))
+
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    return 0 if results["jobs"]["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
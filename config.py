@@ -16,8 +16,165 @@ class Config:
     # Maximum file size for Telegram (approx. 2 GB - 2 * 1024 * 1024 * 1024)
     TECH_VJ_TG_MAX_FILE_SIZE = int(os.environ.get("TG_MAX_FILE_SIZE", 2147483648))
 
-    # Maximum timeout for processing (downloading) links (in seconds)
+    # Maximum time a whole job (download, processing and upload) may take (in seconds)
     TECH_VJ_PROCESS_MAX_TIMEOUT = int(os.environ.get("PROCESS_TIMEOUT", 3600)) # 1 hour
+    # Per-stage deadlines (0 = only the job deadline applies), seconds without progress
+    # before a transfer counts as stalled, and the socket timeout handed to yt-dlp
+    TECH_VJ_DOWNLOAD_TIMEOUT = int(os.environ.get("DOWNLOAD_TIMEOUT", 1800))
+    TECH_VJ_POSTPROCESS_TIMEOUT = int(os.environ.get("POSTPROCESS_TIMEOUT", 1800))
+    TECH_VJ_UPLOAD_TIMEOUT = int(os.environ.get("UPLOAD_TIMEOUT", 1800))
+    TECH_VJ_STALL_TIMEOUT = int(os.environ.get("STALL_TIMEOUT", 120))
+    TECH_VJ_SOCKET_TIMEOUT = int(os.environ.get("SOCKET_TIMEOUT", 30))
 
-    # Chunk size for direct download (if still used, though yt-dlp handles this)
+    # Chunk size of the segmented downloader (bytes buffered per write)
     TECH_VJ_CHUNK_SIZE = 1024 * 1024 # 1MB
+
+    # Storage for pending quality pickers ("sqlite" survives restarts, "memory" does not)
+    TECH_VJ_SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite")
+    TECH_VJ_SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH", "./sessions.db")
+    TECH_VJ_SESSION_TTL = int(os.environ.get("SESSION_TTL", 86400)) # 1 day
+    TECH_VJ_SESSION_MAX_ENTRIES = int(os.environ.get("SESSION_MAX_ENTRIES", 10000))
+    TECH_VJ_SESSION_MAX_PER_USER = int(os.environ.get("SESSION_MAX_PER_USER", 20))
+    # Quality buttons per page of the format picker
+    TECH_VJ_PICKER_PAGE_SIZE = int(os.environ.get("PICKER_PAGE_SIZE", 8))
+
+    # Fast path: users with a preferred quality (set with /quality, or learned after this many
+    # identical picks in a row once they turned on /quality auto; 0 = never learn) get their
+    # format without the picker; everyone else always sees it
+    TECH_VJ_FAST_PATH = os.environ.get("FAST_PATH", "True").lower() in ("1", "true", "yes")
+    TECH_VJ_PREFERENCE_LEARN_PICKS = int(os.environ.get("PREFERENCE_LEARN_PICKS", 3))
+    TECH_VJ_PREFERENCES_DB_PATH = os.environ.get("PREFERENCES_DB_PATH", "./preferences.db")
+    # Speculative download of the likely pick while the picker is shown (standalone mode):
+    # downloads at once, largest size, and seconds a finished one waits to be picked
+    TECH_VJ_SPECULATIVE_DOWNLOAD = os.environ.get("SPECULATIVE_DOWNLOAD", "False").lower() in ("1", "true", "yes")
+    TECH_VJ_SPECULATIVE_MAX_ACTIVE = int(os.environ.get("SPECULATIVE_MAX_ACTIVE", 2))
+    TECH_VJ_SPECULATIVE_MAX_SIZE = int(os.environ.get("SPECULATIVE_MAX_SIZE", 209715200)) # 200 MB
+    TECH_VJ_SPECULATIVE_HOLD = int(os.environ.get("SPECULATIVE_HOLD", 300))
+
+    # Batch mode (playlists and messages with several links): entries per batch,
+    # entries processed at once, and the highest video quality picked automatically
+    TECH_VJ_BATCH_MAX_ENTRIES = int(os.environ.get("BATCH_MAX_ENTRIES", 50))
+    TECH_VJ_BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 2))
+    TECH_VJ_BATCH_MAX_HEIGHT = int(os.environ.get("BATCH_MAX_HEIGHT", 720))
+
+    # Cache of extracted info dicts shared by the quality picker and the download
+    # (format URLs expire on most sites, so keep the TTL short)
+    TECH_VJ_INFO_CACHE_TTL = int(os.environ.get("INFO_CACHE_TTL", 1800)) # 30 minutes
+    TECH_VJ_INFO_CACHE_MAX_ENTRIES = int(os.environ.get("INFO_CACHE_MAX_ENTRIES", 500))
+
+    # Job scheduler: global and per-user concurrency, queue policy ("fifo", "fair" or "sjf":
+    # fair share first, then the smallest expected download; "fair" by default, so
+    # small-jobs-first is opt-in), and the seconds after which a job queued under "sjf"
+    # goes ahead in arrival order whatever its size
+    TECH_VJ_MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", 8))
+    TECH_VJ_MAX_JOBS_PER_USER = int(os.environ.get("MAX_JOBS_PER_USER", 2))
+    TECH_VJ_QUEUE_POLICY = os.environ.get("QUEUE_POLICY", "fair")
+    TECH_VJ_SJF_AGING = int(os.environ.get("SJF_AGING", 120))
+
+    # Bandwidth shaping in bytes per second (0 = unlimited): global and per-user caps of
+    # downloads and uploads. Users transferring at the same time split the global cap evenly
+    TECH_VJ_DOWNLOAD_RATE_LIMIT = int(os.environ.get("DOWNLOAD_RATE_LIMIT", 0))
+    TECH_VJ_USER_DOWNLOAD_RATE_LIMIT = int(os.environ.get("USER_DOWNLOAD_RATE_LIMIT", 0))
+    TECH_VJ_UPLOAD_RATE_LIMIT = int(os.environ.get("UPLOAD_RATE_LIMIT", 0))
+    TECH_VJ_USER_UPLOAD_RATE_LIMIT = int(os.environ.get("USER_UPLOAD_RATE_LIMIT", 0))
+
+    # Worker count of each pipeline stage
+    TECH_VJ_DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 3))
+    TECH_VJ_POSTPROCESS_WORKERS = int(os.environ.get("POSTPROCESS_WORKERS", 2))
+    TECH_VJ_UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 3))
+
+    # Where yt-dlp extraction/download runs: "thread" or "process" (worker process pool)
+    TECH_VJ_YTDL_EXECUTOR = os.environ.get("YTDL_EXECUTOR", "thread")
+    TECH_VJ_YTDL_POOL_SIZE = int(os.environ.get("YTDL_POOL_SIZE", 4))
+    # Recycle each worker process after this many jobs to contain leaks
+    TECH_VJ_YTDL_WORKER_MAX_JOBS = int(os.environ.get("YTDL_WORKER_MAX_JOBS", 20))
+    # Idle YoutubeDL instances kept per option set (per worker process) and reused by later requests
+    TECH_VJ_YTDL_WARM_INSTANCES = int(os.environ.get("YTDL_WARM_INSTANCES", 4))
+
+    # Progress messages: minimum seconds between edits of one message,
+    # and a global cap on progress edits per second across all chats
+    TECH_VJ_PROGRESS_UPDATE_INTERVAL = float(os.environ.get("PROGRESS_UPDATE_INTERVAL", 5))
+    TECH_VJ_PROGRESS_GLOBAL_EDITS_PER_SEC = float(os.environ.get("PROGRESS_GLOBAL_EDITS_PER_SEC", 10))
+
+    # Outbound Bot API scheduler: global requests per second, per-chat rate and burst,
+    # seconds after which a queued progress edit is dropped, and the longest FloodWait
+    # a user-visible request waits out before it fails
+    TECH_VJ_API_GLOBAL_RATE = float(os.environ.get("API_GLOBAL_RATE", 30))
+    TECH_VJ_API_CHAT_RATE = float(os.environ.get("API_CHAT_RATE", 1))
+    TECH_VJ_API_CHAT_BURST = int(os.environ.get("API_CHAT_BURST", 3))
+    TECH_VJ_API_PROGRESS_MAX_AGE = float(os.environ.get("API_PROGRESS_MAX_AGE", 10))
+    TECH_VJ_API_MAX_FLOOD_WAIT = int(os.environ.get("API_MAX_FLOOD_WAIT", 300))
+
+    # Streaming mode: pipe formats that need no remux from the source straight into
+    # Telegram's chunked upload instead of writing the whole file to disk first
+    TECH_VJ_STREAMING_UPLOAD = os.environ.get("STREAMING_UPLOAD", "False").lower() in ("1", "true", "yes")
+    TECH_VJ_STREAM_BUFFER_PARTS = int(os.environ.get("STREAM_BUFFER_PARTS", 8)) # upload parts
+    TECH_VJ_STREAM_UPLOAD_WORKERS = int(os.environ.get("STREAM_UPLOAD_WORKERS", 4))
+
+    # Index of uploaded Telegram file_ids, so repeat requests skip download and upload
+    TECH_VJ_FILE_INDEX_DB_PATH = os.environ.get("FILE_INDEX_DB_PATH", "./file_index.db")
+
+    # ffmpeg settings used only when a stream has to be transcoded (remuxing is stream copy)
+    TECH_VJ_FFMPEG_THREADS = int(os.environ.get("FFMPEG_THREADS", 2))
+    TECH_VJ_FFMPEG_PRESET = os.environ.get("FFMPEG_PRESET", "veryfast")
+
+    # Native segmented downloader for plain HTTP(S) formats (parallel range requests)
+    TECH_VJ_SEGMENTED_DOWNLOAD = os.environ.get("SEGMENTED_DOWNLOAD", "True").lower() in ("1", "true", "yes")
+    TECH_VJ_SEGMENTED_CONNECTIONS = int(os.environ.get("SEGMENTED_CONNECTIONS", 8))
+    # Size of the shared aiohttp connection pool
+    TECH_VJ_HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 64))
+
+    # Parallel upload engine: extra MTProto media sessions, parts in flight per file,
+    # and part size in KiB (must divide 512)
+    TECH_VJ_UPLOAD_SESSIONS = int(os.environ.get("UPLOAD_SESSIONS", 4))
+    TECH_VJ_UPLOAD_PARTS_IN_FLIGHT = int(os.environ.get("UPLOAD_PARTS_IN_FLIGHT", 8))
+    TECH_VJ_UPLOAD_PART_SIZE_KB = int(os.environ.get("UPLOAD_PART_SIZE_KB", 512))
+
+    # Files above TG_MAX_FILE_SIZE are split into parts instead of rejected: videos into
+    # keyframe-aligned stream-copy segments, anything else into byte ranges. Largest file
+    # still downloaded for splitting, and the size each part aims for
+    TECH_VJ_SPLIT_LARGE_FILES = os.environ.get("SPLIT_LARGE_FILES", "True").lower() in ("1", "true", "yes")
+    TECH_VJ_SPLIT_MAX_SIZE = int(os.environ.get("SPLIT_MAX_SIZE", 8589934592)) # 8 GB
+    TECH_VJ_SPLIT_PART_SIZE = int(os.environ.get("SPLIT_PART_SIZE", 2040109465)) # 1.9 GB
+
+    # Disk admission control on DOWNLOAD_LOCATION: byte budget for all jobs (0 = only free
+    # space counts), space always kept free, and the reservation for jobs of unknown size
+    TECH_VJ_DISK_BUDGET = int(os.environ.get("DISK_BUDGET", 0))
+    TECH_VJ_DISK_MIN_FREE = int(os.environ.get("DISK_MIN_FREE", 1073741824)) # 1 GB
+    TECH_VJ_UNKNOWN_SIZE_RESERVATION = int(os.environ.get("UNKNOWN_SIZE_RESERVATION", 536870912)) # 512 MB
+
+    # Background janitor: sweep interval, age after which leftover job files are removed,
+    # and size cap of DOWNLOAD_LOCATION enforced by evicting the oldest leftovers (0 = no cap)
+    TECH_VJ_JANITOR_INTERVAL = int(os.environ.get("JANITOR_INTERVAL", 600))
+    TECH_VJ_JANITOR_MAX_AGE = int(os.environ.get("JANITOR_MAX_AGE", 21600)) # 6 hours
+    TECH_VJ_JANITOR_MAX_BYTES = int(os.environ.get("JANITOR_MAX_BYTES", 0))
+
+    # Deployment mode: "standalone" (one process does everything), "dispatcher" (handles
+    # Telegram updates and the picker, queues downloads) or "worker" (downloads and uploads
+    # queued jobs with its own session). Dispatcher and workers share the SQLite queue,
+    # job journal, file index and download directory, so they must run on one host (or on
+    # one shared volume), not as separate dynos; run one dispatcher per bot and never a
+    # standalone process next to it, or both poll the same bot. E.g. on one machine:
+    #   RUN_MODE=dispatcher python3 main.py
+    #   RUN_MODE=worker METRICS_PORT=0 python3 main.py
+    TECH_VJ_RUN_MODE = os.environ.get("RUN_MODE", "standalone").lower()
+    TECH_VJ_JOB_QUEUE_DB_PATH = os.environ.get("JOB_QUEUE_DB_PATH", "./jobs.db")
+    # Jobs a worker runs at once, seconds a lease lasts without a heartbeat, heartbeat and
+    # queue poll intervals, and how often a job is retried after its worker died
+    TECH_VJ_WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", 4))
+    TECH_VJ_WORKER_LEASE_SECONDS = int(os.environ.get("WORKER_LEASE_SECONDS", 60))
+    TECH_VJ_WORKER_HEARTBEAT_INTERVAL = int(os.environ.get("WORKER_HEARTBEAT_INTERVAL", 10))
+    TECH_VJ_WORKER_POLL_INTERVAL = float(os.environ.get("WORKER_POLL_INTERVAL", 1))
+    TECH_VJ_JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+
+    # Journal of running jobs: after a restart, interrupted downloads continue from their
+    # partial files (or go straight to postprocess/upload) instead of starting over.
+    # Resumes of one job before it is given up
+    TECH_VJ_JOB_JOURNAL = os.environ.get("JOB_JOURNAL", "True").lower() in ("1", "true", "yes")
+    TECH_VJ_JOB_JOURNAL_DB_PATH = os.environ.get("JOB_JOURNAL_DB_PATH", "./job_journal.db")
+    TECH_VJ_JOB_RESUME_MAX_ATTEMPTS = int(os.environ.get("JOB_RESUME_MAX_ATTEMPTS", 3))
+
+    # Prometheus-style metrics endpoint (http://HOST:PORT/metrics); off unless a port is set
+    # (pick one no other exporter on the host uses, e.g. not node_exporter's 9100)
+    TECH_VJ_METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+    TECH_VJ_METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
@@ -2,13 +2,15 @@ import logging
 import asyncio
 import os
 import time
-from datetime import datetime
 import uuid
 
+# Cold start is measured from here and reported once the bot is up
+BOOT_STARTED = time.monotonic()
+
 # Pyrogram imports
-from pyrogram import Client, filters
+from pyrogram import Client, filters, idle
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message
-from pyrogram.errors import MessageNotModified, FloodWait, RPCError
+from pyrogram.errors import MessageNotModified, RPCError
 from pyrogram.handlers import MessageHandler, CallbackQueryHandler
 
 # For yt-dlp
@@ -19,7 +21,33 @@ from config import Config
 from translation import Translation
 
 # Import custom thumbnail and metadata functions
-from plugins.custom_thumbnail import Mdata01, Mdata02, Mdata03, Gthumb01, Gthumb02, delete_temp_file
+from plugins.custom_thumbnail import Mdata01, Mdata02, Mdata03, Gthumb01, Gthumb02, probe_media
+from plugins.session_store import create_session_store
+from plugins.info_cache import info_cache
+from plugins.job_queue import job_scheduler
+from plugins.ytdl_executor import ydl_executor, DownloadTooLarge
+from plugins.progress_dispatcher import get_progress_dispatcher, close_progress_dispatcher, set_progress_markup
+from plugins.stream_upload import find_streamable_format, stream_url_to_telegram
+from plugins.file_index import file_index, make_media_key, get_media_file_id
+from plugins.postprocess import smart_convert
+from plugins.segmented_download import SegmentedDownloader, find_direct_http_format, close_http_session
+from plugins.upload_engine import ParallelUploadClient
+from plugins.disk_quota import disk_budget, estimate_download_size
+from plugins.format_picker import build_format_options, build_picker_keyboard, pick_batch_option, pick_preferred_option
+from plugins.batch import BatchProgress, extract_urls, run_pipeline
+from plugins.janitor import janitor
+from plugins.metrics import CallbackGauge, stage_seconds, transferred_bytes, jobs_total, start_metrics_server
+from plugins.job_control import JobControl, create_job_control, get_job, JobCancelled, CANCEL_USER, CANCEL_STALL, CANCEL_DISK
+from plugins.api_scheduler import api_scheduler
+from plugins.splitter import iter_upload_parts
+from plugins.durable_queue import (get_durable_queue, wait_for_job, QueueWorker, RemoteJobMessage, RemoteJobUpdate,
+                                   run_queue_monitor, DONE, FAILED, CANCELLED, QUEUED, LEASED, ERROR_LOST, FINISHED)
+from plugins.job_journal import get_job_journal, JournaledJob, DOWNLOAD, POSTPROCESS, UPLOAD
+from plugins.preferences import get_preference_store, parse_preference, describe_preference
+from plugins.prefetch import prefetcher
+from plugins.bandwidth import bandwidth, transfer_user, DOWNLOAD as DOWNLOAD_DIRECTION
+
+IMPORT_SECONDS = time.monotonic() - BOOT_STARTED
 
 # --- Logging setup ---
 logging.basicConfig(level=logging.INFO,
@@ -28,8 +56,34 @@ logger = logging.getLogger(__name__)
 logging.getLogger("pyrogram").setLevel(logging.WARNING)
 logging.getLogger("yt_dlp").setLevel(logging.WARNING)
 
-# --- GLOBAL STORAGE FOR TEMPORARY URLs (IN-MEMORY) ---
-temp_url_storage = {}
+# --- SESSION STORE FOR PENDING QUALITY PICKERS (TTL/LRU BOUNDED) ---
+temp_url_storage = create_session_store()
+
+# --- Gauges read from the running components whenever /metrics is scraped ---
+CallbackGauge("ytbot_jobs_running", "Jobs holding a scheduler slot.", lambda: job_scheduler.running)
+CallbackGauge("ytbot_jobs_queued", "Jobs waiting for a scheduler slot.", lambda: job_scheduler.queued)
+CallbackGauge("ytbot_stage_busy_workers", "Busy workers per pipeline stage.",
+              lambda: {name: stage["busy"] for name, stage in job_scheduler.stats()["stages"].items()}, ["stage"])
+CallbackGauge("ytbot_cache_hit_ratio", "Hit ratio of the persistent and in-memory caches.", lambda: {
+    "info": info_cache.stats()["hit_rate"],
+    "session": temp_url_storage.stats()["hit_rate"],
+    "file_index": file_index.stats()["hit_rate"],
+}, ["cache"])
+CallbackGauge("ytbot_disk_reserved_bytes", "Disk space reserved by running jobs.", lambda: disk_budget.reserved)
+CallbackGauge("ytbot_speculative_downloads", "Speculative downloads running or waiting to be picked.",
+              lambda: prefetcher.active)
+CallbackGauge("ytbot_bandwidth_allocation_bytes_per_second", "Current rate cap of each user transferring, by direction.",
+              lambda: {(direction, str(user_id)): rate for (direction, user_id), rate in bandwidth.allocations().items()
+                       if rate is not None}, ["direction", "user"])
+CallbackGauge("ytbot_api_queued_requests", "Bot API calls waiting for a rate limit slot.", lambda: api_scheduler.queued)
+CallbackGauge("ytbot_api_dropped_progress_edits", "Stale progress edits dropped by the API scheduler.", lambda: api_scheduler.dropped)
+if Config.TECH_VJ_RUN_MODE != "standalone":
+    CallbackGauge("ytbot_worker_queue_jobs", "Jobs in the durable worker queue by status.", lambda: {
+        status: count for status, count in get_durable_queue().stats(Config.TECH_VJ_WORKER_LEASE_SECONDS).items()
+        if status != "live_workers"
+    }, ["status"])
+    CallbackGauge("ytbot_live_workers", "Worker processes that sent a heartbeat within one lease.",
+                  lambda: get_durable_queue().stats(Config.TECH_VJ_WORKER_LEASE_SECONDS)["live_workers"])
 
 # --- Helper functions for progress display ---
 async def progress_for_pyrogram(
@@ -41,35 +95,24 @@ async def progress_for_pyrogram(
 ):
     now = time.time()
     diff = now - start_time
-    if round(diff % 5.00) == 0 or current == total:
-        if diff == 0:
-            return
-        percentage = current * 100 / total
-        speed = current / diff
-        elapsed_time = round(diff) * 1000
-        time_to_completion = round((total - current) / speed) * 1000
-        estimated_total_time = elapsed_time + time_to_completion
+    if diff <= 0 or not total:
+        return
+    percentage = current * 100 / total
+    speed = current / diff
+    elapsed_time = round(diff) * 1000
+    time_to_completion = round((total - current) / speed) * 1000 if speed else 0
+    estimated_total_time = elapsed_time + time_to_completion
 
-        elapsed_time_str = TimeFormatter(elapsed_time)
-        estimated_total_time_str = TimeFormatter(estimated_total_time)
+    estimated_total_time_str = TimeFormatter(estimated_total_time)
 
-        current_message = f"{ud_type}\n" \
-                          f"**حجم:** {humanbytes(current)} از {humanbytes(total)}\n" \
-                          f"**پیشرفت:** {percentage:.2f}%\n" \
-                          f"**سرعت:** {humanbytes(speed)}/s\n" \
-                          f"**ETA:** {estimated_total_time_str}"
+    current_message = f"{ud_type}\n" \
+                      f"**حجم:** {humanbytes(current)} از {humanbytes(total)}\n" \
+                      f"**پیشرفت:** {percentage:.2f}%\n" \
+                      f"**سرعت:** {humanbytes(speed)}/s\n" \
+                      f"**ETA:** {estimated_total_time_str}"
 
-        try:
-            await message.edit_text(current_message)
-        except MessageNotModified:
-            pass
-        except FloodWait as e:
-            logger.warning(f"FloodWait encountered while updating progress: {e.value} seconds. Waiting...")
-            await asyncio.sleep(e.value)
-        except RPCError as e:
-            logger.error(f"Pyrogram RPCError during progress update: {e}")
-        except Exception as e:
-            logger.warning(f"General error updating progress message: {e}")
+    # The dispatcher keeps only the latest text and rate-limits the actual edits
+    get_progress_dispatcher(message._client, message.chat.id, message.id).update(current_message)
 
 def humanbytes(size):
     if not size:
@@ -106,78 +149,86 @@ class Button(object):
                                             InlineKeyboardButton(text="🔍 ꜱᴇᴀʀᴄʜ", switch_inline_query_current_chat="4 ") ],
                                           [ InlineKeyboardButton(text="❌", callback_data="X0") ] ] )
 
+# Flat extraction: playlists come back with lightweight entries (at most one batch worth)
+# that are extracted one by one only when batch mode reaches them
+PICKER_YDL_OPTS = {
+    'format': 'bestvideo+bestaudio/best',
+    'cachedir': False,
+    'dump_single_json': True,
+    'extract_flat': True,
+    'force_empty_metadata': True,
+    'no_warnings': True,
+    'noplaylist': True,
+    'playlistend': Config.TECH_VJ_BATCH_MAX_ENTRIES,
+    'socket_timeout': Config.TECH_VJ_SOCKET_TIMEOUT,
+}
+
+# Shared by every download so the pooled YoutubeDL instances can be reused across jobs;
+# format, paths and merge_output_format are set per job
+DOWNLOAD_YDL_OPTS = {
+    'outtmpl': '%(title)s.%(ext)s',
+    'cachedir': False,
+    'noplaylist': True,
+    'prefer_ffmpeg': True,
+    'socket_timeout': Config.TECH_VJ_SOCKET_TIMEOUT,
+}
+
+async def extract_media_info(url):
+    async def extract(link):
+        with stage_seconds.time(stage="extraction"):
+            result = await ydl_executor.run(link, PICKER_YDL_OPTS)
+        entries = result.get('entries')
+        if entries and len(entries) == 1:
+            result = entries[0]
+        return result
+
+    return await info_cache.get_or_extract(url, extract)
+
 # --- Handler for URL messages ---
 @Client.on_message(filters.regex(r"^(http|https)://[^\s/$.?#].[^\s]*$") & filters.private)
 async def process_url_for_qualities(bot: Client, message: Message):
     url = message.text
     sent_message = await message.reply_text("در حال دریافت کیفیت‌های موجود، لطفاً صبر کنید...", quote=True)
     try:
-        ydl_opts = {
-            'format': 'bestvideo+bestaudio/best',
-            'cachedir': False,
-            'dump_single_json': True,
-            'extract_flat': True,
-            'force_empty_metadata': True,
-            'no_warnings': True,
-            'noplaylist': True,
-            'logger': logger
-        }
-        
-        info_dict = await asyncio.to_thread(lambda: youtube_dl.YoutubeDL(ydl_opts).extract_info(url, download=False))
+        info_dict = await extract_media_info(url)
 
-        if 'entries' in info_dict and info_dict['entries']:
-            info_dict = info_dict['entries'][0]
+        if info_dict.get('_type') == 'playlist':
+            entries = [
+                (entry.get('title') or entry.get('url'), entry.get('webpage_url') or entry.get('url'))
+                for entry in info_dict.get('entries') or []
+            ]
+            await run_batch(bot, message, sent_message, [(title, link) for title, link in entries if link and link.startswith('http')])
+            return
 
         formats = info_dict.get('formats', [])
         if not formats:
             await sent_message.edit_text("فرمت قابل دانلودی برای این URL یافت نشد.")
             return
         
-        temp_key = f"{message.chat.id}_{message.id}"
-        temp_url_storage[temp_key] = url
-        logger.info(f"Stored URL {url} with key {temp_key}")
-
-        available_qualities = {}
-        for f in formats:
-            format_id = f.get('format_id')
-            ext = f.get('ext')
-            height = f.get('height')
-            fps = f.get('fps')
-            filesize = f.get('filesize') or f.get('filesize_approx')
-            vcodec = f.get('vcodec')
-            acodec = f.get('acodec')
-
-            if (vcodec != 'none' and acodec != 'none' and height) and ext in ['mp4', 'mkv', 'webm']:
-                quality_label = f"{height}p"
-                if fps:
-                    quality_label += f"@{int(fps)}fps"
-                quality_label += f" ({ext})"
-                if filesize:
-                    quality_label += f" [{humanbytes(filesize)}]"
-                else:
-                    quality_label += " [اندازه نامشخص]"
-
-                callback_data = f"dl_q={format_id}={ext}={temp_key}"
-                
-                if len(callback_data.encode('utf-8')) > 64:
-                    logger.warning(f"Callback data too long ({len(callback_data.encode('utf-8'))} bytes) for format {format_id}. Skipping.")
-                    continue
-
-                available_qualities[quality_label] = callback_data
-
-        if not available_qualities:
+        options = build_format_options(info_dict)
+        if not options:
             await sent_message.edit_text("فرمت‌های ویدیویی مناسب برای این URL یافت نشد.")
             return
+        for option in options:
+            option["label"] = format_option_label(option)
+
+        # Fast path: a known preference picks the format, the download starts on the extraction just done
+        preference = get_preference_store().get(message.from_user.id) if Config.TECH_VJ_FAST_PATH else None
+        option = pick_preferred_option(options, preference, max_output_size()) if preference else None
+        if option is not None:
+            await run_fast_path(bot, message, sent_message, url, option, preference)
+            return
 
-        buttons = []
-        for quality_label, callback_data in available_qualities.items():
-            buttons.append([InlineKeyboardButton(text=quality_label, callback_data=callback_data)])
+        # The full list is stored once; each button only carries the session key and an index
+        temp_key = f"{message.chat.id}_{message.id}"
+        temp_url_storage.put(temp_key, {"url": url, "options": options}, user_id=message.from_user.id)
+        logger.info(f"Stored {len(options)} formats of {url} with key {temp_key} (info cache: {info_cache.stats()})")
 
-        reply_markup = InlineKeyboardMarkup(buttons)
         await sent_message.edit_text(
             "کیفیت مورد نظر را انتخاب کنید:",
-            reply_markup=reply_markup
+            reply_markup=build_picker_keyboard(temp_key, options, 0, Config.TECH_VJ_PICKER_PAGE_SIZE)
         )
+        start_speculative_download(message.from_user.id, temp_key, url, options)
 
     except youtube_dl.utils.DownloadError as e:
         logger.error(f"YoutubeDL Error processing URL {url}: {e}")
@@ -186,25 +237,251 @@ async def process_url_for_qualities(bot: Client, message: Message):
         logger.error(f"General error processing URL {url}: {e}", exc_info=True)
         await sent_message.edit_text(f"هنگام پردازش لینک شما خطایی رخ داد: {e}")
 
+async def run_fast_path(bot: Client, message: Message, status_message: Message, url, option, preference):
+    logger.info(f"Fast path for {url}: format {option['format']} by preference {preference} of user {message.from_user.id}")
+    try:
+        await status_message.edit_text(Translation.TECH_VJ_FAST_PATH_START.format(
+            label=option["label"], preference=describe_preference(preference)))
+    except RPCError:
+        pass
+    description = await get_upload_caption(bot)
+    await process_job(bot, RemoteJobUpdate(message.from_user.id, status_message), url, option["format"],
+                      option["ext"], description)
+
+# While the picker is shown, download the option the user most likely picks: their usual
+# choice, otherwise what batch mode would take. Standalone only, jobs of the other modes
+# run in worker processes that could not use the files.
+def start_speculative_download(user_id, temp_key, url, options):
+    if not Config.TECH_VJ_SPECULATIVE_DOWNLOAD or Config.TECH_VJ_RUN_MODE != "standalone":
+        return
+    preference = get_preference_store().usual_pick(user_id) or {
+        "kind": "video", "max_height": Config.TECH_VJ_BATCH_MAX_HEIGHT, "ext": None, "order": "best"
+    }
+    option = pick_preferred_option([o for o in options if o["size"]], preference, Config.TECH_VJ_SPECULATIVE_MAX_SIZE)
+    if option is None:
+        return
+
+    async def download(directory, progress_hook):
+        return await download_format(url, option["format"], option["ext"], directory, progress_hook,
+                                     Config.TECH_VJ_SPECULATIVE_MAX_SIZE)
+
+    prefetcher.start(temp_key, user_id, options.index(option), option["size"], download)
+
+# --- Handler for the /quality command (preferred quality of the fast path) ---
+@Client.on_message(filters.command("quality") & filters.private)
+async def quality_command(bot: Client, message: Message):
+    store = get_preference_store()
+    user_id = message.from_user.id
+    argument = message.text.split(maxsplit=1)[1].strip().lower() if len(message.text.split(maxsplit=1)) > 1 else ""
+    if not argument:
+        preference = store.get(user_id)
+        text = Translation.TECH_VJ_QUALITY_CURRENT.format(preference=describe_preference(preference)) \
+            if preference else Translation.TECH_VJ_QUALITY_NONE
+        text += "\n\n" + Translation.TECH_VJ_QUALITY_HELP
+    elif argument == "off":
+        store.set(user_id, None, enabled=False)
+        text = Translation.TECH_VJ_QUALITY_OFF
+    elif argument == "auto":
+        store.set(user_id, None)
+        text = Translation.TECH_VJ_QUALITY_AUTO
+    else:
+        try:
+            preference = parse_preference(argument)
+        except ValueError as e:
+            text = Translation.TECH_VJ_QUALITY_INVALID.format(word=e) + "\n\n" + Translation.TECH_VJ_QUALITY_HELP
+        else:
+            store.set(user_id, preference)
+            text = Translation.TECH_VJ_QUALITY_SET.format(preference=describe_preference(preference))
+    await message.reply_text(text, quote=True)
+
+# --- Handler for messages with several URLs ---
+@Client.on_message(filters.regex(r"https?://\S+\s+https?://") & filters.private)
+async def process_batch_urls(bot: Client, message: Message):
+    urls = extract_urls(message.text)[:Config.TECH_VJ_BATCH_MAX_ENTRIES]
+    status_message = await message.reply_text(Translation.TECH_VJ_BATCH_START, quote=True)
+    await run_batch(bot, message, status_message, [(url, url) for url in urls])
+
+# Batch mode: entries are extracted lazily, just ahead of the workers, delivered at the batch
+# quality with bounded concurrency, and reported together in one status message.
+async def run_batch(bot: Client, message: Message, status_message: Message, entries):
+    batch = BatchProgress(bot, message.chat.id, status_message.id, message)
+    for index, (title, _) in enumerate(entries):
+        batch.add(index, title)
+    description = await get_upload_caption(bot)
+    control = JobControl(message.from_user.id, 0, 0)
+    set_progress_markup(message.chat.id, status_message.id, cancel_markup(control.job_id))
+
+    async def resolve():
+        for index, (_, url) in enumerate(entries):
+            option = None
+            try:
+                info_dict = await extract_media_info(url)
+                if info_dict.get('_type') != 'playlist':
+                    batch.add(index, info_dict.get('title') or url)
+                    option = pick_batch_option(build_format_options(info_dict), Config.TECH_VJ_BATCH_MAX_HEIGHT,
+                                               Config.TECH_VJ_TG_MAX_FILE_SIZE)
+            except Exception as e:
+                logger.warning(f"Batch entry {url} could not be extracted: {e}")
+            if option is None:
+                batch.finish(index, ok=False)
+                continue
+            yield index, url, option
+
+    async def process(item):
+        index, url, option = item
+        update = batch.entry(index)
+        ok = False
+        try:
+            ok = await process_job(bot, update, url, option["format"], option["ext"], description)
+        except Exception as e:
+            logger.error(f"Batch entry {url} failed: {e}", exc_info=True)
+        finally:
+            batch.finish(index, ok, update.message)
+
+    template = Translation.TECH_VJ_BATCH_DONE
+    try:
+        await control.run(run_pipeline(resolve(), process, Config.TECH_VJ_BATCH_CONCURRENCY))
+    except JobCancelled:
+        template = Translation.TECH_VJ_BATCH_CANCELLED
+    finally:
+        set_progress_markup(message.chat.id, status_message.id, None)
+        await batch.close(template)
+    logger.info(f"Batch of {batch.total} entries for user {message.from_user.id}: "
+                f"{batch.done} sent, {len(batch.failed)} failed")
+
+def format_option_label(option):
+    if option["kind"] == "audio":
+        label = f"🎵 صوتی ({option['ext']})"
+    else:
+        label = f"{option['height']}p" if option["height"] else "ویدیو"
+        if option["fps"]:
+            label += f"@{option['fps']}fps"
+        label += f" ({option['ext']})"
+    if option["size"]:
+        label += f" [{humanbytes(option['size'])}]"
+    else:
+        label += " [اندازه نامشخص]"
+    return label
+
+# --- Handler for the page buttons of the quality picker ---
+@Client.on_callback_query(filters.regex(r"^pg="))
+async def picker_page_call_back(bot: Client, update: CallbackQuery):
+    _, temp_key, page = update.data.split("=", 2)
+    entry = temp_url_storage.get(temp_key)
+    if not entry:
+        await update.answer("این فهرست منقضی شده است. لطفاً لینک را دوباره ارسال کنید.", show_alert=True)
+        return
+    try:
+        await update.message.edit_reply_markup(
+            build_picker_keyboard(temp_key, entry["options"], int(page), Config.TECH_VJ_PICKER_PAGE_SIZE)
+        )
+    except MessageNotModified:
+        pass
+    await update.answer()
+
+# Download using the info dict cached when the URL was extracted (for the picker or the
+# fast path), so the second extraction is skipped
+async def download_with_cached_info(url, ydl_opts, progress_hook=None, max_bytes=None, throttle=None):
+    cached_info = info_cache.get_copy(url)
+    if cached_info is not None:
+        try:
+            return await ydl_executor.run(url, ydl_opts, download=True, info_dict=cached_info,
+                                          progress_hook=progress_hook, max_bytes=max_bytes, throttle=throttle)
+        except DownloadTooLarge:
+            raise
+        except youtube_dl.utils.DownloadError as e:
+            # Format URLs may have expired, retry once with a fresh extraction
+            logger.warning(f"Download from cached info failed for {url}, re-extracting: {e}")
+            info_cache.invalidate(url)
+    return await ydl_executor.run(url, ydl_opts, download=True, progress_hook=progress_hook, max_bytes=max_bytes,
+                                  throttle=throttle)
+
+# Plain HTTP(S) formats are fetched by the native segmented downloader (parallel range
+# requests); returns (None, None) when the format or server does not allow it.
+async def download_direct_http(url, format_id, directory, progress_hook, max_bytes=None):
+    info_dict = info_cache.get(url)
+    fmt = find_direct_http_format(info_dict, format_id) if Config.TECH_VJ_SEGMENTED_DOWNLOAD else None
+    if fmt is None:
+        return None, None
+    # The format's fields are written into a copy
+    info_dict = info_cache.get_copy(url)
+    info_dict.update({k: fmt[k] for k in ('format_id', 'ext', 'width', 'height', 'vcodec', 'acodec', 'filesize') if k in fmt})
+    file_name = youtube_dl.utils.sanitize_filename(f"{info_dict.get('title') or 'video'}.{fmt.get('ext') or 'mp4'}")
+    downloader = SegmentedDownloader(
+        fmt['url'], fmt.get('http_headers'), os.path.join(directory, file_name),
+        Config.TECH_VJ_SEGMENTED_CONNECTIONS, progress_hook=progress_hook, max_bytes=max_bytes
+    )
+    try:
+        file_path = await downloader.download()
+    except DownloadTooLarge:
+        raise
+    except Exception as e:
+        logger.warning(f"Segmented download failed for {url}, falling back to yt-dlp: {e}")
+        return None, None
+    return info_dict, file_path
+
+# Download one format into `directory`: natively when it is a plain HTTP file, otherwise
+# with yt-dlp. Returns (info_dict, file path).
+async def download_format(url, youtube_dl_format, youtube_dl_ext, directory, progress_hook, max_bytes):
+    with bandwidth.active(DOWNLOAD_DIRECTION) as user_id:
+        info_dict, file_path = await download_direct_http(url, youtube_dl_format, directory, progress_hook, max_bytes=max_bytes)
+        if file_path is None:
+            # yt-dlp (maybe in another process) cannot wait on the buckets itself: its progress
+            # is charged to them here and it pauses for as long as they say, so the caps and
+            # shares hold while other users start and stop
+            ydl_opts = dict(DOWNLOAD_YDL_OPTS, format=youtube_dl_format, paths={'home': directory})
+            if '+' in youtube_dl_format:
+                # Merge straight into the container the picker promised
+                ydl_opts['merge_output_format'] = youtube_dl_ext
+            info_dict = await download_with_cached_info(
+                url, ydl_opts, progress_hook=progress_hook, max_bytes=max_bytes,
+                throttle=lambda nbytes: bandwidth.reserve(DOWNLOAD_DIRECTION, nbytes, user_id))
+            file_path = get_downloaded_path(info_dict)
+    return info_dict, file_path
+
+# Path of the file yt-dlp actually wrote (merged formats may change the extension)
+def get_downloaded_path(info_dict):
+    for download in info_dict.get('requested_downloads') or []:
+        if download.get('filepath'):
+            return download['filepath']
+    return info_dict.get('filepath') or info_dict.get('_filename')
+
 # --- Handler for quality selection Callback Queries ---
-@Client.on_callback_query(filters.regex(r"^dl_q="))
+@Client.on_callback_query(filters.regex(r"^dl="))
 async def ddl_call_back(bot: Client, update: CallbackQuery):
     logger.info(f"Callback received: {update.data} from user {update.from_user.id}")
     cb_data = update.data
 
     try:
-        _, youtube_dl_format, youtube_dl_ext, temp_key = cb_data.split("=", 3)
+        _, temp_key, index = cb_data.split("=", 2)
+        index = int(index)
     except ValueError as e:
         logger.error(f"Error parsing callback data: {cb_data} - {e}", exc_info=True)
         await update.message.edit_text("خطا در پردازش اطلاعات دکمه. لطفاً دوباره امتحان کنید.")
         return
 
-    youtube_dl_url = temp_url_storage.get(temp_key)
-    if not youtube_dl_url:
+    entry = temp_url_storage.get(temp_key)
+    if not entry or index >= len(entry["options"]):
         await update.message.edit_text("خطا: لینک اصلی پیدا نشد یا منقضی شده است. لطفاً دوباره امتحان کنید یا لینک جدیدی ارسال کنید.")
-        logger.warning(f"URL not found in temp_url_storage for key: {temp_key}. Bot might have restarted or key expired.")
+        logger.warning(f"URL not found in temp_url_storage for key: {temp_key}. Key expired or was evicted. Store stats: {temp_url_storage.stats()}")
         return
-    
+    youtube_dl_url = entry["url"]
+    youtube_dl_format = entry["options"][index]["format"]
+    youtube_dl_ext = entry["options"][index]["ext"]
+    if Config.TECH_VJ_FAST_PATH or Config.TECH_VJ_SPECULATIVE_DOWNLOAD:
+        # Learns the user's usual quality for the fast path and the next speculative download
+        get_preference_store().record_pick(update.from_user.id, entry["options"][index])
+    # A speculative download of another option is cancelled here
+    prefetch = prefetcher.claim(temp_key, index)
+
+    description = await get_upload_caption(bot)
+    try:
+        await process_job(bot, update, youtube_dl_url, youtube_dl_format, youtube_dl_ext, description, prefetch=prefetch)
+    finally:
+        if prefetch is not None:
+            prefetch.discard()
+
+async def get_upload_caption(bot: Client):
     user = await bot.get_me()
     if user and user.mention:
         mention = user.mention
@@ -214,13 +491,406 @@ async def ddl_call_back(bot: Client, update: CallbackQuery):
         mention = "ربات"
         logger.warning("Could not get bot's mention or first name. Using generic 'ربات'.")
 
-    description = Translation.TECH_VJ_CUSTOM_CAPTION_UL_FILE.format(mention=mention)
+    return Translation.TECH_VJ_CUSTOM_CAPTION_UL_FILE.format(mention=mention)
+
+# Deliver one format of one URL: from the file_id index if possible, otherwise through
+# admission control, the job queue and the streaming or download pipeline.
+# Returns True when the file was sent. `job_id` is the durable queue id of a job run by a worker,
+# `resume` the journal entry of an interrupted job to continue, `prefetch` a speculative
+# download of this format to take over, `media_key` the file_index key the dispatcher
+# computed (a worker's info cache is empty, so it could only key the job by URL).
+async def process_job(bot: Client, update: CallbackQuery, youtube_dl_url, youtube_dl_format, youtube_dl_ext, description, job_id=None, resume=None, prefetch=None, media_key=None):
+    async def report_queue_position(position):
+        try:
+            await update.message.edit_text(Translation.TECH_VJ_QUEUE_POSITION.format(position=position))
+        except MessageNotModified:
+            pass
+
+    cached_info = info_cache.get(youtube_dl_url)
+    media_key = media_key or make_media_key(cached_info, youtube_dl_url, youtube_dl_format, youtube_dl_ext)
+    if await send_from_file_index(bot, update, media_key, description):
+        return True
+
+    # Admission control: reject files that cannot be sent before downloading a single byte
+    estimated_size = await estimate_download_size(cached_info, youtube_dl_format)
+    if estimated_size and estimated_size > max_output_size():
+        logger.info(f"Rejected {youtube_dl_url} (format {youtube_dl_format}): estimated {estimated_size} bytes")
+        jobs_total.inc(outcome="rejected")
+        await update.message.edit_text(Translation.TECH_VJ_RCHD_TG_API_LIMIT)
+        return False
+    disk_reservation = estimated_size or Config.TECH_VJ_UNKNOWN_SIZE_RESERVATION
+    if '+' in youtube_dl_format or (cached_info and cached_info.get('ext') != youtube_dl_ext):
+        # Merging or remuxing keeps the input and output on disk at the same time
+        disk_reservation *= 2
+    if estimated_size and estimated_size > Config.TECH_VJ_TG_MAX_FILE_SIZE:
+        # Split parts sit next to the full file until they are uploaded
+        disk_reservation *= 2
+    disk_reservation = min(disk_reservation, disk_budget.capacity())
+
+    async def report_disk_wait():
+        try:
+            await update.message.edit_text(Translation.TECH_VJ_WAITING_FOR_DISK)
+        except RPCError:
+            pass
+
+    async def run_job(control, journaled):
+        sent_message = None
+        if journaled.workspace_id is None and prefetch is None:
+            # A resumed or prefetched job with files on disk goes on from them instead of streaming from scratch
+            sent_message = await run_streaming_job(bot, update, control, youtube_dl_url, youtube_dl_format, youtube_dl_ext, description)
+        if sent_message is None:
+            # The workspace is removed when the job ends: success, error, cancellation by the
+            # user or a deadline. A shutdown leaves it (and the journal entry) for the next start.
+            async with disk_budget.reservation(disk_reservation, on_wait=report_disk_wait) as reservation, \
+                    janitor.job_workspace(update.from_user.id, journaled.workspace_id) as workspace:
+                journaled.set_workspace(workspace.job_id)
+                try:
+                    sent_message = await run_download_job(bot, update, workspace, control, youtube_dl_url, youtube_dl_format, youtube_dl_ext, description, journaled, prefetch, reservation)
+                except asyncio.CancelledError:
+                    # Cancelled without a reason of the job's own: the process is shutting down
+                    workspace.keep = journaled.journal is not None and control.reason is None
+                    raise
+        return sent_message
 
+    async def deliver():
+        if Config.TECH_VJ_RUN_MODE == "dispatcher":
+            # Download and upload happen in a worker process
+            return await submit_to_workers(update, youtube_dl_url, youtube_dl_format, youtube_dl_ext, description, media_key)
+        journaled = journal_job(update, youtube_dl_url, youtube_dl_format, youtube_dl_ext, description, job_id, resume)
+        try:
+            delivered = await deliver_journaled(journaled)
+        except asyncio.CancelledError:
+            # Shutting down: the journal entry stays so that the job resumes on the next start
+            raise
+        except Exception:
+            journaled.close()
+            raise
+        journaled.close()
+        return delivered
+
+    async def deliver_journaled(journaled):
+        async with job_scheduler.admit(update.from_user.id, on_position=report_queue_position,
+                                       expected_size=estimated_size or Config.TECH_VJ_UNKNOWN_SIZE_RESERVATION):
+            # Downloads and uploads of this job count against the user's bandwidth share
+            transfer_user.set(update.from_user.id)
+            control = create_job_control(update.from_user.id, job_id)
+            set_progress_markup(update.message.chat.id, update.message.id, cancel_markup(control.job_id))
+            try:
+                sent_message = await control.run(run_job(control, journaled))
+            except JobCancelled as e:
+                logger.warning(f"Job for {youtube_dl_url} (format {youtube_dl_format}) stopped: {e}")
+                jobs_total.inc(outcome=f"cancelled_{e.reason}")
+                await report_cancelled(update, e)
+                return False
+            finally:
+                set_progress_markup(update.message.chat.id, update.message.id, None)
+        if sent_message is None:
+            jobs_total.inc(outcome="failed")
+            return False
+        jobs_total.inc(outcome="sent")
+        if isinstance(sent_message, list):
+            # A split upload has one file_id per part; the index can only replay single files
+            return True
+        file_index.remember(media_key, sent_message)
+        return True
+
+    if file_index.is_inflight(media_key):
+        try:
+            await update.message.edit_text(Translation.TECH_VJ_WAITING_FOR_IDENTICAL_JOB)
+        except RPCError:
+            pass
+    delivered = False
+
+    async def deliver_once():
+        nonlocal delivered
+        delivered = await deliver()
+
+    if await file_index.single_flight(media_key, deliver_once):
+        return delivered
+    # An identical job was already running; reuse its upload, or run our own if it failed
+    if await send_from_file_index(bot, update, media_key, description):
+        return True
+    return await deliver()
+
+# Journal handle of one delivery. Batch entries have no picker message of their own to
+# report a resumed job in, so they are not journaled.
+def journal_job(update, youtube_dl_url, youtube_dl_format, youtube_dl_ext, description, job_id=None, resume=None):
+    if resume is not None:
+        return JournaledJob(get_job_journal(), resume.journal_id, resume)
+    if not Config.TECH_VJ_JOB_JOURNAL or update.message.id < 0:
+        return JournaledJob(None, None)
+    journal_id = get_job_journal().record({
+        "chat_id": update.message.chat.id,
+        "message_id": update.message.id,
+        "reply_to_message_id": update.message.reply_to_message.id,
+        "user_id": update.from_user.id,
+        "url": youtube_dl_url,
+        "format": youtube_dl_format,
+        "ext": youtube_dl_ext,
+        "description": description,
+    }, queue_job_id=job_id)
+    return JournaledJob(get_job_journal(), journal_id)
+
+def cancel_markup(job_id):
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton(text=Translation.TECH_VJ_CANCEL_BUTTON, callback_data=f"cancel={job_id}")
+    ]])
+
+# Dispatcher mode: hand the job to the worker processes through the durable queue and
+# wait for its outcome (the worker edits the message itself). Returns True when sent.
+async def submit_to_workers(update: CallbackQuery, youtube_dl_url, youtube_dl_format, youtube_dl_ext, description, media_key):
+    queue = get_durable_queue()
+    job_id = await asyncio.to_thread(queue.enqueue, {
+        "chat_id": update.message.chat.id,
+        "message_id": update.message.id,
+        "reply_to_message_id": update.message.reply_to_message.id,
+        "user_id": update.from_user.id,
+        "url": youtube_dl_url,
+        "format": youtube_dl_format,
+        "ext": youtube_dl_ext,
+        "description": description,
+        "media_key": list(media_key),
+    }, user_id=update.from_user.id)
+    logger.info(f"Queued job {job_id} for {youtube_dl_url} (format {youtube_dl_format}) for the workers")
+    try:
+        await update.message.edit_text(Translation.TECH_VJ_JOB_QUEUED_FOR_WORKER, reply_markup=cancel_markup(job_id))
+    except RPCError:
+        pass
+
+    try:
+        # Batch entries have no message of their own, their status comes back through the queue
+        status, error = await wait_for_job(queue, job_id, Config.TECH_VJ_WORKER_POLL_INTERVAL,
+                                           on_progress=update.message.edit_text)
+    except asyncio.CancelledError:
+        # e.g. a cancelled batch: stop the job in whichever worker runs it
+        await asyncio.shield(asyncio.to_thread(queue.request_cancel, job_id, update.from_user.id))
+        raise
+
+    if status == CANCELLED:
+        # Cancelled before any worker picked it up, so no worker reports it
+        text = Translation.TECH_VJ_JOB_CANCELLED
+    elif status == FAILED and error == ERROR_LOST:
+        text = Translation.TECH_VJ_JOB_LOST
+    else:
+        return status == DONE
+    try:
+        await update.message.edit_text(text)
+    except RPCError:
+        pass
+    return False
+
+async def report_cancelled(update: CallbackQuery, error: JobCancelled):
+    if error.reason == CANCEL_USER:
+        text = Translation.TECH_VJ_JOB_CANCELLED
+    elif error.reason == CANCEL_STALL:
+        text = Translation.TECH_VJ_SLOW_URL_DECED
+    elif error.reason == CANCEL_DISK:
+        text = Translation.TECH_VJ_DISK_FULL
+    else:
+        text = Translation.TECH_VJ_JOB_TIMED_OUT
+    try:
+        await update.message.edit_text(text)
+    except RPCError as e:
+        logger.warning(f"Could not report cancelled job: {e}")
+
+# --- Handler for the cancel button of a running job ---
+@Client.on_callback_query(filters.regex(r"^cancel="))
+async def cancel_call_back(bot: Client, update: CallbackQuery):
+    job_id = update.data.split("=", 1)[1]
+    control = get_job(job_id)
+    if control is None and Config.TECH_VJ_RUN_MODE == "dispatcher":
+        # The job runs in a worker; it picks the request up with its next heartbeat
+        try:
+            status = await asyncio.to_thread(get_durable_queue().request_cancel, job_id, update.from_user.id)
+        except PermissionError:
+            await update.answer(Translation.TECH_VJ_CANCEL_NOT_ALLOWED, show_alert=True)
+            return
+        found = status in (QUEUED, LEASED, CANCELLED)
+        await update.answer(Translation.TECH_VJ_CANCEL_REQUESTED if found else Translation.TECH_VJ_CANCEL_NOT_FOUND)
+        return
+    if control is None:
+        await update.answer(Translation.TECH_VJ_CANCEL_NOT_FOUND)
+        return
+    if control.user_id != update.from_user.id:
+        await update.answer(Translation.TECH_VJ_CANCEL_NOT_ALLOWED, show_alert=True)
+        return
+    control.cancel(CANCEL_USER)
+    await update.answer(Translation.TECH_VJ_CANCEL_REQUESTED)
+
+# Worker mode: run one job of the durable queue through the normal pipeline
+async def run_queued_job(bot: Client, job):
+    payload = job.payload
+    message = RemoteJobMessage(bot, payload["chat_id"], payload["message_id"], payload["reply_to_message_id"],
+                               job_id=job.job_id)
+    update = RemoteJobUpdate(payload["user_id"], message)
+    # A job whose previous worker died goes on from that worker's files
+    resume = get_job_journal().take_over(queue_job_id=job.job_id) if Config.TECH_VJ_JOB_JOURNAL else None
+    if resume is not None:
+        logger.info(f"Queued job {job.job_id} resumes at {resume.stage} (attempt {resume.attempts})")
+        await report_resumed(update)
+    try:
+        media_key = tuple(payload["media_key"]) if payload.get("media_key") else None
+        delivered = await process_job(bot, update, payload["url"], payload["format"], payload["ext"],
+                                      payload["description"], job_id=job.job_id, resume=resume, media_key=media_key)
+    finally:
+        message.detach()
+    if resume is not None:
+        get_job_journal().remove(resume.journal_id)
+    return delivered
+
+async def report_resumed(update):
+    try:
+        await update.message.edit_text(Translation.TECH_VJ_JOB_RESUMED)
+    except RPCError as e:
+        logger.warning(f"Could not report resumed job: {e}")
+
+# Standalone mode: continue a job that was running when the bot stopped
+async def resume_job(bot: Client, entry):
+    payload = entry.payload
+    message = RemoteJobMessage(bot, payload["chat_id"], payload["message_id"], payload["reply_to_message_id"])
+    update = RemoteJobUpdate(payload["user_id"], message)
+    await report_resumed(update)
+    try:
+        # Fresh format URLs (the old ones have usually expired), and the segmented
+        # downloader needs the info dict to continue its partial file
+        await extract_media_info(payload["url"])
+    except Exception as e:
+        logger.warning(f"Re-extracting {payload['url']} for a resumed job failed: {e}")
+    try:
+        await process_job(bot, update, payload["url"], payload["format"], payload["ext"],
+                          payload["description"], resume=entry)
+    except Exception as e:
+        logger.error(f"Resumed job {entry.journal_id} failed: {e}", exc_info=True)
+    # Also ends entries that never reached the pipeline (e.g. answered from the file index)
+    get_job_journal().remove(entry.journal_id)
+
+# Sorts the journal out at startup, before the janitor sweeps: returns the entries this
+# process resumes. Workspaces of queued jobs whose worker died are kept for the worker
+# that claims the job again; everything else is dropped and swept.
+async def recover_interrupted_jobs(bot: Client, run_mode):
+    if not Config.TECH_VJ_JOB_JOURNAL:
+        return []
+    journal = get_job_journal()
+    retained = []
+    resumable = []
+    for entry, queue_job_id in journal.interrupted():
+        if queue_job_id is not None:
+            row = await asyncio.to_thread(get_durable_queue().status, queue_job_id)
+            if row is not None and row[0] not in FINISHED:
+                retained.append(entry.workspace_id)
+                continue
+            # The queue gave up on it (or it ended) and has reported that already
+            journal.remove(entry.journal_id)
+            continue
+        if run_mode == "standalone" and entry.attempts < Config.TECH_VJ_JOB_RESUME_MAX_ATTEMPTS:
+            entry = journal.take_over(journal_id=entry.journal_id)
+            if entry is not None:
+                retained.append(entry.workspace_id)
+                resumable.append(entry)
+            continue
+        logger.warning(f"Giving up on journaled job {entry.journal_id} ({entry.payload['url']}) "
+                       f"after {entry.attempts} resumes in {run_mode} mode")
+        journal.remove(entry.journal_id)
+        try:
+            await bot.edit_message_text(entry.payload["chat_id"], entry.payload["message_id"], Translation.TECH_VJ_JOB_LOST)
+        except RPCError:
+            pass
+    janitor.retain(w for w in retained if w)
+    return resumable
+
+def cancel_queued_job(job_id):
+    control = get_job(job_id)
+    if control is not None:
+        control.cancel(CANCEL_USER)
+
+# Answer instantly by re-sending a file_id uploaded earlier for the same media
+async def send_from_file_index(bot: Client, update: CallbackQuery, media_key, description):
+    cached = file_index.get(media_key)
+    if cached is None:
+        return False
+    media_type, file_id = cached
+    try:
+        await bot.send_cached_media(
+            chat_id=update.message.chat.id,
+            file_id=file_id,
+            caption=None if media_type == "video_note" else description,
+            reply_to_message_id=update.message.reply_to_message.id
+        )
+    except RPCError as e:
+        logger.warning(f"Cached file_id for {media_key} is no longer valid: {e}")
+        file_index.forget(media_key)
+        return False
+    logger.info(f"Served {media_key} from the file_id index ({file_index.stats()})")
+    jobs_total.inc(outcome="indexed")
+    await update.message.edit_text(Translation.TECH_VJ_SENT_FROM_FILE_INDEX)
+    return True
+
+# Streaming mode: formats that need no remux are piped from the source straight into
+# Telegram, so download and upload overlap and only a few parts are buffered.
+async def run_streaming_job(bot: Client, update: CallbackQuery, control, youtube_dl_url, youtube_dl_format, youtube_dl_ext, description):
+    if not Config.TECH_VJ_STREAMING_UPLOAD:
+        return None
+    info_dict = info_cache.get(youtube_dl_url)
+    fmt = find_streamable_format(info_dict, youtube_dl_format, youtube_dl_ext)
+    if fmt is None:
+        return None
+
+    file_name = youtube_dl.utils.sanitize_filename(f"{info_dict.get('title') or 'video'}.{youtube_dl_ext}")
+    try:
+        thumb_image_path = await Gthumb01(bot, update)
+    except Exception as e:
+        logger.warning(f"Could not get custom thumbnail with Gthumb01: {e}")
+        thumb_image_path = None
+
+    async def upload_progress(current, total, *args):
+        control.report(current)
+        await progress_for_pyrogram(current, total, *args)
+
+    start_time = time.time()
+    try:
+        async with job_scheduler.stage("download"), job_scheduler.stage("upload"):
+            async with control.stage("upload", Config.TECH_VJ_UPLOAD_TIMEOUT, watch_stall=True):
+                with stage_seconds.time(stage="stream"):
+                    sent_message = await stream_url_to_telegram(
+                        bot, update.message.chat.id, fmt, info_dict, file_name, description,
+                        update.message.reply_to_message.id,
+                        thumb_path=thumb_image_path,
+                        progress=upload_progress,
+                        progress_args=(Translation.TECH_VJ_UPLOAD_START, update.message, start_time)
+                    )
+    except Exception as e:
+        logger.warning(f"Streaming upload failed for {youtube_dl_url}, falling back to a regular download: {e}")
+        return None
+    finally:
+        await close_progress_dispatcher(update.message.chat.id, update.message.id)
+    if sent_message is None:
+        return None
+    media_type, _ = get_media_file_id(sent_message)
+    streamed_bytes = getattr(getattr(sent_message, media_type, None), "file_size", None) or 0
+    transferred_bytes.inc(streamed_bytes, direction="download")
+    transferred_bytes.inc(streamed_bytes, direction="upload")
+
+    await update.message.edit_text(
+        text=Translation.TECH_VJ_AFTER_SUCCESSFUL_STREAM_MSG_WITH_TS.format(round(time.time() - start_time)),
+        disable_web_page_preview=True
+    )
+    return sent_message
+
+# Run one job through the download, postprocess and upload stages.
+# Each stage holds a worker of its own pool, so a slow upload never blocks a waiting download.
+# All files are written into `workspace`, which the janitor removes when the job ends.
+# `control` enforces the stage deadlines and stall detection and lets the user cancel.
+# `journaled` records the stage reached; a resumed job whose download had finished starts
+# at postprocess or upload, an unfinished download continues from its partial files.
+# A `prefetch` of the same format started while the picker was shown is taken over.
+# The download grows the job's disk `reservation` when it outruns the estimate, and the job
+# is cancelled when the disk cannot take more.
+async def run_download_job(bot: Client, update: CallbackQuery, workspace, control, youtube_dl_url, youtube_dl_format, youtube_dl_ext, description, journaled, prefetch=None, reservation=None):
     # Initialize start_time_download here, before passing to yt_dlp
     start_time_download = time.time() # Changed to time.time() for consistency with progress calculations
 
     try:
-        await update.message.edit_text(Translation.DOWNLOAD_START)
+        await update.message.edit_text(Translation.DOWNLOAD_START, reply_markup=cancel_markup(control.job_id))
     except MessageNotModified:
         pass
     except RPCError as e:
@@ -228,40 +898,71 @@ async def ddl_call_back(bot: Client, update: CallbackQuery):
         await bot.send_message(chat_id=update.message.chat.id, text=Translation.DOWNLOAD_START)
 
 
-    tmp_directory_for_each_user = os.path.join(Config.TECH_VJ_DOWNLOAD_LOCATION, str(update.from_user.id))
-    os.makedirs(tmp_directory_for_each_user, exist_ok=True)
+    download_progress = get_progress_dispatcher(bot, update.message.chat.id, update.message.id)
 
-    output_template = os.path.join(tmp_directory_for_each_user, '%(title)s.%(ext)s')
+    downloaded = {}  # file name -> bytes, a merged format downloads several files
 
-    loop = asyncio.get_running_loop()
+    # Called on the event loop for every progress event, whichever executor runs yt-dlp
+    def on_progress(d):
+        if reservation is not None and d.get('downloaded_bytes'):
+            downloaded[d.get('filename')] = d['downloaded_bytes']
+            if not reservation.cover(sum(downloaded.values())):
+                control.cancel(CANCEL_DISK)
+        control.report(d.get('downloaded_bytes'))
+        journaled.report(downloaded_bytes=d.get('downloaded_bytes'))
+        yt_dlp_progress_hook(d, download_progress, start_time_download)
 
-    ydl_opts_download = {
-        'format': youtube_dl_format,
-        'outtmpl': output_template,
-        'cachedir': False,
-        'noplaylist': True,
-        'logger': logger,
-        'progress_hooks': [
-            # Pass d, bot, chat_id, message_id, AND the fixed start_time_download
-            lambda d: loop.call_soon_threadsafe(
-                asyncio.create_task,
-                yt_dlp_progress_hook(d, bot, update.message.chat.id, update.message.id, start_time_download)
-            )
-        ],
-        'prefer_ffmpeg': True,
-        'postprocessors': [{
-            'key': 'FFmpegVideoConvertor',
-            'preferedformat': youtube_dl_ext,
-        }]
-    }
+    async def upload_progress(current, total, *args):
+        control.report(current)
+        await progress_for_pyrogram(current, total, *args)
 
     download_success = False
-    downloaded_file_path = None
+    downloaded_file_path = journaled.finished_file()
     try:
-        with youtube_dl.YoutubeDL(ydl_opts_download) as ydl:
-            info_dict = await asyncio.to_thread(lambda: ydl.extract_info(youtube_dl_url, download=True))
-            downloaded_file_path = await asyncio.to_thread(ydl.prepare_filename, info_dict)
-            download_success = True
+        if downloaded_file_path is not None:
+            logger.info(f"Resuming {youtube_dl_url} (format {youtube_dl_format}) at {journaled.stage} with {downloaded_file_path}")
+            # The cached extraction describes the whole entry, not the chosen format: only its
+            # thumbnail is kept, dimensions and duration are probed from the file itself
+            info_dict = {"thumbnail": (info_cache.get(youtube_dl_url) or {}).get("thumbnail")}
+            await download_progress.close()
+        else:
+            journaled.set_stage(DOWNLOAD)
+            async with job_scheduler.stage("download"):
+                try:
+                    async with control.stage("download", Config.TECH_VJ_DOWNLOAD_TIMEOUT, watch_stall=True):
+                        with stage_seconds.time(stage="download"):
+                            adopted = await prefetch.adopt(workspace.directory, on_progress) if prefetch else None
+                            if adopted is not None:
+                                info_dict, downloaded_file_path = adopted
+                                logger.info(f"Took over the speculative download of {youtube_dl_url} (format {youtube_dl_format})")
+                            else:
+                                info_dict, downloaded_file_path = await download_format(
+                                    youtube_dl_url, youtube_dl_format, youtube_dl_ext, workspace.directory, on_progress,
+                                    max_output_size()
+                                )
+                finally:
+                    await download_progress.close()
+            transferred_bytes.inc(os.path.getsize(downloaded_file_path), direction="download")
+
+        if not downloaded_file_path.lower().endswith(f".{youtube_dl_ext.lower()}"):
+            journaled.set_stage(POSTPROCESS, downloaded_file_path)
+            async with job_scheduler.stage("postprocess"):
+                try:
+                    await update.message.edit_text(Translation.TECH_VJ_POSTPROCESS_START, reply_markup=cancel_markup(control.job_id))
+                except RPCError:
+                    pass
+                # Remuxes with stream copy when the codecs fit, transcodes only when required
+                async with control.stage("postprocess", Config.TECH_VJ_POSTPROCESS_TIMEOUT):
+                    with stage_seconds.time(stage="postprocess"):
+                        downloaded_file_path, postprocess_path, _ = await smart_convert(downloaded_file_path, youtube_dl_ext)
+                logger.info(f"Postprocess path for {youtube_dl_url} (format {youtube_dl_format}): {postprocess_path}")
+        journaled.set_stage(UPLOAD, downloaded_file_path)
+        download_success = True
+    except DownloadTooLarge as e:
+        # Aborted mid-stream: the file would be thrown away anyway
+        logger.warning(f"Download of {youtube_dl_url} (format {youtube_dl_format}) stopped: {e}")
+        await update.message.edit_text(Translation.TECH_VJ_RCHD_TG_API_LIMIT)
+        return
     except youtube_dl.DownloadError as e:
         logger.error(f"Download Error for {youtube_dl_url} (format {youtube_dl_format}): {e}", exc_info=True)
         await update.message.edit_text(f"دانلود با شکست مواجه شد: {e}")
@@ -272,9 +973,9 @@ async def ddl_call_back(bot: Client, update: CallbackQuery):
         return
 
     if download_success and downloaded_file_path and os.path.exists(downloaded_file_path):
-        end_download_time = datetime.now() # Use datetime for calculation here
+        end_download_time = time.time()
         try:
-            await update.message.edit_text(Translation.UPLOAD_START)
+            await update.message.edit_text(Translation.UPLOAD_START, reply_markup=cancel_markup(control.job_id))
         except MessageNotModified:
             pass
         except RPCError as e:
@@ -284,167 +985,237 @@ async def ddl_call_back(bot: Client, update: CallbackQuery):
         file_size = os.stat(downloaded_file_path).st_size
 
         if file_size > Config.TECH_VJ_TG_MAX_FILE_SIZE:
+            if not Config.TECH_VJ_SPLIT_LARGE_FILES:
+                await update.message.edit_text(text=Translation.TECH_VJ_RCHD_TG_API_LIMIT)
+                return
+            sent_messages = await upload_split_parts(bot, update, workspace, control, downloaded_file_path, info_dict,
+                                                     description, upload_progress, journaled)
+            if sent_messages is None:
+                return
+            total_download_seconds = round(end_download_time - start_time_download, 1)
+            total_upload_seconds = round(time.time() - end_download_time, 1)
             await update.message.edit_text(
-                chat_id=update.message.chat.id,
-                text=Translation.TECH_VJ_RCHD_TG_API_LIMIT,
-                message_id=update.message.id
+                text=Translation.TECH_VJ_AFTER_SUCCESSFUL_UPLOAD_MSG_WITH_TS.format(total_download_seconds, total_upload_seconds)
+                + "\n" + Translation.TECH_VJ_SPLIT_DONE.format(parts=journaled.progress["parts_sent"]),
+                disable_web_page_preview=True
             )
-            try:
-                await asyncio.to_thread(os.remove, downloaded_file_path)
-                logger.info(f"Removed large file: {downloaded_file_path}")
-            except Exception as e:
-                logger.warning(f"Error removing large file {downloaded_file_path}: {e}")
-            return
+            return sent_messages
         else:
-            upload_start_time = time.time() # This is the start time for the *upload*
+            async with job_scheduler.stage("upload"), \
+                    control.stage("upload", Config.TECH_VJ_UPLOAD_TIMEOUT, watch_stall=True):
+                upload_start_time = time.time() # This is the start time for the *upload*
 
-            if downloaded_file_path.lower().endswith(('.mp3', '.ogg', '.wav', '.m4a')):
-                tg_send_type = "audio"
-            elif downloaded_file_path.lower().endswith(('.mp4', '.mkv', '.webm', '.avi', '.mov')):
-                tg_send_type = "video"
-            else:
-                tg_send_type = "file"
+                if downloaded_file_path.lower().endswith(('.mp3', '.ogg', '.wav', '.m4a')):
+                    tg_send_type = "audio"
+                elif downloaded_file_path.lower().endswith(('.mp4', '.mkv', '.webm', '.avi', '.mov')):
+                    tg_send_type = "video"
+                else:
+                    tg_send_type = "file"
 
-            thumb_image_path = None
-            try:
-                thumb_image_path = await Gthumb01(bot, update) 
-            except Exception as e:
-                logger.warning(f"Could not get custom thumbnail with Gthumb01: {e}")
                 thumb_image_path = None
+                try:
+                    thumb_image_path = await Gthumb01(bot, update) 
+                except Exception as e:
+                    logger.warning(f"Could not get custom thumbnail with Gthumb01: {e}")
+                    thumb_image_path = None
 
-            thumb_vm_path = None
-            thumb_video_path = None
+                thumb_vm_path = None
+                thumb_video_path = None
+                sent_message = None
 
-            try:
-                if tg_send_type == "audio":
-                    duration = await Mdata03(downloaded_file_path)
-                    await bot.send_audio(
-                        chat_id=update.message.chat.id,
-                        audio=downloaded_file_path,
-                        caption=description,
-                        duration=duration,
-                        thumb=thumb_image_path,
-                        reply_to_message_id=update.message.reply_to_message.id,
-                        progress=progress_for_pyrogram,
-                        progress_args=(
-                            Translation.TECH_VJ_UPLOAD_START,
-                            update.message,
-                            upload_start_time
-                        )
-                    )
-                elif tg_send_type == "file":
-                    await bot.send_document(
-                        chat_id=update.message.chat.id,
-                        document=downloaded_file_path,
-                        thumb=thumb_image_path,
-                        caption=description,
-                        reply_to_message_id=update.message.reply_to_message.id,
-                        progress=progress_for_pyrogram,
-                        progress_args=(
-                            Translation.TECH_VJ_UPLOAD_START,
-                            update.message,
-                            upload_start_time
-                        )
-                    )
-                elif tg_send_type == "video":
-                    width, height, duration = await Mdata01(downloaded_file_path)
-                    
-                    is_video_note = (width and height and width == height and duration <= 60)
-
-                    if is_video_note:
-                        thumb_vm_path = await Gthumb02(bot, update, duration, downloaded_file_path)
-                        await bot.send_video_note(
+                try:
+                    if tg_send_type == "audio":
+                        duration = await Mdata03(downloaded_file_path, info_dict)
+                        sent_message = await bot.send_audio(
                             chat_id=update.message.chat.id,
-                            video_note=downloaded_file_path,
+                            audio=downloaded_file_path,
+                            caption=description,
                             duration=duration,
-                            length=width,
-                            thumb=thumb_vm_path,
+                            thumb=thumb_image_path,
                             reply_to_message_id=update.message.reply_to_message.id,
-                            progress=progress_for_pyrogram,
+                            progress=upload_progress,
                             progress_args=(
                                 Translation.TECH_VJ_UPLOAD_START,
                                 update.message,
                                 upload_start_time
                             )
                         )
-                    else:
-                        thumb_video_path = await Gthumb02(bot, update, duration, downloaded_file_path)
-                        await bot.send_video(
+                    elif tg_send_type == "file":
+                        sent_message = await bot.send_document(
                             chat_id=update.message.chat.id,
-                            video=downloaded_file_path,
+                            document=downloaded_file_path,
+                            thumb=thumb_image_path,
                             caption=description,
-                            duration=duration,
-                            width=width,
-                            height=height,
-                            supports_streaming=True,
-                            thumb=thumb_video_path,
                             reply_to_message_id=update.message.reply_to_message.id,
-                            progress=progress_for_pyrogram,
+                            progress=upload_progress,
                             progress_args=(
                                 Translation.TECH_VJ_UPLOAD_START,
                                 update.message,
                                 upload_start_time
                             )
                         )
-                else:
-                    logger.info("Unknown send type. Sending file as document.")
-                    await bot.send_document(
-                        chat_id=update.message.chat.id,
-                        document=downloaded_file_path,
-                        thumb=thumb_image_path,
-                        caption=description,
-                        reply_to_message_id=update.message.reply_to_message.id,
-                        progress=progress_for_pyrogram,
-                        progress_args=(
-                            Translation.TECH_VJ_UPLOAD_START,
-                            update.message,
-                            upload_start_time
+                    elif tg_send_type == "video":
+                        width, height, duration = await Mdata01(downloaded_file_path, info_dict)
+                    
+                        is_video_note = (width and height and width == height and duration <= 60)
+
+                        if is_video_note:
+                            thumb_vm_path = await Gthumb02(bot, update, duration, downloaded_file_path, info_dict)
+                            workspace.track(thumb_vm_path)
+                            sent_message = await bot.send_video_note(
+                                chat_id=update.message.chat.id,
+                                video_note=downloaded_file_path,
+                                duration=duration,
+                                length=width,
+                                thumb=thumb_vm_path,
+                                reply_to_message_id=update.message.reply_to_message.id,
+                                progress=upload_progress,
+                                progress_args=(
+                                    Translation.TECH_VJ_UPLOAD_START,
+                                    update.message,
+                                    upload_start_time
+                                )
+                            )
+                        else:
+                            thumb_video_path = await Gthumb02(bot, update, duration, downloaded_file_path, info_dict)
+                            workspace.track(thumb_video_path)
+                            sent_message = await bot.send_video(
+                                chat_id=update.message.chat.id,
+                                video=downloaded_file_path,
+                                caption=description,
+                                duration=duration,
+                                width=width,
+                                height=height,
+                                supports_streaming=True,
+                                thumb=thumb_video_path,
+                                reply_to_message_id=update.message.reply_to_message.id,
+                                progress=upload_progress,
+                                progress_args=(
+                                    Translation.TECH_VJ_UPLOAD_START,
+                                    update.message,
+                                    upload_start_time
+                                )
+                            )
+                    else:
+                        logger.info("Unknown send type. Sending file as document.")
+                        sent_message = await bot.send_document(
+                            chat_id=update.message.chat.id,
+                            document=downloaded_file_path,
+                            thumb=thumb_image_path,
+                            caption=description,
+                            reply_to_message_id=update.message.reply_to_message.id,
+                            progress=upload_progress,
+                            progress_args=(
+                                Translation.TECH_VJ_UPLOAD_START,
+                                update.message,
+                                upload_start_time
+                            )
                         )
-                    )
-            except Exception as e:
-                logger.error(f"Error during file upload: {e}", exc_info=True)
-                await update.message.edit_text(f"خطا در آپلود فایل: {e}")
-                return
+                except Exception as e:
+                    logger.error(f"Error during file upload: {e}", exc_info=True)
+                    await close_progress_dispatcher(update.message.chat.id, update.message.id)
+                    await update.message.edit_text(f"خطا در آپلود فایل: {e}")
+                    return
+                finally:
+                    await close_progress_dispatcher(update.message.chat.id, update.message.id)
 
-            end_upload_time = datetime.now()
-            try:
-                await delete_temp_file(downloaded_file_path)
-                
-                if thumb_image_path and os.path.exists(thumb_image_path):
-                    await delete_temp_file(thumb_image_path)
-                if thumb_vm_path and os.path.exists(thumb_vm_path):
-                    await delete_temp_file(thumb_vm_path)
-                if thumb_video_path and os.path.exists(thumb_video_path):
-                    await delete_temp_file(thumb_video_path)
-
-                if os.path.exists(tmp_directory_for_each_user) and not os.listdir(tmp_directory_for_each_user):
-                    await asyncio.to_thread(os.rmdir, tmp_directory_for_each_user)
-                    logger.info(f"Removed empty user directory: {tmp_directory_for_each_user}")
+            end_upload_time = time.time()
+            stage_seconds.observe(end_upload_time - upload_start_time, stage="upload")
+            transferred_bytes.inc(file_size, direction="upload")
 
-            except Exception as e:
-                logger.warning(f"Error during cleanup: {e}")
+            # Wall-clock seconds with one decimal (download includes postprocessing)
+            total_download_seconds = round(end_download_time - start_time_download, 1)
+            total_upload_seconds = round(end_upload_time - end_download_time, 1)
 
-            # Calculate time taken using the datetime objects
-            total_download_seconds = (end_download_time - datetime.fromtimestamp(start_time_download)).seconds
-            total_upload_seconds = (end_upload_time - end_download_time).seconds
-            
             await update.message.edit_text(
                 text=Translation.TECH_VJ_AFTER_SUCCESSFUL_UPLOAD_MSG_WITH_TS.format(total_download_seconds, total_upload_seconds),
-                chat_id=update.message.chat.id,
-                message_id=update.message.id,
                 disable_web_page_preview=True
             )
+            return sent_message
     else:
         await update.message.edit_text(
-            text=Translation.TECH_VJ_NO_VOID_FORMAT_FOUND.format("دانلود ناموفق بود یا فایل یافت نشد."),
-            chat_id=update.message.chat.id,
-            message_id=update.message.id,
+            text=Translation.TECH_VJ_NO_VOID_FORMAT_FOUND.format(reason="دانلود ناموفق بود یا فایل یافت نشد."),
             disable_web_page_preview=True
         )
 
+def max_output_size():
+    """Largest file a job may produce; with splitting on, bigger than one Telegram upload."""
+    if Config.TECH_VJ_SPLIT_LARGE_FILES:
+        return max(Config.TECH_VJ_SPLIT_MAX_SIZE, Config.TECH_VJ_TG_MAX_FILE_SIZE)
+    return Config.TECH_VJ_TG_MAX_FILE_SIZE
+
+# Oversized output: cut it into parts below the Telegram limit and upload each part while
+# the next one is being cut. Returns the sent messages, or None after reporting an error.
+# Parts a resumed job had already sent are cut again (the cuts are deterministic) but skipped.
+async def upload_split_parts(bot: Client, update: CallbackQuery, workspace, control, file_path, info_dict, description, upload_progress, journaled):
+    try:
+        await update.message.edit_text(Translation.TECH_VJ_SPLITTING, reply_markup=cancel_markup(control.job_id))
+    except RPCError:
+        pass
+    part_size = min(Config.TECH_VJ_SPLIT_PART_SIZE, Config.TECH_VJ_TG_MAX_FILE_SIZE)
+    thumb_path = await Gthumb01(bot, update)
+    sent_messages = []
+    already_sent = journaled.progress.get("parts_sent", 0)
+    journaled.report(force=True, parts_sent=already_sent)
+    # No per-stage deadline: the job deadline and the stall detector cover all parts
+    async with job_scheduler.stage("upload"), control.stage("upload", 0, watch_stall=True):
+        try:
+            index = 0
+            async for part_path, playable in iter_upload_parts(file_path, Config.TECH_VJ_TG_MAX_FILE_SIZE, part_size):
+                index += 1
+                if index <= already_sent:
+                    await asyncio.to_thread(os.remove, part_path)
+                    continue
+                part_bytes = os.path.getsize(part_path)
+                control.report(f"part{index}")
+                upload_start_time = time.time()
+                common = dict(
+                    chat_id=update.message.chat.id,
+                    caption=Translation.TECH_VJ_SPLIT_PART_CAPTION.format(caption=description, index=index),
+                    reply_to_message_id=update.message.reply_to_message.id,
+                    progress=upload_progress,
+                    progress_args=(
+                        Translation.TECH_VJ_SPLIT_UPLOAD_PART.format(index=index),
+                        update.message,
+                        upload_start_time
+                    )
+                )
+                if playable:
+                    # The whole-file info dict does not describe a part: probe the part itself, once
+                    probe = await probe_media(part_path)
+                    if thumb_path is None:
+                        thumb_path = await Gthumb02(bot, update, probe["duration"], part_path, info_dict)
+                        workspace.track(thumb_path)
+                    sent_message = await bot.send_video(
+                        video=part_path,
+                        duration=probe["duration"],
+                        width=probe["width"],
+                        height=probe["height"],
+                        supports_streaming=True,
+                        thumb=thumb_path,
+                        **common
+                    )
+                else:
+                    sent_message = await bot.send_document(document=part_path, thumb=thumb_path, **common)
+                sent_messages.append(sent_message)
+                journaled.report(force=True, parts_sent=index)
+                stage_seconds.observe(time.time() - upload_start_time, stage="upload")
+                transferred_bytes.inc(part_bytes, direction="upload")
+                # Sent parts are deleted right away, so at most a few parts sit on disk
+                await asyncio.to_thread(os.remove, part_path)
+                logger.info(f"Uploaded part {index} ({part_bytes} bytes) of {file_path}")
+        except Exception as e:
+            logger.error(f"Error during split upload of {file_path}: {e}", exc_info=True)
+            await close_progress_dispatcher(update.message.chat.id, update.message.id)
+            await update.message.edit_text(f"خطا در آپلود فایل: {e}")
+            return None
+        finally:
+            await close_progress_dispatcher(update.message.chat.id, update.message.id)
+    return sent_messages
+
 # --- Progress Hook for yt-dlp ---
-async def yt_dlp_progress_hook(d: dict, bot: Client, chat_id: int, message_id: int, start_time: float):
-    # This hook is called by yt-dlp.
+def yt_dlp_progress_hook(d: dict, progress, start_time: float):
+    # This hook is called on the event loop for every yt-dlp progress event.
     # d['status'] can be 'downloading', 'finished', 'error'
     if d['status'] == 'downloading':
         total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate')
@@ -454,11 +1225,6 @@ async def yt_dlp_progress_hook(d: dict, bot: Client, chat_id: int, message_id: i
 
         if total_bytes and downloaded_bytes:
             percentage = downloaded_bytes * 100 / total_bytes
-            current_time = time.time()
-            diff = current_time - start_time # Use the start_time passed from ddl_call_back
-
-            if diff == 0:
-                diff = 0.001
 
             current_speed = humanbytes(speed) if speed else "N/A"
             estimated_time_str = TimeFormatter(eta * 1000) if eta else "N/A"
@@ -468,19 +1234,8 @@ async def yt_dlp_progress_hook(d: dict, bot: Client, chat_id: int, message_id: i
                               f"**پیشرفت:** {percentage:.2f}%\n" \
                               f"**سرعت:** {current_speed}/s\n" \
                               f"**زمان باقیمانده (ETA):** {estimated_time_str}"
-            try:
-                # Only edit if progress has changed significantly to avoid spamming Telegram API
-                # or if it's the very first update
-                await bot.edit_message_text(chat_id, message_id, text=current_message)
-            except MessageNotModified:
-                pass
-            except FloodWait as e:
-                logger.warning(f"FloodWait on progress update: {e.value} seconds. Waiting...")
-                await asyncio.sleep(e.value)
-            except RPCError as e:
-                logger.error(f"Pyrogram RPCError during yt-dlp progress update: {e}")
-            except Exception as e:
-                logger.warning(f"General error updating yt-dlp progress message: {e}")
+            # Coalesced by the dispatcher: no task or API call per yt-dlp callback
+            progress.update(current_message)
     elif d['status'] == 'finished':
         logger.info(f"Download finished for {d.get('filename', 'unknown file')}")
 
@@ -489,17 +1244,94 @@ async def yt_dlp_progress_hook(d: dict, bot: Client, chat_id: int, message_id: i
 if __name__ == "__main__":
     plugins_path = dict(root="plugins")
 
-    app = Client(
-        "my_bot_session",
-        bot_token=Config.TG_BOT_TOKEN,
-        api_id=Config.APP_ID,
-        api_hash=Config.API_HASH,
-        plugins=plugins_path
-    )
+    run_mode = Config.TECH_VJ_RUN_MODE
+
+    if run_mode == "worker":
+        # Workers only send; each has its own in-memory session and receives no updates
+        app = ParallelUploadClient(
+            "worker_session",
+            bot_token=Config.TG_BOT_TOKEN,
+            api_id=Config.APP_ID,
+            api_hash=Config.API_HASH,
+            in_memory=True,
+            no_updates=True
+        )
+    else:
+        # Big uploads go through the parallel upload engine (several MTProto sessions)
+        app = ParallelUploadClient(
+            "my_bot_session",
+            bot_token=Config.TG_BOT_TOKEN,
+            api_id=Config.APP_ID,
+            api_hash=Config.API_HASH,
+            plugins=plugins_path
+        )
+
+        app.add_handler(MessageHandler(process_url_for_qualities, filters.regex(r"^(http|https)://[^\s/$.?#].[^\s]*$") & filters.private))
+        app.add_handler(MessageHandler(process_batch_urls, filters.regex(r"https?://\S+\s+https?://") & filters.private))
+        app.add_handler(MessageHandler(quality_command, filters.command("quality") & filters.private))
+        app.add_handler(CallbackQueryHandler(ddl_call_back, filters.regex(r"^dl=")))
+        app.add_handler(CallbackQueryHandler(picker_page_call_back, filters.regex(r"^pg=")))
+        app.add_handler(CallbackQueryHandler(cancel_call_back, filters.regex(r"^cancel=")))
 
-    app.add_handler(MessageHandler(process_url_for_qualities, filters.regex(r"^(http|https)://[^\s/$.?#].[^\s]*$") & filters.private))
-    app.add_handler(CallbackQueryHandler(ddl_call_back, filters.regex(r"^dl_q=")))
+    # Builds the YoutubeDL instances this mode needs before the first request and reports
+    # how long a cold instance takes to set up against a warm one from the pool
+    async def warm_up_ytdl():
+        option_sets = {"picker": PICKER_YDL_OPTS, "download": DOWNLOAD_YDL_OPTS}
+        if run_mode == "dispatcher":
+            option_sets.pop("download")
+        elif run_mode == "worker":
+            option_sets.pop("picker")
+        start = time.monotonic()
+        try:
+            timings = await ydl_executor.warm_up(*option_sets.values())
+        except Exception as e:
+            logger.warning(f"Warming up yt-dlp failed: {e}")
+            return
+        for name, (cold, warm) in zip(option_sets, timings):
+            logger.info(f"yt-dlp {name} instance setup: {cold:.3f}s cold, {warm:.4f}s warm")
+        logger.info(f"yt-dlp warm-up took {time.monotonic() - start:.2f}s")
+
+    async def main():
+        await app.start()
+        await warm_up_ytdl()
+        resumable = await recover_interrupted_jobs(app, run_mode)
+        # Sweeps files left behind by a previous crash before any job starts
+        await janitor.start()
+        resumed = [asyncio.create_task(resume_job(app, entry)) for entry in resumable]
+        if resumed:
+            logger.info(f"Resuming {len(resumed)} interrupted jobs")
+        metrics_runner = await start_metrics_server(Config.TECH_VJ_METRICS_HOST, Config.TECH_VJ_METRICS_PORT)
+        worker = None
+        queue_monitor = None
+        if run_mode == "worker":
+            worker = QueueWorker(
+                get_durable_queue(), lambda job: run_queued_job(app, job), cancel_queued_job,
+                Config.TECH_VJ_WORKER_CONCURRENCY, Config.TECH_VJ_WORKER_LEASE_SECONDS,
+                Config.TECH_VJ_WORKER_HEARTBEAT_INTERVAL, Config.TECH_VJ_WORKER_POLL_INTERVAL
+            )
+            worker.start()
+        elif run_mode == "dispatcher":
+            queue_monitor = asyncio.create_task(run_queue_monitor(
+                get_durable_queue(), Config.TECH_VJ_WORKER_HEARTBEAT_INTERVAL, Config.TECH_VJ_SESSION_TTL
+            ))
+        logger.info(f"ربات در حال شروع به کار است... (حالت: {run_mode})")
+        logger.info(f"Cold start took {time.monotonic() - BOOT_STARTED:.2f}s (imports {IMPORT_SECONDS:.2f}s)")
+        try:
+            await idle()
+        finally:
+            # Interrupted again: their journal entries stay for the next start
+            for task in resumed:
+                task.cancel()
+            if worker is not None:
+                await worker.stop()
+            if queue_monitor is not None:
+                queue_monitor.cancel()
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+            await janitor.stop()
+            await app.stop()
+            ydl_executor.shutdown()
+            await close_http_session()
+        logger.info("ربات متوقف شد.")
 
-    logger.info("ربات در حال شروع به کار است...")
-    app.run()
-    logger.info("ربات متوقف شد.")
+    app.run(main())
@@ -0,0 +1,224 @@
+import asyncio
+import contextvars
+import itertools
+import logging
+import time
+
+from pyrogram import Client, raw
+from pyrogram.errors import FloodWait
+
+from config import Config
+from plugins.metrics import record_flood_wait
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first: replies and results the user waits for, then progress edits
+PRIORITY_REPLY = 0
+PRIORITY_PROGRESS = 1
+
+# Priority of the Bot API calls made from the current task (the progress dispatcher sets PROGRESS)
+api_priority = contextvars.ContextVar("api_priority", default=PRIORITY_REPLY)
+
+MAX_IDLE_BUCKETS = 10000
+
+
+class RequestDropped(Exception):
+    """A queued progress edit was superseded or waited too long; sending it late would only mislead."""
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available (0 = now)."""
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds):
+        # A FloodWait empties the bucket and closes it for the requested time
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def idle(self, now):
+        return self.blocked_until <= now and self.delay(now) == 0 and self.tokens >= self.capacity
+
+
+class _Request(object):
+    def __init__(self, seq, chat_id, priority, message_key):
+        self.seq = seq
+        self.chat_id = chat_id
+        self.priority = priority
+        self.message_key = message_key
+        self.created = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+# Grants outbound Bot API calls against a global and a per-chat token bucket, highest
+# priority first. A chat that is out of tokens or under FloodWait never holds up other
+# chats, and queued progress edits are dropped once superseded or too old.
+class ApiScheduler(object):
+    def __init__(self, global_rate, chat_rate, chat_burst, progress_max_age):
+        self.global_bucket = TokenBucket(global_rate, max(1, global_rate))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.progress_max_age = progress_max_age
+        self.dropped = 0
+        self._chats = {}
+        self._waiting = []  # sorted by (priority, seq)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    @property
+    def queued(self):
+        return len(self._waiting)
+
+    def stats(self):
+        return {"queued": self.queued, "dropped": self.dropped, "chats": len(self._chats)}
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_IDLE_BUCKETS:
+                now = time.monotonic()
+                self._chats = {c: b for c, b in self._chats.items() if not b.idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _drop(self, request):
+        self._waiting.remove(request)
+        self.dropped += 1
+        if not request.future.done():
+            request.future.set_exception(RequestDropped())
+
+    async def acquire(self, chat_id, priority, message_key=None):
+        """Wait for a slot to send one request to `chat_id` (None = only the global limit)."""
+        request = _Request(next(self._seq), chat_id, priority, message_key)
+        if message_key is not None:
+            # Any newer request for the same message makes a queued progress edit pointless
+            for other in [r for r in self._waiting if r.message_key == message_key and r.priority == PRIORITY_PROGRESS]:
+                self._drop(other)
+        self._waiting.append(request)
+        self._waiting.sort(key=lambda r: (r.priority, r.seq))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        try:
+            await request.future
+        except asyncio.CancelledError:
+            if request in self._waiting:
+                self._waiting.remove(request)
+            raise
+
+    def _grant(self):
+        """Grant every request that can go now; returns seconds until the next one could."""
+        now = time.monotonic()
+        next_check = None
+        for request in list(self._waiting):
+            if request.future.done():
+                self._waiting.remove(request)
+                continue
+            if request.priority == PRIORITY_PROGRESS and now - request.created > self.progress_max_age:
+                self._drop(request)
+                continue
+            global_delay = self.global_bucket.delay(now)
+            if global_delay > 0:
+                # Nobody can go; the highest-priority request gets the next global token
+                return global_delay if next_check is None else min(next_check, global_delay)
+            bucket = self._chat_bucket(request.chat_id) if request.chat_id is not None else None
+            chat_delay = bucket.delay(now) if bucket is not None else 0
+            if chat_delay > 0:
+                next_check = chat_delay if next_check is None else min(next_check, chat_delay)
+                continue
+            self.global_bucket.take()
+            if bucket is not None:
+                bucket.take()
+            self._waiting.remove(request)
+            request.future.set_result(None)
+        return next_check
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            next_check = self._grant()
+            if not self._waiting:
+                await self._wakeup.wait()
+                continue
+            if self.progress_max_age:
+                next_check = min(next_check or self.progress_max_age, self.progress_max_age)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=next_check)
+            except asyncio.TimeoutError:
+                pass
+
+    def flood_wait(self, chat_id, seconds):
+        """Back off only the bucket the FloodWait was for."""
+        if chat_id is not None:
+            self._chat_bucket(chat_id).block(seconds)
+        else:
+            self.global_bucket.block(seconds)
+        self._wakeup.set()
+
+
+def _peer_chat_id(peer):
+    for attr in ("user_id", "chat_id", "channel_id"):
+        value = getattr(peer, attr, None)
+        if value is not None:
+            return value
+    return None
+
+
+def classify_request(query):
+    """(scheduled, chat_id, message_key) of a raw query; only messages.* calls aimed at a chat are scheduled."""
+    peer = getattr(query, "peer", None)
+    if peer is None or not type(query).__module__.startswith("pyrogram.raw.functions.messages"):
+        return False, None, None
+    chat_id = _peer_chat_id(peer)
+    message_key = None
+    if isinstance(query, raw.functions.messages.EditMessage):
+        message_key = (chat_id, query.id)
+    return True, chat_id, message_key
+
+
+# Client that routes every chat-bound Bot API call through the scheduler and handles
+# FloodWait centrally: the affected bucket is closed, user-visible calls are retried,
+# progress edits are given back to their dispatcher.
+class ScheduledClient(Client):
+    async def invoke(self, query, *args, **kwargs):
+        scheduled, chat_id, message_key = classify_request(query)
+        if not scheduled:
+            return await super().invoke(query, *args, **kwargs)
+        if len(args) < 3:
+            # Surface every FloodWait here instead of letting pyrogram sleep inside the call
+            kwargs["sleep_threshold"] = 0
+        priority = api_priority.get()
+        while True:
+            await api_scheduler.acquire(chat_id, priority, message_key)
+            try:
+                return await super().invoke(query, *args, **kwargs)
+            except FloodWait as e:
+                logger.warning(f"FloodWait of {e.value} seconds for chat {chat_id} ({type(query).__name__})")
+                record_flood_wait("api", e.value)
+                api_scheduler.flood_wait(chat_id, e.value)
+                if priority == PRIORITY_PROGRESS or e.value > Config.TECH_VJ_API_MAX_FLOOD_WAIT:
+                    raise
+
+
+api_scheduler = ApiScheduler(
+    Config.TECH_VJ_API_GLOBAL_RATE, Config.TECH_VJ_API_CHAT_RATE,
+    Config.TECH_VJ_API_CHAT_BURST, Config.TECH_VJ_API_PROGRESS_MAX_AGE
+)
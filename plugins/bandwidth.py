@@ -0,0 +1,124 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD = "download"
+UPLOAD = "upload"
+
+# Seconds of traffic a bucket lets through at once after being idle
+BURST_SECONDS = 1
+
+# User the transfers of the current task are charged to (set when a job or prefetch starts)
+transfer_user = contextvars.ContextVar("transfer_user", default=None)
+
+
+# Token bucket counted in bytes. A consumer takes what it sends right away and sleeps off
+# the debt, so concurrent consumers are served in arrival order and the rate can change live.
+class ByteBucket(object):
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate * BURST_SECONDS
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.rate * BURST_SECONDS, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate):
+        self._refill(time.monotonic())
+        self.rate = rate
+
+    def reserve(self, nbytes):
+        """Take `nbytes`; returns the seconds to wait before sending them."""
+        self._refill(time.monotonic())
+        self.tokens -= nbytes
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+# Download and upload rate caps: a global bucket per direction, and a bucket per user with
+# a transfer running. A user's share is their own cap or an equal part of the global cap
+# among the users transferring in that direction, whichever is lower; shares are
+# recomputed whenever a user starts or stops transferring.
+class BandwidthShaper(object):
+    def __init__(self, limits):
+        """`limits` maps a direction to (global rate, per-user rate) in bytes/s, 0 = unlimited."""
+        self.limits = dict(limits)
+        self._global = {direction: ByteBucket(rate) for direction, (rate, _) in self.limits.items() if rate}
+        self._users = {direction: {} for direction in self.limits}  # direction -> user_id -> ByteBucket
+        self._active = {direction: Counter() for direction in self.limits}  # direction -> user_id -> transfers
+
+    def share(self, direction, user_id=None):
+        """Rate in bytes/s `user_id` may use now, None when unlimited."""
+        global_rate, user_rate = self.limits[direction]
+        active = self._active[direction]
+        users = len(active) + (0 if user_id in active else 1)
+        rates = [rate for rate in (user_rate, global_rate / users if global_rate else 0) if rate]
+        return min(rates) if rates else None
+
+    def _rebalance(self, direction):
+        buckets = self._users[direction]
+        for user_id in list(buckets):
+            if user_id not in self._active[direction]:
+                del buckets[user_id]
+        for user_id in self._active[direction]:
+            rate = self.share(direction, user_id)
+            if rate is None:
+                continue
+            if user_id in buckets:
+                buckets[user_id].set_rate(rate)
+            else:
+                buckets[user_id] = ByteBucket(rate)
+
+    @contextmanager
+    def active(self, direction, user_id=None):
+        """Count a transfer of `user_id` (default: the current job's user) while the block runs."""
+        user_id = transfer_user.get() if user_id is None else user_id
+        active = self._active[direction]
+        active[user_id] += 1
+        if active[user_id] == 1:
+            self._rebalance(direction)
+        try:
+            yield user_id
+        finally:
+            active[user_id] -= 1
+            if active[user_id] <= 0:
+                del active[user_id]
+                self._rebalance(direction)
+
+    def reserve(self, direction, nbytes, user_id=None):
+        """Charge `nbytes` to the global and the user's bucket; returns the seconds to hold off."""
+        user_id = transfer_user.get() if user_id is None else user_id
+        wait = 0.0
+        bucket = self._global.get(direction)
+        if bucket is not None:
+            wait = bucket.reserve(nbytes)
+        bucket = self._users[direction].get(user_id)
+        if bucket is not None:
+            wait = max(wait, bucket.reserve(nbytes))
+        return wait
+
+    async def consume(self, direction, nbytes, user_id=None):
+        """Wait until `nbytes` may be sent under the global and the user's cap."""
+        wait = self.reserve(direction, nbytes, user_id)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def allocations(self):
+        """{(direction, user_id): rate} of every user transferring now, for monitoring."""
+        return {
+            (direction, user_id): self.share(direction, user_id)
+            for direction, active in self._active.items() for user_id in active
+        }
+
+
+bandwidth = BandwidthShaper({
+    DOWNLOAD: (Config.TECH_VJ_DOWNLOAD_RATE_LIMIT, Config.TECH_VJ_USER_DOWNLOAD_RATE_LIMIT),
+    UPLOAD: (Config.TECH_VJ_UPLOAD_RATE_LIMIT, Config.TECH_VJ_USER_UPLOAD_RATE_LIMIT),
+})
@@ -0,0 +1,148 @@
+import asyncio
+import itertools
+import logging
+import re
+from types import SimpleNamespace
+
+from translation import Translation
+from plugins.progress_dispatcher import get_progress_dispatcher, register_progress_sink, unregister_progress_sink
+
+logger = logging.getLogger(__name__)
+
+URL_RE = re.compile(r"https?://[^\s/$.?#][^\s]*")
+MAX_TITLE_LENGTH = 40
+MAX_FAILED_LISTED = 10
+
+# Batch entries have no Telegram message of their own; they get unique negative ids
+_entry_ids = itertools.count(1)
+
+
+def extract_urls(text):
+    """All distinct URLs of a message, in order."""
+    return list(dict.fromkeys(URL_RE.findall(text or "")))
+
+
+def _short(title):
+    return title if len(title) <= MAX_TITLE_LENGTH else title[:MAX_TITLE_LENGTH - 1] + "…"
+
+
+# Stand-in for the picker message of one batch entry. Everything the job pipeline
+# writes to it (status, progress) ends up as one line of the aggregated batch message.
+class BatchEntryMessage(object):
+    def __init__(self, batch, index, client, chat_id, reply_to_message_id):
+        self._batch = batch
+        self._index = index
+        self._client = client
+        self.id = -next(_entry_ids)
+        self.chat = SimpleNamespace(id=chat_id)
+        self.reply_to_message = SimpleNamespace(id=reply_to_message_id)
+
+    async def edit_text(self, text, **kwargs):
+        self._batch.set_status(self._index, text)
+        return self
+
+    # Progress sink registered for this entry's (chat_id, id)
+    def update(self, text):
+        self._batch.set_status(self._index, text)
+
+    async def close(self):
+        pass
+
+
+# Stand-in for the CallbackQuery a picker job receives
+class BatchEntryUpdate(object):
+    def __init__(self, from_user, message):
+        self.from_user = from_user
+        self.message = message
+
+
+# One aggregated status message for the whole batch: totals plus a block per running entry
+class BatchProgress(object):
+    def __init__(self, client, chat_id, message_id, user_message):
+        self.client = client
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.user_message = user_message
+        self.total = 0
+        self.done = 0
+        self.failed = []
+        self._titles = {}
+        self._running = {}  # index -> last status text
+        self._dispatcher = get_progress_dispatcher(client, chat_id, message_id)
+
+    def add(self, index, title):
+        self._titles[index] = _short(title)
+        self.total = max(self.total, index + 1)
+
+    def entry(self, index):
+        """The (update, message) pair the job pipeline works on for entry `index`."""
+        message = BatchEntryMessage(self, index, self.client, self.chat_id, self.user_message.id)
+        register_progress_sink(self.chat_id, message.id, message)
+        self._running[index] = ""
+        self._render()
+        return BatchEntryUpdate(self.user_message.from_user, message)
+
+    def set_status(self, index, text):
+        if index in self._running:
+            self._running[index] = text
+            self._render()
+
+    def finish(self, index, ok, message=None):
+        self._running.pop(index, None)
+        if message is not None:
+            unregister_progress_sink(self.chat_id, message.id)
+        if ok:
+            self.done += 1
+        else:
+            self.failed.append(self._titles.get(index, str(index + 1)))
+        self._render()
+
+    def _render(self):
+        text = Translation.TECH_VJ_BATCH_PROGRESS.format(done=self.done, total=self.total, failed=len(self.failed))
+        for index, status in sorted(self._running.items()):
+            text += f"\n\n**{index + 1}. {self._titles.get(index, '')}**"
+            if status:
+                text += f"\n{status}"
+        self._dispatcher.update(text)
+
+    def summary(self, template):
+        text = template.format(done=self.done, total=self.total, failed=len(self.failed))
+        if self.failed:
+            listed = "\n".join(f"• {title}" for title in self.failed[:MAX_FAILED_LISTED])
+            text += f"\n\n{Translation.TECH_VJ_BATCH_FAILED_ENTRIES}\n{listed}"
+        return text
+
+    async def close(self, template):
+        await self._dispatcher.close()
+        try:
+            await self.client.edit_message_text(self.chat_id, self.message_id, text=self.summary(template))
+        except Exception as e:
+            logger.warning(f"Could not send batch summary: {e}")
+
+
+async def run_pipeline(items, process, concurrency):
+    """Feed `items` (an async iterator) to `concurrency` workers running `process(item)`.
+
+    At most `concurrency` items are resolved ahead of the workers, so a lazy source
+    (e.g. per-entry extraction) runs just in front of the downloads and uploads.
+    """
+    queue = asyncio.Queue(maxsize=concurrency)
+
+    async def produce():
+        async for item in items:
+            await queue.put(item)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def consume():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            await process(item)
+
+    # A failing worker cancels the others instead of leaving them blocked on the queue
+    async with asyncio.TaskGroup() as group:
+        group.create_task(produce())
+        for _ in range(concurrency):
+            group.create_task(consume())
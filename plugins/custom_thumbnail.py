@@ -1,12 +1,16 @@
 import os
+import json
 import asyncio
 import logging
-from hachoir.metadata import extractMetadata
-from hachoir.parser import createParser
-from PIL import Image
+from collections import OrderedDict
+
+import aiohttp
 
 # Import Config (assuming it's accessible or needs to be imported)
 from config import Config
+from plugins.job_control import run_subprocess
+from plugins.metrics import timed, cache_lookups
+from plugins.segmented_download import get_http_session
 
 logger = logging.getLogger(__name__)
 
@@ -19,42 +23,144 @@ async def delete_temp_file(path):
         except Exception as e:
             logger.warning(f"Error deleting temp file {path}: {e}")
 
+# --- Media probe service ---
+# One probe per file: duration, dimensions and codecs are read once (from the yt-dlp
+# info dict when it already has them, otherwise with a single ffprobe call) and cached.
+_PROBE_CACHE_SIZE = 256
+_probe_cache = OrderedDict()
+
+
+def _empty_probe():
+    return {"duration": 0, "width": 0, "height": 0, "video_codec": None, "audio_codec": None,
+            "streams": [], "source": None}
+
+
+def _probe_from_info(info_dict):
+    # After a download the top-level fields describe the selected (merged) format
+    if not info_dict or not info_dict.get("duration"):
+        return None
+    vcodec = info_dict.get("vcodec")
+    acodec = info_dict.get("acodec")
+    has_video = vcodec not in (None, "none")
+    if has_video and not (info_dict.get("width") and info_dict.get("height")):
+        return None
+    result = _empty_probe()
+    result.update(
+        duration=int(info_dict["duration"]),
+        width=info_dict.get("width") or 0,
+        height=info_dict.get("height") or 0,
+        video_codec=vcodec.split(".")[0] if has_video else None,
+        audio_codec=acodec.split(".")[0] if acodec not in (None, "none") else None,
+        source="info",
+    )
+    return result
+
+
+@timed("probe")
+async def _ffprobe(file_path):
+    command = [
+        "ffprobe", "-v", "error", "-print_format", "json",
+        "-show_entries", "format=duration:stream=index,codec_type,codec_name,width,height:stream_disposition=attached_pic",
+        file_path
+    ]
+    returncode, stdout, stderr = await run_subprocess(*command)
+    if returncode != 0:
+        raise RuntimeError(f"ffprobe failed for {file_path}: {stderr.decode(errors='ignore')}")
+    data = json.loads(stdout or b"{}")
+    streams = data.get("streams", [])
+    # Cover art (attached_pic) is a video stream too, but not the video
+    video = next((st for st in streams if st.get("codec_type") == "video"
+                  and not (st.get("disposition") or {}).get("attached_pic")), {})
+    audio = next((st for st in streams if st.get("codec_type") == "audio"), {})
+    result = _empty_probe()
+    result.update(
+        duration=int(float(data.get("format", {}).get("duration") or 0)),
+        width=video.get("width") or 0,
+        height=video.get("height") or 0,
+        video_codec=video.get("codec_name"),
+        audio_codec=audio.get("codec_name"),
+        streams=streams,
+        source="ffprobe",
+    )
+    return result
+
+
+@timed("probe")
+async def _hachoir_probe(file_path):
+    # hachoir and PIL are only needed on fallback paths, so they are imported on first use
+    from hachoir.metadata import extractMetadata
+    from hachoir.parser import createParser
+    metadata = await asyncio.to_thread(lambda: extractMetadata(createParser(file_path)))
+    result = _empty_probe()
+    if metadata:
+        result.update(
+            duration=metadata.get('duration').seconds if metadata.has('duration') else 0,
+            width=metadata.get('width', 0) if metadata.has('width') else 0,
+            height=metadata.get('height', 0) if metadata.has('height') else 0,
+            source="hachoir",
+        )
+    return result
+
+
+async def probe_media(file_path, info_dict=None, need_streams=False):
+    """Return duration/width/height/codecs of a media file, probing it at most once.
+
+    With `need_streams` the per-stream codec list is required, so the info dict
+    shortcut is skipped.
+    """
+    try:
+        st = os.stat(file_path)
+    except OSError as e:
+        logger.error(f"Cannot probe {file_path}: {e}")
+        return _empty_probe()
+    key = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+    cached = _probe_cache.get(key)
+    if cached is not None and (cached["streams"] or not need_streams):
+        _probe_cache.move_to_end(key)
+        cache_lookups.inc(cache="probe", result="hit")
+        return cached
+    cache_lookups.inc(cache="probe", result="miss")
+
+    result = None if need_streams else _probe_from_info(info_dict)
+    if result is None:
+        try:
+            result = await _ffprobe(file_path)
+        except FileNotFoundError:
+            logger.warning("ffprobe not found, falling back to hachoir for media metadata.")
+            result = await _hachoir_probe(file_path)
+        except Exception as e:
+            logger.error(f"Error probing {file_path}: {e}")
+            result = await _hachoir_probe(file_path)
+
+    _probe_cache[key] = result
+    while len(_probe_cache) > _PROBE_CACHE_SIZE:
+        _probe_cache.popitem(last=False)
+    return result
+
+
 # Function to get video metadata (width, height, duration)
-async def Mdata01(file_path):
+async def Mdata01(file_path, info_dict=None):
     try:
-        # Use asyncio.to_thread for blocking I/O operations
-        metadata = await asyncio.to_thread(extractMetadata, createParser(file_path))
-        if metadata:
-            width = metadata.get('width', 0)
-            height = metadata.get('height', 0)
-            duration = metadata.get('duration').seconds if metadata.has('duration') else 0
-            return width, height, duration
-        return 0, 0, 0
+        probe = await probe_media(file_path, info_dict)
+        return probe["width"], probe["height"], probe["duration"]
     except Exception as e:
         logger.error(f"Error in Mdata01 for {file_path}: {e}")
         return 0, 0, 0
 
 # Function to get video message metadata (width, duration)
-async def Mdata02(file_path):
+async def Mdata02(file_path, info_dict=None):
     try:
-        metadata = await asyncio.to_thread(extractMetadata, createParser(file_path))
-        if metadata:
-            width = metadata.get('width', 0)
-            duration = metadata.get('duration').seconds if metadata.has('duration') else 0
-            return width, duration
-        return 0, 0
+        probe = await probe_media(file_path, info_dict)
+        return probe["width"], probe["duration"]
     except Exception as e:
         logger.error(f"Error in Mdata02 for {file_path}: {e}")
         return 0, 0
 
 # Function to get audio file metadata (duration)
-async def Mdata03(file_path):
+async def Mdata03(file_path, info_dict=None):
     try:
-        metadata = await asyncio.to_thread(extractMetadata, createParser(file_path))
-        if metadata:
-            duration = metadata.get('duration').seconds if metadata.has('duration') else 0
-            return duration
-        return 0
+        probe = await probe_media(file_path, info_dict)
+        return probe["duration"]
     except Exception as e:
         logger.error(f"Error in Mdata03 for {file_path}: {e}")
         return 0
@@ -68,32 +174,59 @@ async def Gthumb01(bot, update):
         return thumb_path
     return None # Return None if no custom thumbnail found
 
+# Turn the thumbnail yt-dlp already found into a Telegram-sized JPEG, with no video decoding
+def _save_jpeg_thumbnail(data, thumb_path):
+    from io import BytesIO
+    from PIL import Image
+    with Image.open(BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((320, 320))
+        image.save(thumb_path, "JPEG", quality=85)
+
+
+async def thumbnail_from_info(info_dict, thumb_path):
+    url = (info_dict or {}).get("thumbnail")
+    if not url:
+        return None
+    try:
+        # Pooled connections of the shared session, with a deadline of its own
+        async with get_http_session().get(url, timeout=aiohttp.ClientTimeout(total=20)) as resp:
+            if resp.status != 200:
+                return None
+            data = await resp.read()
+        await asyncio.to_thread(_save_jpeg_thumbnail, data, thumb_path)
+        logger.info(f"Thumbnail taken from info dict: {thumb_path}")
+        return thumb_path
+    except Exception as e:
+        logger.warning(f"Could not use info dict thumbnail {url}: {e}")
+        return None
+
+
 # Function to generate a video thumbnail using FFmpeg
 # This function requires FFmpeg to be installed on your system
-async def Gthumb02(bot, update, duration, file_path):
+@timed("thumbnail")
+async def Gthumb02(bot, update, duration, file_path, info_dict=None):
     user_id = update.from_user.id
     thumb_dir = os.path.join(Config.TECH_VJ_DOWNLOAD_LOCATION, str(user_id))
     os.makedirs(thumb_dir, exist_ok=True) # Ensure directory exists
     thumb_path = os.path.join(thumb_dir, f"video_thumb_{os.path.basename(file_path)}.jpg")
 
+    if await thumbnail_from_info(info_dict, thumb_path):
+        return thumb_path
+
     try:
         # Use ffmpeg to extract a frame as thumbnail
-        # -ss: seek to position (e.g., middle of video)
-        # -vframes 1: extract only one frame
-        # -s 320x180: resize thumbnail (optional)
+        # -ss before -i: fast input-side seek to the middle, no decoding from the start
+        # -frames:v 1: extract only one frame
+        # scale: fits in 320x320 (Telegram's thumbnail limit on both sides), keeping the aspect ratio
         # -y: overwrite if exists
         command = [
-            "ffmpeg", "-i", file_path, "-ss", str(duration // 2),
-            "-vframes", "1", "-s", "320x180", "-y", thumb_path
+            "ffmpeg", "-ss", str(duration // 2), "-i", file_path,
+            "-frames:v", "1", "-vf", "scale=320:320:force_original_aspect_ratio=decrease", "-y", thumb_path
         ]
-        process = await asyncio.create_subprocess_exec(
-            *command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
+        returncode, stdout, stderr = await run_subprocess(*command)
 
-        if process.returncode != 0:
+        if returncode != 0:
             logger.error(f"FFmpeg thumbnail generation failed for {file_path}. Error: {stderr.decode()}")
             return None
         
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import os
+import shutil
+from contextlib import asynccontextmanager
+
+from config import Config
+from plugins.segmented_download import find_direct_http_format, get_content_length, get_http_session
+
+logger = logging.getLogger(__name__)
+
+
+def format_size(fmt, duration):
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    bitrate = fmt.get("tbr") or (fmt.get("vbr") or 0) + (fmt.get("abr") or 0)
+    if not size and bitrate and duration:
+        # Bitrates are in KBit/s
+        size = int(bitrate * 1000 / 8 * duration)
+    return size or None
+
+
+async def estimate_download_size(info_dict, format_id):
+    """Best estimate of the final size of `format_id` (e.g. "22" or "137+140"), or None."""
+    if not info_dict:
+        return None
+    formats = {f.get("format_id"): f for f in info_dict.get("formats") or []}
+    duration = info_dict.get("duration")
+    total = 0
+    for part in format_id.split("+"):
+        fmt = formats.get(part)
+        if fmt is None:
+            return None
+        size = format_size(fmt, duration)
+        if size is None:
+            direct = find_direct_http_format(info_dict, part)
+            if direct is not None:
+                size = await get_content_length(get_http_session(), direct["url"], direct.get("http_headers") or {})
+        if size is None:
+            return None
+        total += size
+    return total
+
+
+# One job's reservation. The bytes it has written are already missing from the free
+# space, so only the part not written yet is held back from it.
+class DiskReservation(object):
+    def __init__(self, budget, size):
+        self.budget = budget
+        self.size = size
+        self.written = 0
+
+    def cover(self, written):
+        """Record that the job has `written` bytes on disk, growing the reservation (with some
+        headroom) when they outrun it. Returns False when the disk cannot take them."""
+        self.written = written
+        if written <= self.size:
+            return True
+        for extra in (written - self.size + written // 4, written - self.size):
+            if self.budget.try_reserve(extra):
+                self.size += extra
+                return True
+        return False
+
+
+# Disk space reservations against a configurable budget on the download volume.
+# Jobs wait in FIFO order until their estimated size fits.
+class DiskBudget(object):
+    def __init__(self, path, budget, min_free):
+        self.path = path
+        self.budget = budget
+        self.min_free = min_free
+        self.reserved = 0
+        self._reservations = set()
+        self._condition = asyncio.Condition()
+
+    def _available(self):
+        os.makedirs(self.path, exist_ok=True)
+        unwritten = self.reserved - sum(min(r.written, r.size) for r in self._reservations)
+        free = shutil.disk_usage(self.path).free - self.min_free - unwritten
+        if self.budget:
+            free = min(free, self.budget - self.reserved)
+        return free
+
+    def capacity(self):
+        """The largest reservation that can ever be granted."""
+        os.makedirs(self.path, exist_ok=True)
+        capacity = shutil.disk_usage(self.path).total - self.min_free
+        if self.budget:
+            capacity = min(capacity, self.budget)
+        return capacity
+
+    async def reserve(self, size, on_wait=None):
+        """Wait until `size` bytes can be reserved. `on_wait()` is awaited once if the job has to wait."""
+        async with self._condition:
+            waited = False
+            while self._available() < size:
+                if not waited and on_wait is not None:
+                    waited = True
+                    await on_wait()
+                try:
+                    # Space is also freed by processes outside the bot, so re-check periodically
+                    await asyncio.wait_for(self._condition.wait(), timeout=30)
+                except asyncio.TimeoutError:
+                    pass
+            self.reserved += size
+
+    def try_reserve(self, size):
+        """Reserve `size` bytes only if they are free right now; speculative work never waits."""
+        if self._available() < size:
+            return False
+        self.reserved += size
+        return True
+
+    async def release(self, size):
+        async with self._condition:
+            self.reserved -= size
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def reservation(self, size, on_wait=None):
+        """Reserve `size` bytes for the block; yields the DiskReservation, which may grow."""
+        await self.reserve(size, on_wait)
+        reservation = DiskReservation(self, size)
+        self._reservations.add(reservation)
+        try:
+            yield reservation
+        finally:
+            self._reservations.discard(reservation)
+            await self.release(reservation.size)
+
+    def stats(self):
+        return {"reserved": self.reserved, "available": self._available(), "budget": self.budget}
+
+
+disk_budget = DiskBudget(
+    Config.TECH_VJ_DOWNLOAD_LOCATION,
+    Config.TECH_VJ_DISK_BUDGET,
+    Config.TECH_VJ_DISK_MIN_FREE,
+)
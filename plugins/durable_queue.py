@@ -0,0 +1,381 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+from config import Config
+from plugins.progress_dispatcher import register_progress_sink, unregister_progress_sink
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# Error recorded for jobs whose workers kept dying before they finished
+ERROR_LOST = "lost"
+
+# wait_for_job polls less often the longer a job runs, up to this many seconds
+MAX_WAIT_POLL_INTERVAL = 10
+
+# Latest status text of the batch entries this worker runs (job_id -> text), written to
+# the queue with the next heartbeat
+_pending_progress = {}
+
+
+class QueuedJob(object):
+    def __init__(self, job_id, payload, attempts):
+        self.job_id = job_id
+        self.payload = payload
+        self.attempts = attempts
+
+
+# SQLite job queue shared by the dispatcher and the worker processes of one machine.
+# Workers lease jobs for a limited time and extend the lease with heartbeats; a job whose
+# lease runs out (its worker died) goes back to the queue until max_attempts is reached.
+# Calls block while another process holds the write lock: call them from the event loop
+# through asyncio.to_thread.
+class DurableJobQueue(object):
+    def __init__(self, path, max_attempts):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " user_id INTEGER,"
+            " payload TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " worker_id TEXT,"
+            " lease_expires REAL,"
+            " cancel_requested INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT,"
+            " progress TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        if "progress" not in [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]:
+            # Queue created before batch entry status was relayed
+            self._db.execute("ALTER TABLE jobs ADD COLUMN progress TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS workers ("
+            " worker_id TEXT PRIMARY KEY,"
+            " heartbeat REAL NOT NULL,"
+            " started_at REAL NOT NULL)"
+        )
+
+    def _transaction(self, work):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return result
+
+    def enqueue(self, payload, user_id=None):
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (job_id, user_id, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, user_id, json.dumps(payload), QUEUED, now, now),
+            )
+        return job_id
+
+    def _requeue_expired(self, now):
+        expired = self._db.execute(
+            "SELECT job_id, attempts, worker_id FROM jobs WHERE status = ? AND lease_expires < ?", (LEASED, now)
+        ).fetchall()
+        for job_id, attempts, worker_id in expired:
+            if attempts >= self.max_attempts:
+                logger.error(f"Job {job_id} lost its worker {worker_id} {attempts} times, giving up")
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, worker_id = NULL, updated_at = ? WHERE job_id = ?",
+                    (FAILED, ERROR_LOST, now, job_id),
+                )
+            else:
+                logger.warning(f"Lease of job {job_id} on worker {worker_id} expired, re-queueing")
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, worker_id = NULL, lease_expires = NULL, updated_at = ? WHERE job_id = ?",
+                    (QUEUED, now, job_id),
+                )
+        return len(expired)
+
+    def requeue_expired(self):
+        return self._transaction(lambda: self._requeue_expired(time.time()))
+
+    def claim(self, worker_id, lease_seconds):
+        """Lease the oldest queued job to `worker_id`; None when the queue is empty."""
+        def work():
+            now = time.time()
+            self._requeue_expired(now)
+            row = self._db.execute(
+                "SELECT job_id, payload, attempts FROM jobs WHERE status = ? AND cancel_requested = 0"
+                " ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, payload, attempts = row
+            self._db.execute(
+                "UPDATE jobs SET status = ?, worker_id = ?, lease_expires = ?, attempts = ?, updated_at = ?"
+                " WHERE job_id = ?",
+                (LEASED, worker_id, now + lease_seconds, attempts + 1, now, job_id),
+            )
+            return QueuedJob(job_id, json.loads(payload), attempts + 1)
+        return self._transaction(work)
+
+    def heartbeat(self, worker_id, job_ids, lease_seconds, progress=None):
+        """Extend the leases of `job_ids` and store their `progress` texts (job_id -> text);
+        returns the jobs whose cancellation was requested."""
+        progress = progress or {}
+
+        def work():
+            now = time.time()
+            self._db.execute(
+                "INSERT INTO workers (worker_id, heartbeat, started_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(worker_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (worker_id, now, now),
+            )
+            cancelled = []
+            for job_id in job_ids:
+                row = self._db.execute(
+                    "SELECT cancel_requested FROM jobs WHERE job_id = ? AND worker_id = ?", (job_id, worker_id)
+                ).fetchone()
+                if row is None:
+                    continue
+                self._db.execute(
+                    "UPDATE jobs SET lease_expires = ?, progress = COALESCE(?, progress) WHERE job_id = ?",
+                    (now + lease_seconds, progress.get(job_id), job_id)
+                )
+                if row[0]:
+                    cancelled.append(job_id)
+            return cancelled
+        return self._transaction(work)
+
+    def finish(self, job_id, worker_id, status, error=None):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_expires = NULL, updated_at = ?"
+                " WHERE job_id = ? AND worker_id = ? AND status = ?",
+                (status, error, time.time(), job_id, worker_id, LEASED),
+            )
+
+    def release(self, job_id, worker_id):
+        """Hand a leased job back without counting the attempt (clean worker shutdown)."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, worker_id = NULL, lease_expires = NULL, attempts = attempts - 1,"
+                " updated_at = ? WHERE job_id = ? AND worker_id = ? AND status = ?",
+                (QUEUED, time.time(), job_id, worker_id, LEASED),
+            )
+
+    def request_cancel(self, job_id, user_id):
+        """Flag `job_id` for cancellation; returns the job status, or None if it does not exist.
+
+        A job still waiting in the queue is cancelled right away, a leased one by its
+        worker at the next heartbeat. Raises PermissionError for another user's job.
+        """
+        def work():
+            row = self._db.execute("SELECT user_id, status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            owner, status = row
+            if owner != user_id:
+                raise PermissionError(job_id)
+            if status == QUEUED:
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?", (CANCELLED, time.time(), job_id)
+                )
+                return CANCELLED
+            if status == LEASED:
+                self._db.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ?", (job_id,))
+            return status
+        return self._transaction(work)
+
+    def status(self, job_id):
+        with self._lock:
+            return self._db.execute("SELECT status, error, progress FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+
+    def purge_finished(self, max_age):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?", (*FINISHED, time.time() - max_age)
+            )
+
+    def stats(self, worker_timeout):
+        with self._lock:
+            counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            (workers,) = self._db.execute(
+                "SELECT COUNT(*) FROM workers WHERE heartbeat > ?", (time.time() - worker_timeout,)
+            ).fetchone()
+        return {"queued": counts.get(QUEUED, 0), "leased": counts.get(LEASED, 0), "live_workers": workers}
+
+
+async def wait_for_job(queue, job_id, poll_interval, on_progress=None):
+    """Wait until `job_id` is finished; returns (status, error).
+
+    `on_progress(text)` is awaited with each new status the worker reports for a batch entry.
+    """
+    last_progress = None
+    while True:
+        row = await asyncio.to_thread(queue.status, job_id)
+        if row is None:
+            return FAILED, ERROR_LOST
+        status, error, progress = row
+        if status in FINISHED:
+            return status, error
+        if on_progress is not None and progress and progress != last_progress:
+            last_progress = progress
+            await on_progress(progress)
+        await asyncio.sleep(poll_interval)
+        # The worker edits real messages itself; the dispatcher only relays batch entry status
+        poll_interval = min(poll_interval * 2, max(poll_interval, MAX_WAIT_POLL_INTERVAL))
+
+
+# Stand-in for the picker message of a job that runs in a worker process. Edits go to
+# the real message; batch entries (negative ids) have none, their updates go through the
+# queue (`job_id`) to the dispatcher, which shows them in the batch status message.
+class RemoteJobMessage(object):
+    def __init__(self, client, chat_id, message_id, reply_to_message_id, job_id=None):
+        self._client = client
+        self._job_id = job_id
+        self.id = message_id
+        self.chat = SimpleNamespace(id=chat_id)
+        self.reply_to_message = SimpleNamespace(id=reply_to_message_id)
+        if message_id < 0:
+            register_progress_sink(chat_id, message_id, self)
+
+    async def edit_text(self, text, **kwargs):
+        if self.id < 0:
+            self.update(text)
+            return self
+        return await self._client.edit_message_text(self.chat.id, self.id, text=text, **kwargs)
+
+    # Progress sink of a batch entry
+    def update(self, text):
+        if self._job_id is not None:
+            _pending_progress[self._job_id] = text
+
+    async def close(self):
+        pass
+
+    def detach(self):
+        if self.id < 0:
+            unregister_progress_sink(self.chat.id, self.id)
+            _pending_progress.pop(self._job_id, None)
+
+
+class RemoteJobUpdate(object):
+    def __init__(self, user_id, message):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.message = message
+
+
+# Claims jobs from the durable queue and runs up to `concurrency` of them at once with
+# `handle(job)`, which returns True on success. Heartbeats keep the leases alive and
+# deliver cancellation requests to `on_cancel(job_id)`.
+class QueueWorker(object):
+    def __init__(self, queue, handle, on_cancel, concurrency, lease_seconds, heartbeat_interval, poll_interval):
+        self.queue = queue
+        self.handle = handle
+        self.on_cancel = on_cancel
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._active = {}  # job_id -> task
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks = []
+
+    async def _run_job(self, job):
+        status, error = FAILED, None
+        try:
+            if await self.handle(job):
+                status = DONE
+        except asyncio.CancelledError:
+            # Shutting down: let another worker pick the job up again
+            await asyncio.shield(asyncio.to_thread(self.queue.release, job.job_id, self.worker_id))
+            raise
+        except Exception as e:
+            logger.error(f"Queued job {job.job_id} crashed: {e}", exc_info=True)
+            error = str(e)
+        finally:
+            self._active.pop(job.job_id, None)
+            self._slots.release()
+        await asyncio.to_thread(self.queue.finish, job.job_id, self.worker_id, status, error)
+
+    async def _claim_loop(self):
+        while True:
+            await self._slots.acquire()
+            job = await asyncio.to_thread(self.queue.claim, self.worker_id, self.lease_seconds)
+            if job is None:
+                self._slots.release()
+                await asyncio.sleep(self.poll_interval)
+                continue
+            logger.info(f"Worker {self.worker_id} leased job {job.job_id} (attempt {job.attempts})")
+            self._active[job.job_id] = asyncio.create_task(self._run_job(job))
+
+    async def _heartbeat_loop(self):
+        while True:
+            try:
+                progress = {job_id: _pending_progress.pop(job_id) for job_id in list(self._active)
+                            if job_id in _pending_progress}
+                cancelled = await asyncio.to_thread(
+                    self.queue.heartbeat, self.worker_id, list(self._active), self.lease_seconds, progress
+                )
+                for job_id in cancelled:
+                    self.on_cancel(job_id)
+            except Exception as e:
+                logger.error(f"Worker heartbeat failed: {e}", exc_info=True)
+            await asyncio.sleep(self.heartbeat_interval)
+
+    def start(self):
+        logger.info(f"Worker {self.worker_id} started ({self.concurrency} jobs at once)")
+        self._tasks = [asyncio.create_task(self._heartbeat_loop()), asyncio.create_task(self._claim_loop())]
+
+    async def stop(self):
+        for task in self._tasks + list(self._active.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._active.values(), return_exceptions=True)
+        self._tasks = []
+
+
+# Keeps an eye on the queue from the dispatcher: re-queues jobs of dead workers even
+# when no worker is left to claim them, and purges old finished jobs.
+async def run_queue_monitor(queue, interval, finished_max_age):
+    while True:
+        try:
+            await asyncio.to_thread(queue.requeue_expired)
+            await asyncio.to_thread(queue.purge_finished, finished_max_age)
+        except Exception as e:
+            logger.error(f"Job queue monitor failed: {e}", exc_info=True)
+        await asyncio.sleep(interval)
+
+
+_queue = None
+
+
+def get_durable_queue():
+    """The job queue of the dispatcher/worker deployment, opened on first use."""
+    global _queue
+    if _queue is None:
+        _queue = DurableJobQueue(Config.TECH_VJ_JOB_QUEUE_DB_PATH, Config.TECH_VJ_JOB_MAX_ATTEMPTS)
+    return _queue
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from config import Config
+from plugins.info_cache import normalize_url
+
+logger = logging.getLogger(__name__)
+
+# Media attributes of a sent pyrogram Message, in the order they are checked
+MEDIA_TYPES = ("video", "video_note", "audio", "document")
+
+
+def make_media_key(info_dict, url, format_id, ext):
+    """Dedup key (extractor, video id, format_id, ext); falls back to the normalized URL."""
+    if info_dict and info_dict.get("id"):
+        extractor = info_dict.get("extractor_key") or info_dict.get("extractor") or "generic"
+        return (extractor, str(info_dict["id"]), format_id, ext)
+    return ("url", normalize_url(url), format_id, ext)
+
+
+def get_media_file_id(message):
+    for media_type in MEDIA_TYPES:
+        media = getattr(message, media_type, None)
+        if media is not None:
+            return media_type, media.file_id
+    return None, None
+
+
+# Persistent index of Telegram file_ids already uploaded for a given media key.
+# Repeat requests are answered by re-sending the file_id, and concurrent identical
+# requests collapse into one in-flight job.
+class FileIndex(object):
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS media_index ("
+            " extractor TEXT NOT NULL,"
+            " video_id TEXT NOT NULL,"
+            " format_id TEXT NOT NULL,"
+            " ext TEXT NOT NULL,"
+            " media_type TEXT NOT NULL,"
+            " file_id TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (extractor, video_id, format_id, ext))"
+        )
+        self._inflight = {}  # key -> Future resolved when the leading job finishes
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT media_type, file_id FROM media_index"
+                " WHERE extractor = ? AND video_id = ? AND format_id = ? AND ext = ?",
+                key,
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return row
+
+    def remember(self, key, message):
+        media_type, file_id = get_media_file_id(message)
+        if file_id is None:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO media_index"
+                " (extractor, video_id, format_id, ext, media_type, file_id, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*key, media_type, file_id, time.time()),
+            )
+        logger.info(f"Indexed {media_type} file_id for {key}")
+
+    def forget(self, key):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM media_index WHERE extractor = ? AND video_id = ? AND format_id = ? AND ext = ?",
+                key,
+            )
+
+    def is_inflight(self, key):
+        return key in self._inflight
+
+    async def single_flight(self, key, job):
+        """Run `job()` unless an identical job is already running.
+
+        Returns True if this call ran the job, False if it only waited for another one.
+        """
+        pending = self._inflight.get(key)
+        if pending is not None:
+            await asyncio.shield(pending)
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            await job()
+        finally:
+            del self._inflight[key]
+            future.set_result(None)
+        return True
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "inflight": len(self._inflight),
+        }
+
+
+file_index = FileIndex(Config.TECH_VJ_FILE_INDEX_DB_PATH)
@@ -0,0 +1,143 @@
+import logging
+
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from plugins.disk_quota import format_size
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTS = ("mp4", "mkv", "webm")
+# Audio-only formats and the container the file is delivered in (opus/vorbis in webm become ogg)
+AUDIO_EXTS = {"m4a": "m4a", "mp3": "mp3", "webm": "ogg", "ogg": "ogg", "opus": "ogg"}
+# Audio container that merges into each video container without re-encoding
+MERGE_AUDIO_EXT = {"mp4": "m4a", "webm": "webm"}
+
+
+def _has(fmt, kind):
+    # yt-dlp uses "none" for a missing stream and None for an unknown codec
+    return fmt.get(kind) != "none"
+
+
+def _quality(fmt):
+    return (fmt.get("height") or 0, fmt.get("fps") or 0, fmt.get("tbr") or 0)
+
+
+def _best_audio(audio_formats, video_ext):
+    preferred = [f for f in audio_formats if f.get("ext") == MERGE_AUDIO_EXT.get(video_ext)]
+    candidates = preferred or audio_formats
+    return max(candidates, key=lambda f: f.get("abr") or f.get("tbr") or 0) if candidates else None
+
+
+def build_format_options(info_dict):
+    """Every downloadable choice of `info_dict`, best first.
+
+    Returns dicts with "format" (a yt-dlp format spec, e.g. "22" or "137+140"), the target
+    "ext", "kind" (video/audio), "height", "fps" and the estimated "size" (or None).
+    Muxed formats, video-only formats merged with the best matching audio, and the best
+    audio-only format per container are offered; duplicates of the same quality keep the best.
+    """
+    formats = info_dict.get("formats") or []
+    duration = info_dict.get("duration")
+    audio_formats = [f for f in formats if _has(f, "acodec") and not _has(f, "vcodec") and f.get("format_id")]
+
+    videos = {}  # (height, fps, ext) -> (quality, option)
+    for f in formats:
+        ext = f.get("ext")
+        if not f.get("format_id") or not _has(f, "vcodec") or ext not in VIDEO_EXTS:
+            continue
+        size = format_size(f, duration)
+        if _has(f, "acodec"):
+            option = {"format": f["format_id"], "ext": ext}
+        else:
+            audio = _best_audio(audio_formats, ext)
+            if audio is None:
+                continue
+            audio_size = format_size(audio, duration)
+            size = size + audio_size if size and audio_size else None
+            merged_ext = ext if audio.get("ext") == MERGE_AUDIO_EXT.get(ext) else "mkv"
+            option = {"format": f"{f['format_id']}+{audio['format_id']}", "ext": merged_ext}
+        fps = int(f["fps"]) if f.get("fps") else None
+        # Direct links carry no height; they are still offered, after the known qualities
+        option.update(kind="video", height=f.get("height"), fps=fps, size=size)
+        key = (f.get("height"), fps, option["ext"])
+        if key not in videos or _quality(f) > videos[key][0]:
+            videos[key] = (_quality(f), option)
+
+    audios = {}  # target ext -> (bitrate, option)
+    for f in audio_formats:
+        target_ext = AUDIO_EXTS.get(f.get("ext"))
+        if target_ext is None:
+            continue
+        bitrate = f.get("abr") or f.get("tbr") or 0
+        if target_ext not in audios or bitrate > audios[target_ext][0]:
+            audios[target_ext] = (bitrate, {
+                "format": f["format_id"], "ext": target_ext, "kind": "audio",
+                "height": None, "fps": None, "size": format_size(f, duration),
+            })
+
+    options = [option for _, option in sorted(videos.values(), key=lambda v: v[0], reverse=True)]
+    options += [option for _, option in sorted(audios.values(), key=lambda a: a[0], reverse=True)]
+    return options
+
+
+def build_picker_keyboard(temp_key, options, page, page_size):
+    """Keyboard of one page of `options`; buttons carry only the session key and an option index."""
+    pages = max(1, (len(options) + page_size - 1) // page_size)
+    page = min(max(page, 0), pages - 1)
+    start = page * page_size
+    buttons = [
+        [InlineKeyboardButton(text=option["label"], callback_data=f"dl={temp_key}={index}")]
+        for index, option in enumerate(options[start:start + page_size], start=start)
+    ]
+    if pages > 1:
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(text="◀️", callback_data=f"pg={temp_key}={page - 1}"))
+        navigation.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=f"pg={temp_key}={page}"))
+        if page < pages - 1:
+            navigation.append(InlineKeyboardButton(text="▶️", callback_data=f"pg={temp_key}={page + 1}"))
+        buttons.append(navigation)
+    return InlineKeyboardMarkup(buttons)
+
+
+def pick_batch_option(options, max_height, max_size):
+    """The best video option up to `max_height` that fits `max_size` (batch mode has no picker)."""
+    videos = [o for o in options if o["kind"] == "video"]
+    for option in videos:
+        if (option["height"] or 0) <= max_height and (not option["size"] or option["size"] <= max_size):
+            return option
+    if videos:
+        return videos[-1]
+    return options[0] if options else None
+
+
+def rank_options(options, preference, max_size):
+    """Options that satisfy `preference`, best match first.
+
+    `preference` has "kind" (video/audio), "max_height" (None = any), "ext" (None = any;
+    other containers still qualify, after the preferred one) and "order": "best" keeps
+    the picker order (highest quality first), "smallest" puts the smallest known size first.
+    Options known to be larger than `max_size` never qualify.
+    """
+    kind = preference.get("kind") or "video"
+    max_height = preference.get("max_height") if kind == "video" else None
+    ext = preference.get("ext")
+    candidates = [
+        o for o in options
+        if o["kind"] == kind and (not o["size"] or o["size"] <= max_size)
+        and (not max_height or (o["height"] and o["height"] <= max_height))
+    ]
+
+    def key(option):
+        mismatch = bool(ext) and option["ext"] != ext
+        if preference.get("order") == "smallest":
+            return (mismatch, option["size"] is None, option["size"] or 0)
+        return (mismatch,)
+
+    # Stable: within equal keys the picker order (best first) is kept
+    return sorted(candidates, key=key)
+
+
+def pick_preferred_option(options, preference, max_size):
+    ranked = rank_options(options, preference, max_size)
+    return ranked[0] if ranked else None
@@ -0,0 +1,166 @@
+import asyncio
+import copy
+import logging
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that only carry tracking/sharing information
+# Only parameters that are tracking on every site: short generic names ("s", "from", "ref"...)
+# carry content on some sites (a search, a start offset) and must stay in the key
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "gbraid", "wbraid", "msclkid", "yclid", "twclid", "ttclid",
+    "igshid", "igsh", "mc_cid", "mc_eid", "si",
+}
+TRACKING_PREFIXES = ("utm_", "pk_", "vero_", "hsa_")
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+_YOUTUBE_HOSTS = {"youtube.com", "m.youtube.com", "music.youtube.com", "youtube-nocookie.com"}
+_YOUTUBE_ID = re.compile(r"^[0-9A-Za-z_-]{11}$")
+
+
+def _youtube_video_id(host, path, query):
+    if host == "youtu.be":
+        candidate = path.strip("/").split("/")[0]
+    elif host in _YOUTUBE_HOSTS:
+        parts = [p for p in path.split("/") if p]
+        if parts and parts[0] == "watch":
+            candidate = dict(query).get("v", "")
+        elif len(parts) >= 2 and parts[0] in ("shorts", "embed", "live", "v"):
+            candidate = parts[1]
+        else:
+            return None
+    else:
+        return None
+    return candidate if _YOUTUBE_ID.match(candidate or "") else None
+
+
+# Normalize a URL so that equivalent links share one cache entry
+def normalize_url(url):
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in TRACKING_PARAMS and not k.lower().startswith(TRACKING_PREFIXES)
+    ]
+
+    video_id = _youtube_video_id(host, parts.path, query)
+    if video_id:
+        return f"https://www.youtube.com/watch?v={video_id}"
+
+    # The scheme stays: a site may serve different content over http and https
+    scheme = parts.scheme.lower()
+    netloc = host
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((scheme, netloc, path, urlencode(sorted(query)), ""))
+
+
+# TTL/LRU cache of yt-dlp info dicts shared by the picker and download paths.
+# Hits and misses count the links users send (get_or_extract), not the lookups the
+# download path makes afterwards.
+class InfoCache(object):
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # normalized url -> (info_dict, expires_at)
+        self._inflight = {}  # normalized url -> Future, collapses concurrent extractions
+
+    def get(self, url):
+        """The cached info dict, shared with the cache: callers must not modify it."""
+        key = normalize_url(url)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def get_copy(self, url):
+        """A private copy of the cached info dict, for callers that modify it (yt-dlp does)."""
+        info_dict = self.get(url)
+        return copy.deepcopy(info_dict) if info_dict is not None else None
+
+    def put(self, url, info_dict):
+        key = normalize_url(url)
+        self._entries.pop(key, None)
+        self._entries[key] = (info_dict, time.time() + self.ttl)
+        webpage_url = info_dict.get("webpage_url")
+        if webpage_url:
+            alias = normalize_url(webpage_url)
+            if alias != key:
+                self._entries.pop(alias, None)
+                self._entries[alias] = self._entries[key]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, url):
+        entry = self._entries.pop(normalize_url(url), None)
+        webpage_url = entry[0].get("webpage_url") if entry is not None else None
+        # put() also stored the entry under its webpage_url
+        if webpage_url and self._entries.get(normalize_url(webpage_url)) is entry:
+            del self._entries[normalize_url(webpage_url)]
+
+    async def get_or_extract(self, url, extract):
+        """Return a cached info dict or run `extract(url)` (a coroutine function) once per URL.
+
+        The dict is shared with the cache, like the one get() returns.
+        """
+        info_dict = self.get(url)
+        if info_dict is not None:
+            self.hits += 1
+            return info_dict
+
+        key = normalize_url(url)
+        pending = self._inflight.get(key)
+        if pending is not None:
+            # Someone else is extracting it: served without an extraction of our own
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            info_dict = await extract(url)
+            self.put(url, info_dict)
+            future.set_result(info_dict)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else is waiting on it
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+        return info_dict
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+
+info_cache = InfoCache(Config.TECH_VJ_INFO_CACHE_MAX_ENTRIES, Config.TECH_VJ_INFO_CACHE_TTL)
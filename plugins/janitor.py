@@ -0,0 +1,258 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_DIR = ".manifests"
+JOB_DIR_PREFIX = "job_"
+# Files in a user directory that belong to the user, not to a job
+KEEP_FILES = {"thumbnail.jpg"}
+
+
+def owned_by_other_process(pid):
+    # Worker processes share DOWNLOAD_LOCATION; a live owner's files are not leftovers
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _remove_path(path):
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+        else:
+            return False
+        return True
+    except OSError as e:
+        logger.warning(f"Janitor could not remove {path}: {e}")
+        return False
+
+
+def _entry_size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+# Everything one job writes: its own working directory plus any extra tracked files.
+# The list is persisted as a manifest so that a crash can be cleaned up on the next start.
+class JobWorkspace(object):
+    def __init__(self, root, user_id, job_id):
+        self.job_id = job_id
+        self.user_directory = os.path.join(root, str(user_id))
+        self.directory = os.path.join(self.user_directory, f"{JOB_DIR_PREFIX}{job_id}")
+        self.manifest_path = os.path.join(root, MANIFEST_DIR, f"{job_id}.json")
+        self.paths = [self.directory]
+        # Set when the job is interrupted by a shutdown and will be resumed from these files
+        self.keep = False
+
+    def _write_manifest(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"job_id": self.job_id, "pid": os.getpid(), "paths": self.paths, "created_at": time.time()}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            # Reopened by a resumed job: keep tracking what the interrupted run created
+            try:
+                with open(self.manifest_path) as f:
+                    self.paths += [p for p in json.load(f).get("paths", []) if p not in self.paths]
+            except (OSError, ValueError) as e:
+                logger.warning(f"Unreadable manifest {self.manifest_path}: {e}")
+        self._write_manifest()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def track(self, path):
+        """Register a file created outside the job directory (e.g. a generated thumbnail)."""
+        if path and path not in self.paths:
+            self.paths.append(path)
+            self._write_manifest()
+
+    def cleanup(self):
+        for path in self.paths:
+            _remove_path(path)
+        _remove_path(self.manifest_path)
+        try:
+            if os.path.isdir(self.user_directory) and not os.listdir(self.user_directory):
+                os.rmdir(self.user_directory)
+        except OSError:
+            pass
+
+
+# Removes job files on every exit path, sweeps leftovers of crashed runs on startup,
+# and periodically evicts old or excess files in a background task.
+class Janitor(object):
+    def __init__(self, root, interval, max_age, max_bytes):
+        self.root = root
+        self.interval = interval
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._active = {}  # job_id -> JobWorkspace
+        self._retained = set()  # workspaces of interrupted jobs that will be resumed
+        self._task = None
+        self.removed = 0
+
+    @asynccontextmanager
+    async def job_workspace(self, user_id, job_id=None):
+        """Working directory of one job; pass the `job_id` of a retained workspace to reopen it."""
+        workspace = JobWorkspace(self.root, user_id, job_id or uuid.uuid4().hex[:12])
+        self._active[workspace.job_id] = workspace
+        self._retained.discard(workspace.job_id)
+        try:
+            await asyncio.to_thread(workspace.open)
+            yield workspace
+        finally:
+            try:
+                if not workspace.keep:
+                    await asyncio.to_thread(workspace.cleanup)
+            finally:
+                del self._active[workspace.job_id]
+
+    def _manifests(self):
+        """(path, contents) of every manifest not owned by a job of this process."""
+        manifest_dir = os.path.join(self.root, MANIFEST_DIR)
+        if not os.path.isdir(manifest_dir):
+            return []
+        active = {f"{job_id}.json" for job_id in self._active}
+        manifests = []
+        for name in os.listdir(manifest_dir):
+            if name in active or not name.endswith(".json"):
+                continue
+            manifest_path = os.path.join(manifest_dir, name)
+            try:
+                with open(manifest_path) as f:
+                    manifests.append((manifest_path, json.load(f)))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Unreadable manifest {manifest_path}: {e}")
+                manifests.append((manifest_path, {}))
+        return manifests
+
+    def retain(self, job_ids):
+        """Keep the workspaces of `job_ids` through sweeps until a resumed job reopens them."""
+        self._retained.update(job_ids)
+
+    def _kept(self, manifest):
+        return manifest.get("job_id") in self._retained or owned_by_other_process(manifest.get("pid"))
+
+    def _protected_paths(self):
+        protected = set()
+        for workspace in list(self._active.values()):
+            protected.update(os.path.abspath(p) for p in workspace.paths)
+        for _, manifest in self._manifests():
+            if self._kept(manifest):
+                protected.update(os.path.abspath(p) for p in manifest.get("paths", []))
+        return protected
+
+    def _sweep_manifests(self):
+        for manifest_path, manifest in self._manifests():
+            if self._kept(manifest):
+                continue
+            for path in manifest.get("paths", []):
+                if _remove_path(path):
+                    self.removed += 1
+            _remove_path(manifest_path)
+
+    def _candidates(self):
+        """Top-level entries of every user directory that no running job owns."""
+        protected = self._protected_paths()
+        if not os.path.isdir(self.root):
+            return []
+        entries = []
+        for user_dir in os.listdir(self.root):
+            user_path = os.path.join(self.root, user_dir)
+            if user_dir == MANIFEST_DIR or not os.path.isdir(user_path):
+                continue
+            for name in os.listdir(user_path):
+                path = os.path.abspath(os.path.join(user_path, name))
+                if name in KEEP_FILES or path in protected:
+                    continue
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        return entries
+
+    def _sweep_orphans(self):
+        # On startup no job is running, so every job directory and generated file is orphaned
+        for _, path in self._candidates():
+            if _remove_path(path):
+                self.removed += 1
+
+    def _evict(self):
+        now = time.time()
+        entries = []
+        for mtime, path in self._candidates():
+            if self.max_age and now - mtime > self.max_age:
+                if _remove_path(path):
+                    self.removed += 1
+                    logger.info(f"Janitor removed stale {path}")
+            else:
+                entries.append((mtime, path))
+
+        if not self.max_bytes:
+            return
+        sizes = {path: _entry_size(path) for _, path in entries}
+        total = sum(sizes.values()) + sum(_entry_size(p) for p in self._protected_paths() if os.path.exists(p))
+        for _, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if _remove_path(path):
+                self.removed += 1
+                total -= sizes[path]
+                logger.info(f"Janitor evicted {path} to stay under {self.max_bytes} bytes")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self._evict)
+            except Exception as e:
+                logger.error(f"Janitor eviction failed: {e}", exc_info=True)
+
+    async def start(self):
+        await asyncio.to_thread(self._sweep_manifests)
+        await asyncio.to_thread(self._sweep_orphans)
+        logger.info(f"Janitor startup sweep removed {self.removed} leftover paths")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+janitor = Janitor(
+    Config.TECH_VJ_DOWNLOAD_LOCATION,
+    Config.TECH_VJ_JANITOR_INTERVAL,
+    Config.TECH_VJ_JANITOR_MAX_AGE,
+    Config.TECH_VJ_JANITOR_MAX_BYTES,
+)
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+WATCHDOG_INTERVAL = 1
+
+# Why a job was stopped
+CANCEL_USER = "user"
+CANCEL_TIMEOUT = "timeout"
+CANCEL_STALL = "stall"
+CANCEL_DISK = "disk"
+
+
+class JobCancelled(Exception):
+    """Raised by JobControl.run when the job was cancelled by the user, a deadline or the stall detector."""
+
+    def __init__(self, reason, stage=None):
+        super().__init__(f"Job cancelled ({reason}) during {stage or 'setup'}")
+        self.reason = reason
+        self.stage = stage
+
+
+async def run_subprocess(*command):
+    """Run a command and return (returncode, stdout, stderr). The process is killed if the caller is cancelled."""
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+            logger.info(f"Killed {command[0]} (pid {process.pid}) of a cancelled job")
+        raise
+    return process.returncode, stdout, stderr
+
+
+# Lifecycle of one running job: an overall deadline, per-stage deadlines and a stall
+# detector fed by progress hooks. Cancelling the job cancels its task, which interrupts
+# whatever it is awaiting (yt-dlp, ffmpeg, HTTP transfers, uploads).
+class JobControl(object):
+    def __init__(self, user_id, max_seconds, stall_timeout, job_id=None):
+        # Jobs from the durable worker queue keep their queue id, so cancel buttons stay valid
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.user_id = user_id
+        self.deadline = time.monotonic() + max_seconds if max_seconds else None
+        self.stall_timeout = stall_timeout
+        self.reason = None
+        self.stage_name = None
+        self._stage_deadline = None
+        self._watch_stall = False
+        self._last_progress = None
+        self._last_progress_at = time.monotonic()
+        self._task = None
+
+    def cancel(self, reason):
+        if self.reason is not None or self._task is None or self._task.done():
+            return False
+        self.reason = reason
+        logger.info(f"Cancelling job {self.job_id} of user {self.user_id} during {self.stage_name}: {reason}")
+        self._task.cancel()
+        return True
+
+    def report(self, progress):
+        """Feed the stall detector; any change of the progress value counts as progress."""
+        if progress != self._last_progress:
+            self._last_progress = progress
+            self._last_progress_at = time.monotonic()
+
+    @asynccontextmanager
+    async def stage(self, name, timeout, watch_stall=False):
+        """Run a pipeline stage under its own deadline, capped by the job deadline."""
+        now = time.monotonic()
+        deadlines = [d for d in (self.deadline, now + timeout if timeout else None) if d is not None]
+        self.stage_name = name
+        self._stage_deadline = min(deadlines) if deadlines else None
+        self._watch_stall = watch_stall and bool(self.stall_timeout)
+        self._last_progress_at = now
+        try:
+            yield
+        finally:
+            self._stage_deadline = None
+            self._watch_stall = False
+
+    async def _watchdog(self):
+        while True:
+            await asyncio.sleep(WATCHDOG_INTERVAL)
+            now = time.monotonic()
+            deadline = self._stage_deadline or self.deadline
+            if deadline is not None and now > deadline:
+                self.cancel(CANCEL_TIMEOUT)
+            elif self._watch_stall and now - self._last_progress_at > self.stall_timeout:
+                self.cancel(CANCEL_STALL)
+
+    async def run(self, coro):
+        """Run the job coroutine in its own task; raises JobCancelled if the job was cancelled."""
+        self._task = asyncio.ensure_future(coro)
+        _jobs[self.job_id] = self
+        watchdog = asyncio.create_task(self._watchdog())
+        try:
+            return await self._task
+        except asyncio.CancelledError:
+            # Only translate our own cancellation; a cancelled caller (e.g. shutdown) propagates as is
+            if self.reason is not None and not asyncio.current_task().cancelling():
+                raise JobCancelled(self.reason, self.stage_name) from None
+            raise
+        finally:
+            watchdog.cancel()
+            _jobs.pop(self.job_id, None)
+
+
+_jobs = {}
+
+
+def get_job(job_id):
+    return _jobs.get(job_id)
+
+
+def create_job_control(user_id, job_id=None):
+    return JobControl(user_id, Config.TECH_VJ_PROCESS_MAX_TIMEOUT, Config.TECH_VJ_STALL_TIMEOUT, job_id)
@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import Config
+from plugins.janitor import owned_by_other_process
+
+logger = logging.getLogger(__name__)
+
+# Stages of a journaled job; a resumed job continues from the one it was in
+QUEUED = "queued"
+DOWNLOAD = "download"
+POSTPROCESS = "postprocess"
+UPLOAD = "upload"
+
+# Progress (downloaded bytes) is written at most this often; stage changes are written at once
+PROGRESS_SAVE_INTERVAL = 5
+
+_instance = None
+
+
+def instance_id():
+    """Token of this process run. A restarted bot often gets its old PID back (PID 1 in a
+    container), so the PID alone cannot tell its own entries from those of the last run."""
+    global _instance
+    if _instance is None or _instance[0] != os.getpid():
+        _instance = (os.getpid(), uuid.uuid4().hex)
+    return _instance[1]
+
+
+class JournalEntry(object):
+    def __init__(self, journal_id, payload, stage, workspace_id, file_path, progress, attempts):
+        self.journal_id = journal_id
+        self.payload = payload
+        self.stage = stage
+        self.workspace_id = workspace_id
+        self.file_path = file_path
+        self.progress = progress
+        self.attempts = attempts
+
+    def finished_file(self):
+        """The downloaded (or converted) file when the job got past its download, else None."""
+        if self.stage in (POSTPROCESS, UPLOAD) and self.file_path and os.path.exists(self.file_path):
+            return self.file_path
+        return None
+
+
+# SQLite journal of the jobs this machine is running: what was asked for (URL, format,
+# the picker message to report to), the stage reached, the workspace and file paths and
+# the progress. Entries outlive a crash or deploy, so the next start can pick them up.
+class JobJournal(object):
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS journal ("
+            " journal_id TEXT PRIMARY KEY,"
+            " queue_job_id TEXT,"
+            " payload TEXT NOT NULL,"
+            " stage TEXT NOT NULL,"
+            " workspace_id TEXT,"
+            " file_path TEXT,"
+            " progress TEXT NOT NULL DEFAULT '{}',"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " pid INTEGER,"
+            " instance TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(journal)")}
+        if "instance" not in columns:
+            # Journals written before entries carried the owner's instance token
+            self._db.execute("ALTER TABLE journal ADD COLUMN instance TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS journal_queue_job ON journal (queue_job_id)")
+
+    def _entry(self, row):
+        journal_id, payload, stage, workspace_id, file_path, progress, attempts = row
+        return JournalEntry(journal_id, json.loads(payload), stage, workspace_id, file_path,
+                            json.loads(progress), attempts)
+
+    def record(self, payload, queue_job_id=None):
+        journal_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO journal (journal_id, queue_job_id, payload, stage, pid, instance, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (journal_id, queue_job_id, json.dumps(payload), QUEUED, os.getpid(), instance_id(), now, now),
+            )
+        return journal_id
+
+    def update(self, journal_id, **fields):
+        if "progress" in fields:
+            fields["progress"] = json.dumps(fields["progress"])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._db.execute(
+                f"UPDATE journal SET {assignments}, updated_at = ? WHERE journal_id = ?",
+                (*fields.values(), time.time(), journal_id),
+            )
+
+    def remove(self, journal_id):
+        with self._lock:
+            self._db.execute("DELETE FROM journal WHERE journal_id = ?", (journal_id,))
+
+    def interrupted(self):
+        """(entry, queue_job_id) of every job whose process is gone."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT journal_id, payload, stage, workspace_id, file_path, progress, attempts, queue_job_id, pid, instance"
+                " FROM journal ORDER BY created_at"
+            ).fetchall()
+        return [(self._entry(row[:7]), row[7]) for row in rows if not self._alive(row[8], row[9])]
+
+    @staticmethod
+    def _alive(pid, instance):
+        if instance == instance_id():
+            return True
+        # Our PID with another token is the previous run of this process
+        return pid != os.getpid() and owned_by_other_process(pid)
+
+    def take_over(self, journal_id=None, queue_job_id=None):
+        """Claim an interrupted entry for this process and count the attempt; None if there is
+        none or its process is still running."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                column, value = ("journal_id", journal_id) if journal_id else ("queue_job_id", queue_job_id)
+                row = self._db.execute(
+                    "SELECT journal_id, payload, stage, workspace_id, file_path, progress, attempts, pid, instance"
+                    f" FROM journal WHERE {column} = ? ORDER BY created_at DESC LIMIT 1", (value,)
+                ).fetchone()
+                entry = None
+                if row is not None and not self._alive(row[7], row[8]):
+                    entry = self._entry(row[:7])
+                    entry.attempts += 1
+                    self._db.execute(
+                        "UPDATE journal SET pid = ?, instance = ?, attempts = ?, updated_at = ? WHERE journal_id = ?",
+                        (os.getpid(), instance_id(), entry.attempts, time.time(), entry.journal_id),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return entry
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+
+# One job's handle on the journal. Keeps the state in memory as well, so jobs that are
+# not journaled (batch entries) go through the same code with `journal` set to None.
+class JournaledJob(object):
+    def __init__(self, journal, journal_id, entry=None):
+        self.journal = journal
+        self.journal_id = journal_id
+        self.resumed = entry
+        self.stage = entry.stage if entry else QUEUED
+        self.workspace_id = entry.workspace_id if entry else None
+        self.progress = dict(entry.progress) if entry else {}
+        self._last_save = 0.0
+
+    def _save(self, **fields):
+        if self.journal is not None:
+            self.journal.update(self.journal_id, **fields)
+
+    def set_workspace(self, workspace_id):
+        if workspace_id != self.workspace_id:
+            self.workspace_id = workspace_id
+            self._save(workspace_id=workspace_id)
+
+    def set_stage(self, stage, file_path=None):
+        self.stage = stage
+        self._save(stage=stage, file_path=file_path)
+
+    def report(self, force=False, **progress):
+        self.progress.update(progress)
+        now = time.monotonic()
+        if force or now - self._last_save >= PROGRESS_SAVE_INTERVAL:
+            self._last_save = now
+            self._save(progress=self.progress)
+
+    def finished_file(self):
+        return self.resumed.finished_file() if self.resumed else None
+
+    def close(self):
+        """The job ended (sent, failed or cancelled); it is not resumed."""
+        if self.journal is not None:
+            self.journal.remove(self.journal_id)
+
+
+_journal = None
+
+
+def get_job_journal():
+    global _journal
+    if _journal is None:
+        _journal = JobJournal(Config.TECH_VJ_JOB_JOURNAL_DB_PATH)
+    return _journal
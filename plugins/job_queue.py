@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+
+from config import Config
+from plugins.metrics import stage_seconds
+
+logger = logging.getLogger(__name__)
+
+
+class _Waiter(object):
+    def __init__(self, user_id, on_position, expected_size):
+        self.user_id = user_id
+        self.expected_size = expected_size
+        self.on_position = on_position
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.time()
+        self.last_position = None
+
+
+# Admission control for download jobs: a global concurrency limit, per-user limits
+# and a FIFO, fair-share or shortest-job-first wait queue, plus a worker pool per pipeline stage.
+class JobScheduler(object):
+    def __init__(self, max_jobs, max_per_user, stage_workers, policy="fair", sjf_aging=120):
+        self.max_jobs = max_jobs
+        self.max_per_user = max_per_user
+        self.policy = policy
+        self.sjf_aging = sjf_aging
+        self._waiters = deque()
+        self._running = Counter()  # user_id -> jobs admitted
+        self._stage_workers = dict(stage_workers)
+        self._stages = {name: asyncio.Semaphore(count) for name, count in stage_workers.items()}
+        self._stage_busy = Counter()
+
+    @property
+    def running(self):
+        return sum(self._running.values())
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    def _eligible(self, user_id):
+        return not self.max_per_user or self._running[user_id] < self.max_per_user
+
+    def _pick_next(self):
+        candidates = [w for w in self._waiters if self._eligible(w.user_id)]
+        if not candidates:
+            return None
+        if self.policy == "fair":
+            # Users with the fewest running jobs go first, FIFO within the same share
+            return min(candidates, key=lambda w: self._running[w.user_id])
+        if self.policy == "sjf":
+            # Fair share first, then the smallest expected download. A job that waited
+            # sjf_aging seconds goes before any younger one, oldest first, so a stream of
+            # small jobs cannot hold a big one back for longer than that
+            now = time.time()
+
+            def order(w):
+                if now - w.enqueued_at >= self.sjf_aging:
+                    return self._running[w.user_id], 0, w.enqueued_at
+                return self._running[w.user_id], 1, w.expected_size
+
+            return min(candidates, key=order)
+        return candidates[0]
+
+    def _dispatch(self):
+        while self.running < self.max_jobs:
+            waiter = self._pick_next()
+            if waiter is None:
+                break
+            self._waiters.remove(waiter)
+            self._running[waiter.user_id] += 1
+            waiter.future.set_result(None)
+        self._notify_positions()
+
+    def _notify_positions(self):
+        for position, waiter in enumerate(self._waiters, start=1):
+            if waiter.on_position and waiter.last_position != position:
+                waiter.last_position = position
+                asyncio.create_task(self._safe_notify(waiter.on_position, position))
+
+    @staticmethod
+    async def _safe_notify(callback, position):
+        try:
+            await callback(position)
+        except Exception as e:
+            logger.warning(f"Error sending queue position update: {e}")
+
+    def _release(self, user_id):
+        self._running[user_id] -= 1
+        if self._running[user_id] <= 0:
+            del self._running[user_id]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(self, user_id, on_position=None, expected_size=0):
+        """Wait for a job slot. `on_position(position)` is awaited whenever the queue position changes;
+        `expected_size` (bytes to download) orders the queue under the "sjf" policy."""
+        waiter = _Waiter(user_id, on_position, expected_size)
+        self._waiters.append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(user_id)
+            else:
+                self._waiters.remove(waiter)
+                self._notify_positions()
+            raise
+        stage_seconds.observe(time.time() - waiter.enqueued_at, stage="queue")
+        logger.info(f"Job admitted for user {user_id} after {time.time() - waiter.enqueued_at:.2f}s in queue "
+                    f"(running: {self.running}, queued: {self.queued})")
+        try:
+            yield
+        finally:
+            self._release(user_id)
+
+    @asynccontextmanager
+    async def stage(self, name):
+        """Hold one worker of the given pipeline stage (download, postprocess, upload)."""
+        async with self._stages[name]:
+            self._stage_busy[name] += 1
+            try:
+                yield
+            finally:
+                self._stage_busy[name] -= 1
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "stages": {
+                name: {"busy": self._stage_busy[name], "workers": workers}
+                for name, workers in self._stage_workers.items()
+            },
+        }
+
+
+job_scheduler = JobScheduler(
+    Config.TECH_VJ_MAX_CONCURRENT_JOBS,
+    Config.TECH_VJ_MAX_JOBS_PER_USER,
+    {
+        "download": Config.TECH_VJ_DOWNLOAD_WORKERS,
+        "postprocess": Config.TECH_VJ_POSTPROCESS_WORKERS,
+        "upload": Config.TECH_VJ_UPLOAD_WORKERS,
+    },
+    policy=Config.TECH_VJ_QUEUE_POLICY,
+    sjf_aging=Config.TECH_VJ_SJF_AGING,
+)
@@ -0,0 +1,198 @@
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Stage latencies range from milliseconds (cache hits, probes) to an hour (big uploads)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, labels, extra)} {value}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [("", key, (), value) for key, value in sorted(self._values.items())]
+
+
+# Gauge whose value is read from the running components at scrape time
+class CallbackGauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def samples(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.warning(f"Metric {self.name} could not be collected: {e}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [("", key if isinstance(key, tuple) else (key,), (), value) for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block, also when it raises."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, data in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, data):
+                    samples.append(("_bucket", key, (("le", bound),), count))
+                samples.append(("_bucket", key, (("le", "+Inf"),), data[-1]))
+                samples.append(("_sum", key, (), data[-2]))
+                samples.append(("_count", key, (), data[-1]))
+        return samples
+
+
+def timed(stage):
+    """Decorator recording the duration of an async function as `stage` in stage_seconds."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with stage_seconds.time(stage=stage):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = Histogram(
+    "ytbot_stage_duration_seconds", "Time spent per pipeline stage.", ["stage"]
+)
+transferred_bytes = Counter(
+    "ytbot_transferred_bytes_total", "Bytes downloaded from sources and uploaded to Telegram.", ["direction"]
+)
+jobs_total = Counter(
+    "ytbot_jobs_total", "Finished jobs by outcome.", ["outcome"]
+)
+flood_waits = Counter(
+    "ytbot_flood_waits_total", "FloodWait errors received from Telegram.", ["source"]
+)
+cache_lookups = Counter(
+    "ytbot_cache_lookups_total", "Lookups of in-process caches by result.", ["cache", "result"]
+)
+flood_wait_seconds = Counter(
+    "ytbot_flood_wait_seconds_total", "Seconds Telegram asked us to wait.", ["source"]
+)
+prefetches_total = Counter(
+    "ytbot_prefetches_total", "Speculative downloads by result (adopted by a job or wasted).", ["result"]
+)
+
+
+def record_flood_wait(source, seconds):
+    flood_waits.inc(source=source)
+    flood_wait_seconds.inc(seconds, source=source)
+
+
+async def handle_metrics(request):
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host, port):
+    """Serve /metrics for scraping; returns the runner (None when disabled or the port is taken)."""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        # Metrics are optional: the bot keeps running without the endpoint
+        logger.error(f"Could not serve metrics on {host}:{port}: {e}")
+        await runner.cleanup()
+        return None
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,103 @@
+import logging
+import os
+import time
+from collections import Counter
+
+from config import Config
+from plugins.custom_thumbnail import probe_media
+from plugins.job_control import run_subprocess
+
+logger = logging.getLogger(__name__)
+
+# Codecs each target container can carry without re-encoding
+CONTAINER_CODECS = {
+    "mp4": {
+        "video": {"h264", "hevc", "av1", "mpeg4", "vp9"},
+        "audio": {"aac", "mp3", "alac", "opus", "ac3", "eac3", "flac"},
+    },
+    "mov": {
+        "video": {"h264", "hevc", "mpeg4", "prores", "mjpeg"},
+        "audio": {"aac", "mp3", "alac", "ac3", "pcm_s16le"},
+    },
+    "webm": {
+        "video": {"vp8", "vp9", "av1"},
+        "audio": {"opus", "vorbis"},
+    },
+}
+
+# Encoders used when a stream really has to be transcoded
+TRANSCODE_ENCODERS = {
+    "mp4": {"video": "libx264", "audio": "aac"},
+    "mov": {"video": "libx264", "audio": "aac"},
+    "webm": {"video": "libvpx-vp9", "audio": "libopus"},
+}
+
+# How many jobs took each path (skip/remux/transcode) and the seconds spent in it
+postprocess_stats = {"count": Counter(), "seconds": Counter()}
+
+
+def _is_attached_pic(stream):
+    # Cover art of m4a/mp3/mp4 files is a video stream too (mjpeg/png)
+    return bool((stream.get("disposition") or {}).get("attached_pic"))
+
+
+def plan_conversion(streams, target_ext):
+    """Return ("remux" | "transcode", ffmpeg codec arguments) for the given streams."""
+    supported = CONTAINER_CODECS.get(target_ext)
+    if supported is None:
+        # mkv and friends accept anything
+        return "remux", ["-c", "copy"]
+    if not streams:
+        # Unknown codecs (ffprobe unavailable): let ffmpeg pick its default encoders
+        return "transcode", []
+
+    args = []
+    transcode = False
+    for kind, flag in (("video", "-c:v"), ("audio", "-c:a")):
+        # Cover art is not mapped (0:V), so its codec does not decide the path
+        codecs = {s.get("codec_name") for s in streams if s.get("codec_type") == kind and not _is_attached_pic(s)}
+        if not codecs:
+            continue
+        if codecs <= supported[kind]:
+            args += [flag, "copy"]
+        else:
+            transcode = True
+            args += [flag, TRANSCODE_ENCODERS[target_ext][kind]]
+            if kind == "video":
+                args += ["-preset", Config.TECH_VJ_FFMPEG_PRESET]
+    return ("transcode" if transcode else "remux"), args
+
+
+# Bring the downloaded file into the requested container with the cheapest path:
+# skip when the extension already matches, stream-copy remux when the codecs fit,
+# and a real transcode (only of the streams that need it) otherwise.
+async def smart_convert(file_path, target_ext):
+    target_ext = target_ext.lower()
+    start = time.time()
+    base, ext = os.path.splitext(file_path)
+    if ext.lstrip(".").lower() == target_ext:
+        path_taken, output_path = "skip", file_path
+    else:
+        streams = (await probe_media(file_path, need_streams=True))["streams"]
+        path_taken, codec_args = plan_conversion(streams, target_ext)
+        output_path = f"{base}.{target_ext}"
+        command = ["ffmpeg", "-y", "-v", "error", "-i", file_path, "-map", "0:V?", "-map", "0:a?"]
+        command += codec_args
+        if path_taken == "transcode":
+            command += ["-threads", str(Config.TECH_VJ_FFMPEG_THREADS)]
+        if target_ext in ("mp4", "mov"):
+            command += ["-movflags", "+faststart"]
+        command.append(output_path)
+
+        returncode, _, stderr = await run_subprocess(*command)
+        if returncode != 0:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise RuntimeError(f"ffmpeg {path_taken} failed for {file_path}: {stderr.decode(errors='ignore')}")
+        os.remove(file_path)
+
+    elapsed = time.time() - start
+    postprocess_stats["count"][path_taken] += 1
+    postprocess_stats["seconds"][path_taken] += elapsed
+    logger.info(f"Postprocess {path_taken} for {os.path.basename(output_path)} took {elapsed:.2f}s")
+    return output_path, path_taken, elapsed
@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from config import Config
+from plugins.format_picker import VIDEO_EXTS, AUDIO_EXTS
+
+logger = logging.getLogger(__name__)
+
+ORDERS = ("best", "smallest")
+# Picks remembered per user for learning
+HISTORY_SIZE = 20
+
+_HEIGHT = re.compile(r"^(\d{3,4})p?$")
+
+
+def parse_preference(text):
+    """Preference from words like "720 mp4 smallest" or "audio m4a"; raises ValueError."""
+    preference = {"kind": "video", "max_height": None, "ext": None, "order": "best"}
+    for word in text.lower().replace("≤", " ").replace("<=", " ").split():
+        height = _HEIGHT.match(word)
+        if height:
+            preference["max_height"] = int(height.group(1))
+        elif word in ("audio", "video"):
+            preference["kind"] = word
+        elif word in ORDERS:
+            preference["order"] = word
+        elif word in VIDEO_EXTS or word in AUDIO_EXTS.values():
+            preference["ext"] = word
+        else:
+            raise ValueError(word)
+    if preference["kind"] == "audio":
+        preference["max_height"] = None
+    return preference
+
+
+def describe_preference(preference):
+    parts = [preference["kind"]]
+    if preference.get("max_height"):
+        parts.append(f"≤{preference['max_height']}p")
+    if preference.get("ext"):
+        parts.append(preference["ext"])
+    parts.append(preference.get("order") or "best")
+    return " ".join(parts)
+
+
+# Per-user preferred quality for the fast path: set explicitly with /quality, or learned
+# once a user picked the same quality and container several times in a row. Only users
+# who turned learning on with /quality auto get a learned preference.
+class PreferenceStore(object):
+    def __init__(self, path, learn_picks):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.learn_picks = learn_picks
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS preferences ("
+            " user_id INTEGER PRIMARY KEY,"
+            " preference TEXT,"  # explicit preference, NULL = none
+            " enabled INTEGER NOT NULL DEFAULT 1,"  # 0 = always show the picker
+            " updated_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS picks ("
+            " user_id INTEGER NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " height INTEGER,"
+            " ext TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS picks_user ON picks (user_id, created_at)")
+
+    def set(self, user_id, preference, enabled=True):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO preferences (user_id, preference, enabled, updated_at) VALUES (?, ?, ?, ?)",
+                (user_id, json.dumps(preference) if preference else None, int(enabled), time.time()),
+            )
+            if not preference:
+                # Starting over: learning must not bring back the old habit right away
+                self._db.execute("DELETE FROM picks WHERE user_id = ?", (user_id,))
+
+    def record_pick(self, user_id, option):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO picks (user_id, kind, height, ext, created_at) VALUES (?, ?, ?, ?, ?)",
+                (user_id, option["kind"], option.get("height"), option["ext"], time.time()),
+            )
+            self._db.execute(
+                "DELETE FROM picks WHERE user_id = ? AND rowid NOT IN"
+                " (SELECT rowid FROM picks WHERE user_id = ? ORDER BY created_at DESC LIMIT ?)",
+                (user_id, user_id, HISTORY_SIZE),
+            )
+
+    def _learned(self, user_id):
+        if not self.learn_picks:
+            return None
+        picks = self._db.execute(
+            "SELECT kind, height, ext FROM picks WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+            (user_id, self.learn_picks),
+        ).fetchall()
+        if len(picks) < self.learn_picks or len(set(picks)) != 1:
+            return None
+        kind, height, ext = picks[0]
+        return {"kind": kind, "max_height": height, "ext": ext, "order": "best", "learned": True}
+
+    def get(self, user_id):
+        """The preference the fast path uses for `user_id`, or None to show the picker."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT preference, enabled FROM preferences WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is not None and not row[1]:
+                return None
+            if row is None:
+                return None
+            if row[0]:
+                return json.loads(row[0])
+            return self._learned(user_id)
+
+    def usual_pick(self, user_id):
+        """The user's most frequent recent pick as a preference, for speculative downloads."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT kind, height, ext, COUNT(*) AS n FROM picks WHERE user_id = ?"
+                " GROUP BY kind, height, ext ORDER BY n DESC, MAX(created_at) DESC LIMIT 1", (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        kind, height, ext, _ = row
+        return {"kind": kind, "max_height": height, "ext": ext, "order": "best"}
+
+
+_preferences = None
+
+
+def get_preference_store():
+    global _preferences
+    if _preferences is None:
+        _preferences = PreferenceStore(Config.TECH_VJ_PREFERENCES_DB_PATH, Config.TECH_VJ_PREFERENCE_LEARN_PICKS)
+    return _preferences
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+
+from config import Config
+from plugins.bandwidth import transfer_user
+from plugins.disk_quota import disk_budget
+from plugins.janitor import janitor
+from plugins.job_control import create_job_control
+from plugins.job_queue import job_scheduler
+from plugins.metrics import prefetches_total
+
+logger = logging.getLogger(__name__)
+
+
+# One speculative download: the option the user will most likely pick is fetched into a
+# workspace of its own while the picker is shown. The job of a matching pick adopts the
+# file (waiting for the rest of the download if needed); anything else discards it.
+# The download holds a download worker slot and runs under a JobControl like any job,
+# so it counts against the stage concurrency and is stopped by deadlines and stalls.
+class Prefetch(object):
+    def __init__(self, key, user_id, option_index, size, download, hold_seconds):
+        self.key = key
+        self.user_id = user_id
+        self.option_index = option_index
+        self.size = size
+        self._download = download
+        self._hold_seconds = hold_seconds
+        self._progress_hook = None
+        self._control = create_job_control(user_id)
+        self._downloaded = asyncio.get_running_loop().create_future()
+        self._released = asyncio.Event()
+        self._task = None
+
+    def start(self, on_done):
+        self._task = asyncio.create_task(self._run())
+        self._task.add_done_callback(lambda _: on_done(self))
+
+    def _on_progress(self, d):
+        self._control.report(d.get("downloaded_bytes"))
+        if self._progress_hook is not None:
+            self._progress_hook(d)
+
+    async def _fetch(self, directory):
+        async with job_scheduler.stage("download"), \
+                self._control.stage("download", Config.TECH_VJ_DOWNLOAD_TIMEOUT, watch_stall=True):
+            return await self._download(directory, self._on_progress)
+
+    async def _run(self):
+        transfer_user.set(self.user_id)
+        try:
+            async with janitor.job_workspace(self.user_id) as workspace:
+                try:
+                    result = await self._control.run(self._fetch(workspace.directory))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # Also a JobCancelled from a deadline or a stall
+                    logger.info(f"Speculative download {self.key} failed: {e}")
+                    result = None
+                if not self._downloaded.done():
+                    self._downloaded.set_result(result)
+                # Files stay until a job takes them over or nobody picked this option in time
+                try:
+                    await asyncio.wait_for(self._released.wait(), timeout=self._hold_seconds)
+                except asyncio.TimeoutError:
+                    logger.info(f"Speculative download {self.key} was not picked, discarding it")
+                    prefetches_total.inc(result="wasted")
+        finally:
+            await disk_budget.release(self.size)
+            if not self._downloaded.done():
+                self._downloaded.set_result(None)
+
+    async def adopt(self, directory, progress_hook):
+        """Wait for the download and move its file into `directory`; returns (info_dict, path),
+        or None when the speculative download failed and the job has to download itself."""
+        self._progress_hook = progress_hook
+        try:
+            result = await asyncio.shield(self._downloaded)
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+        # The hold may have run out between the pick and now, taking the files with it
+        if result is None or self._task.done():
+            self._released.set()
+            return None
+        info_dict, path = result
+        target = os.path.join(directory, os.path.basename(path))
+        try:
+            await asyncio.to_thread(os.replace, path, target)
+        except OSError as e:
+            logger.warning(f"Could not take over speculative download {path}: {e}")
+            return None
+        finally:
+            self._released.set()
+        prefetches_total.inc(result="adopted")
+        return info_dict, target
+
+    def cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    def discard(self):
+        """Drop the files unless a job has taken them over (which also ends the task)."""
+        if not self._released.is_set():
+            self.cancel()
+
+
+# Speculative downloads by picker session key, capped in number and size. Each user has at
+# most one: a newer picker replaces it. Nothing is started that would have to wait for disk.
+class Prefetcher(object):
+    def __init__(self, max_active, max_size, hold_seconds):
+        self.max_active = max_active
+        self.max_size = max_size
+        self.hold_seconds = hold_seconds
+        self._active = {}  # session key -> Prefetch
+
+    def start(self, key, user_id, option_index, size, download):
+        """Speculatively run `download(directory, progress_hook)` for option `option_index` of
+        picker `key` (estimated at `size` bytes); returns False when the limits do not allow it."""
+        for other in [p for p in self._active.values() if p.user_id == user_id]:
+            self.discard(other.key)
+        if not size or size > self.max_size or len(self._active) >= self.max_active:
+            return False
+        if not disk_budget.try_reserve(size):
+            return False
+        prefetch = Prefetch(key, user_id, option_index, size, download, self.hold_seconds)
+        self._active[key] = prefetch
+        prefetch.start(lambda p: self._active.pop(p.key, None) if self._active.get(p.key) is p else None)
+        logger.info(f"Speculatively downloading option {option_index} of {key} ({size} bytes)")
+        return True
+
+    def claim(self, key, option_index):
+        """The prefetch of picker `key` if it fetched `option_index`; any other one is discarded."""
+        prefetch = self._active.pop(key, None)
+        if prefetch is None:
+            return None
+        if prefetch.option_index != option_index:
+            prefetch.cancel()
+            prefetches_total.inc(result="wasted")
+            return None
+        return prefetch
+
+    def discard(self, key):
+        prefetch = self._active.pop(key, None)
+        if prefetch is not None:
+            prefetch.cancel()
+            prefetches_total.inc(result="wasted")
+
+    @property
+    def active(self):
+        return len(self._active)
+
+
+prefetcher = Prefetcher(
+    Config.TECH_VJ_SPECULATIVE_MAX_ACTIVE,
+    Config.TECH_VJ_SPECULATIVE_MAX_SIZE,
+    Config.TECH_VJ_SPECULATIVE_HOLD,
+)
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import time
+
+from pyrogram.errors import MessageNotModified, FloodWait, RPCError
+
+from config import Config
+from plugins.api_scheduler import api_priority, PRIORITY_PROGRESS, RequestDropped
+
+logger = logging.getLogger(__name__)
+
+
+# Spaces out progress edits across all chats so that progress traffic alone
+# can never exceed the configured global rate.
+class EditRateLimiter(object):
+    def __init__(self, edits_per_second):
+        self.interval = 1.0 / edits_per_second
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+# One dispatcher per progress message. Producers call update() as often as they like;
+# only the latest text is kept and it is sent at most once every `interval` seconds.
+class ProgressDispatcher(object):
+    def __init__(self, client, chat_id, message_id, interval, limiter):
+        self.client = client
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = interval
+        self.limiter = limiter
+        self.edits = 0
+        self.skipped = 0
+        self._pending = None
+        self._last_text = None
+        self._last_edit = 0.0
+        self._changed = asyncio.Event()
+        self._task = None
+        self._closed = False
+
+    def update(self, text):
+        if self._closed:
+            return
+        if self._pending is not None and self._pending != self._last_text:
+            self.skipped += 1
+        self._pending = text
+        self._changed.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        # Every edit from this task queues behind user-visible replies in the API scheduler
+        api_priority.set(PRIORITY_PROGRESS)
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            delay = self._last_edit + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            text = self._pending
+            if text is None or text == self._last_text:
+                continue
+            await self.limiter.acquire()
+            if self._closed:
+                return
+            try:
+                await self.client.edit_message_text(
+                    self.chat_id, self.message_id, text=text,
+                    reply_markup=_markups.get((self.chat_id, self.message_id))
+                )
+                self._last_text = text
+                self.edits += 1
+            except MessageNotModified:
+                self._last_text = text
+            except FloodWait as e:
+                # Only this message backs off, newer updates keep replacing the pending text
+                logger.warning(f"FloodWait on progress message {self.chat_id}/{self.message_id}: {e.value} seconds")
+                self._last_edit = time.monotonic() + e.value
+                self._changed.set()
+                continue
+            except RequestDropped:
+                # Too late to be useful; retry with whatever text is latest after the interval
+                self.skipped += 1
+                self._changed.set()
+            except RPCError as e:
+                logger.error(f"Pyrogram RPCError during progress update: {e}")
+            except Exception as e:
+                logger.warning(f"General error updating progress message: {e}")
+            self._last_edit = time.monotonic()
+
+    async def close(self):
+        """Stop the dispatcher and drop any pending text, so it cannot overwrite later edits."""
+        self._closed = True
+        _dispatchers.pop((self.chat_id, self.message_id), None)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logger.debug(f"Progress dispatcher {self.chat_id}/{self.message_id} closed "
+                     f"({self.edits} edits, {self.skipped} coalesced updates)")
+
+
+edit_rate_limiter = EditRateLimiter(Config.TECH_VJ_PROGRESS_GLOBAL_EDITS_PER_SEC)
+_dispatchers = {}
+_markups = {}  # (chat_id, message_id) -> reply markup kept on every progress edit
+
+
+def set_progress_markup(chat_id, message_id, reply_markup):
+    """Keep `reply_markup` (e.g. a cancel button) on the progress message; None removes it."""
+    if reply_markup is None:
+        _markups.pop((chat_id, message_id), None)
+    else:
+        _markups[(chat_id, message_id)] = reply_markup
+
+
+def get_progress_dispatcher(client, chat_id, message_id):
+    """Return the open dispatcher of a progress message, creating it on first use."""
+    key = (chat_id, message_id)
+    dispatcher = _dispatchers.get(key)
+    if dispatcher is None:
+        dispatcher = ProgressDispatcher(
+            client, chat_id, message_id, Config.TECH_VJ_PROGRESS_UPDATE_INTERVAL, edit_rate_limiter
+        )
+        _dispatchers[key] = dispatcher
+    return dispatcher
+
+
+def register_progress_sink(chat_id, message_id, sink):
+    """Route the progress of (chat_id, message_id) to `sink` (any object with update() and async close())."""
+    _dispatchers[(chat_id, message_id)] = sink
+
+
+def unregister_progress_sink(chat_id, message_id):
+    _dispatchers.pop((chat_id, message_id), None)
+
+
+async def close_progress_dispatcher(chat_id, message_id):
+    dispatcher = _dispatchers.get((chat_id, message_id))
+    if dispatcher is not None:
+        await dispatcher.close()
@@ -0,0 +1,233 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+import aiohttp
+
+from config import Config
+from plugins.bandwidth import bandwidth, DOWNLOAD
+from plugins.ytdl_executor import DownloadTooLarge
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = 0.5
+STATE_SAVE_INTERVAL = 5
+SEGMENT_RETRIES = 3
+
+_http_session = None
+
+
+def get_http_session():
+    """Shared aiohttp session, so all direct downloads reuse one connection pool."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(limit=Config.TECH_VJ_HTTP_POOL_SIZE, limit_per_host=0)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+        _http_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _http_session
+
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+# Return the format dict of `format_id` if it is a single plain HTTP(S) file
+def find_direct_http_format(info_dict, format_id):
+    if not info_dict or "+" in format_id or "/" in format_id:
+        return None
+    for f in info_dict.get("formats") or []:
+        if f.get("format_id") != format_id:
+            continue
+        if f.get("protocol") not in ("http", "https") or f.get("fragments") or not f.get("url"):
+            return None
+        return f
+    return None
+
+
+async def get_content_length(session, url, headers):
+    try:
+        async with session.head(url, headers=headers, allow_redirects=True) as resp:
+            if resp.status < 400 and resp.headers.get("Content-Length"):
+                return int(resp.headers["Content-Length"])
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        logger.warning(f"HEAD request failed for {url}: {e}")
+    return None
+
+
+async def probe_range_support(session, url, headers):
+    """Return the total size if the server honours byte ranges, otherwise None."""
+    try:
+        async with session.get(url, headers=dict(headers, Range="bytes=0-0")) as resp:
+            if resp.status != 206:
+                return None
+            content_range = resp.headers.get("Content-Range", "")
+            total = content_range.rpartition("/")[2]
+            return int(total) if total.isdigit() else None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning(f"Range probe failed for {url}: {e}")
+        return None
+
+
+# Downloads one file over N parallel HTTP range requests into a preallocated file.
+# Per-segment progress is checkpointed next to the file so an interrupted download resumes.
+class SegmentedDownloader(object):
+    def __init__(self, url, headers, file_path, connections, progress_hook=None, max_bytes=None):
+        self.url = url
+        self.max_bytes = max_bytes
+        self.headers = headers or {}
+        self.file_path = file_path
+        self.state_path = file_path + ".segments.json"
+        self.connections = connections
+        self.progress_hook = progress_hook
+        self.total_size = None
+        self.segments = []  # [start, end (inclusive), downloaded]
+        self._fd = None
+        self._writes = set()  # pwrite calls still running in a thread
+        self._started = None
+        self._resumed_bytes = 0
+        self._last_progress = 0.0
+        self._last_state_save = 0.0
+
+    @property
+    def downloaded(self):
+        return sum(done for _, _, done in self.segments)
+
+    def _plan_segments(self):
+        if os.path.exists(self.state_path) and os.path.exists(self.file_path):
+            try:
+                with open(self.state_path) as f:
+                    state = json.load(f)
+                if state.get("url_size") == self.total_size:
+                    self.segments = state["segments"]
+                    logger.info(f"Resuming {self.file_path} from {self.downloaded} bytes")
+                    return
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Ignoring unreadable segment state {self.state_path}: {e}")
+        size = self.total_size
+        count = max(1, min(self.connections, size // Config.TECH_VJ_CHUNK_SIZE or 1))
+        step = size // count
+        self.segments = []
+        for i in range(count):
+            start = i * step
+            end = size - 1 if i == count - 1 else start + step - 1
+            self.segments.append([start, end, 0])
+
+    def _save_state(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_state_save < STATE_SAVE_INTERVAL:
+            return
+        self._last_state_save = now
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"url_size": self.total_size, "segments": self.segments}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _report(self, status="downloading", force=False):
+        if self.progress_hook is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_progress < PROGRESS_INTERVAL:
+            return
+        self._last_progress = now
+        elapsed = max(now - self._started, 0.001)
+        speed = (self.downloaded - self._resumed_bytes) / elapsed
+        remaining = self.total_size - self.downloaded
+        self.progress_hook({
+            "status": status,
+            "downloaded_bytes": self.downloaded,
+            "total_bytes": self.total_size,
+            "speed": speed,
+            "eta": int(remaining / speed) if speed else None,
+            "elapsed": elapsed,
+            "filename": self.file_path,
+        })
+
+    async def _download_segment(self, session, segment):
+        chunk_size = Config.TECH_VJ_CHUNK_SIZE
+        for attempt in range(1, SEGMENT_RETRIES + 1):
+            start, end, done = segment
+            if start + done > end:
+                return
+            headers = dict(self.headers, Range=f"bytes={start + done}-{end}")
+            try:
+                async with session.get(self.url, headers=headers) as resp:
+                    if resp.status != 206:
+                        raise IOError(f"Expected 206 for range request, got {resp.status}")
+                    buffer = bytearray()
+                    async for data in resp.content.iter_chunked(64 * 1024):
+                        await bandwidth.consume(DOWNLOAD, len(data))
+                        buffer.extend(data)
+                        if len(buffer) >= chunk_size:
+                            await self._write(segment, buffer)
+                            buffer = bytearray()
+                    if buffer:
+                        await self._write(segment, buffer)
+                if segment[0] + segment[2] <= segment[1]:
+                    raise IOError("Segment ended early")
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError, IOError) as e:
+                if attempt == SEGMENT_RETRIES:
+                    raise
+                logger.warning(f"Segment {start}-{end} of {self.file_path} failed (attempt {attempt}): {e}")
+                await asyncio.sleep(attempt)
+
+    async def _write(self, segment, buffer):
+        offset = segment[0] + segment[2]
+        data = bytes(buffer[:segment[1] - offset + 1])
+        # The thread cannot be stopped, so a cancelled segment leaves the write running
+        # and download() waits for it before the file is closed
+        write = asyncio.ensure_future(asyncio.to_thread(os.pwrite, self._fd, data, offset))
+        self._writes.add(write)
+        write.add_done_callback(self._writes.discard)
+        await asyncio.shield(write)
+        segment[2] += len(data)
+        self._save_state()
+        self._report()
+
+    async def download(self):
+        """Download the file; returns its path, or None when the server has no range support."""
+        session = get_http_session()
+        self.total_size = await probe_range_support(session, self.url, self.headers)
+        if not self.total_size:
+            return None
+        if self.max_bytes and self.total_size > self.max_bytes:
+            raise DownloadTooLarge(f"{self.url} is {self.total_size} bytes, over the limit of {self.max_bytes} bytes")
+
+        self._plan_segments()
+        self._resumed_bytes = self.downloaded
+        self._started = time.monotonic()
+        self._fd = os.open(self.file_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(self._fd).st_size != self.total_size:
+                if hasattr(os, "posix_fallocate"):
+                    await asyncio.to_thread(os.posix_fallocate, self._fd, 0, self.total_size)
+                else:
+                    os.ftruncate(self._fd, self.total_size)
+            tasks = [asyncio.create_task(self._download_segment(session, seg)) for seg in self.segments]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                # gather does not stop the other segments when one fails (or on cancellation)
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except BaseException:
+            self._save_state(force=True)
+            raise
+        finally:
+            if self._writes:
+                await asyncio.gather(*self._writes, return_exceptions=True)
+            os.close(self._fd)
+            self._fd = None
+
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        self._report(status="finished", force=True)
+        logger.info(f"Segmented download of {self.file_path} ({self.total_size} bytes, "
+                    f"{len(self.segments)} connections) took {time.monotonic() - self._started:.2f}s")
+        return self.file_path
@@ -0,0 +1,244 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+# Base class for the pending-picker session stores.
+# Values must be JSON serialisable so that every backend can persist them.
+class SessionStore(object):
+    def __init__(self, max_entries, ttl, max_per_user):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_per_user = max_per_user
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def put(self, key, value, user_id=None):
+        raise NotImplementedError
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def pop(self, key):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self).__name__,
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+
+# In-memory LRU backend with TTL expiry and per-user quotas
+class MemorySessionStore(SessionStore):
+    def __init__(self, max_entries, ttl, max_per_user):
+        super().__init__(max_entries, ttl, max_per_user)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, user_id, expires_at)
+        self._user_keys = {}  # user_id -> OrderedDict of keys, oldest first
+
+    def _drop(self, key):
+        _, user_id, _ = self._entries.pop(key)
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.pop(key, None)
+            if not keys:
+                del self._user_keys[user_id]
+
+    def _purge_expired(self, now):
+        expired = [k for k, (_, _, exp) in self._entries.items() if exp <= now]
+        for key in expired:
+            self._drop(key)
+        self.evictions += len(expired)
+
+    def put(self, key, value, user_id=None):
+        now = time.time()
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if len(self._entries) >= self.max_entries:
+                self._purge_expired(now)
+
+            keys = self._user_keys.setdefault(user_id, OrderedDict())
+            while user_id is not None and self.max_per_user and len(keys) >= self.max_per_user:
+                oldest = next(iter(keys))
+                self._drop(oldest)
+                self.evictions += 1
+                keys = self._user_keys.setdefault(user_id, OrderedDict())
+
+            while self._entries and len(self._entries) >= self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+            self._entries[key] = (value, user_id, now + self.ttl)
+            self._user_keys.setdefault(user_id, OrderedDict())[key] = None
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, _, expires_at = entry
+            if expires_at <= now:
+                self._drop(key)
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._drop(key)
+            return entry[0] if entry[2] > time.time() else None
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# SQLite backend so that pending quality pickers survive a restart
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path, max_entries, ttl, max_per_user):
+        super().__init__(max_entries, ttl, max_per_user)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " key TEXT PRIMARY KEY,"
+            " user_id INTEGER,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_user ON sessions (user_id, last_access)")
+        with self._lock:
+            self._purge_expired(time.time())
+
+    def _purge_expired(self, now):
+        cur = self._db.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+        self.evictions += cur.rowcount
+
+    def put(self, key, value, user_id=None):
+        now = time.time()
+        payload = json.dumps(value)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM sessions WHERE key = ?", (key,))
+                if len(self) >= self.max_entries:
+                    self._purge_expired(now)
+
+                if user_id is not None and self.max_per_user:
+                    (count,) = self._db.execute(
+                        "SELECT COUNT(*) FROM sessions WHERE user_id = ?", (user_id,)
+                    ).fetchone()
+                    overflow = count - self.max_per_user + 1
+                    if overflow > 0:
+                        cur = self._db.execute(
+                            "DELETE FROM sessions WHERE key IN ("
+                            " SELECT key FROM sessions WHERE user_id = ?"
+                            " ORDER BY last_access LIMIT ?)",
+                            (user_id, overflow),
+                        )
+                        self.evictions += cur.rowcount
+
+                overflow = len(self) - self.max_entries + 1
+                if overflow > 0:
+                    cur = self._db.execute(
+                        "DELETE FROM sessions WHERE key IN ("
+                        " SELECT key FROM sessions ORDER BY last_access LIMIT ?)",
+                        (overflow,),
+                    )
+                    self.evictions += cur.rowcount
+
+                self._db.execute(
+                    "INSERT INTO sessions (key, user_id, value, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, user_id, payload, now + self.ttl, now),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM sessions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, expires_at = row
+            if expires_at <= now:
+                self._db.execute("DELETE FROM sessions WHERE key = ?", (key,))
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE sessions SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(value)
+
+    def pop(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM sessions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("DELETE FROM sessions WHERE key = ?", (key,))
+            return json.loads(row[0]) if row[1] > time.time() else None
+
+    def __len__(self):
+        (count,) = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()
+        return count
+
+
+def create_session_store():
+    backend = Config.TECH_VJ_SESSION_BACKEND.lower()
+    if backend == "sqlite":
+        store = SQLiteSessionStore(
+            Config.TECH_VJ_SESSION_DB_PATH,
+            Config.TECH_VJ_SESSION_MAX_ENTRIES,
+            Config.TECH_VJ_SESSION_TTL,
+            Config.TECH_VJ_SESSION_MAX_PER_USER,
+        )
+    elif backend == "memory":
+        store = MemorySessionStore(
+            Config.TECH_VJ_SESSION_MAX_ENTRIES,
+            Config.TECH_VJ_SESSION_TTL,
+            Config.TECH_VJ_SESSION_MAX_PER_USER,
+        )
+    else:
+        raise ValueError(f"Unknown session backend: {Config.TECH_VJ_SESSION_BACKEND}")
+    logger.info(f"Using {type(store).__name__} for pending picker sessions")
+    return store
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import os
+
+from plugins.custom_thumbnail import probe_media
+from plugins.job_control import run_subprocess
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTS = (".mp4", ".mkv", ".webm", ".mov")
+# Segments end at the first keyframe after the cut point and bitrate varies, so aim lower
+SEGMENT_SAFETY = 0.9
+# A segment that still came out too big is cut again, this many times at most
+MAX_RESPLITS = 2
+COPY_BLOCK = 8 * 1024 * 1024
+POLL_INTERVAL = 1
+
+
+def _copy_part(source, part_path, part_size):
+    written = 0
+    with open(part_path, "wb") as part:
+        while written < part_size:
+            block = source.read(min(COPY_BLOCK, part_size - written))
+            if not block:
+                break
+            part.write(block)
+            written += len(block)
+    if not written:
+        os.remove(part_path)
+    return written
+
+
+async def split_bytes(path, part_size):
+    """Yield byte-range parts path.001, path.002, ... of `path`, each once it is fully written."""
+    index = 1
+    with open(path, "rb") as source:
+        while True:
+            part_path = f"{path}.{index:03d}"
+            if not await asyncio.to_thread(_copy_part, source, part_path, part_size):
+                return
+            yield part_path
+            index += 1
+
+
+async def split_video(path, segment_time):
+    """Yield stream-copy segments of about `segment_time` seconds, cut at keyframes by ffmpeg's
+    segment muxer. A segment is yielded as soon as ffmpeg has moved on to the next one."""
+    base, ext = os.path.splitext(path)
+    pattern = f"{base}.part%03d{ext}"
+    command = [
+        "ffmpeg", "-y", "-v", "error", "-i", path, "-map", "0:v?", "-map", "0:a?", "-c", "copy",
+        "-f", "segment", "-segment_time", f"{segment_time:.3f}", "-reset_timestamps", "1", pattern
+    ]
+    process = asyncio.create_task(run_subprocess(*command))
+    index = 0
+    try:
+        while True:
+            current = pattern % index
+            finished = process.done()
+            if os.path.exists(pattern % (index + 1)) or (finished and os.path.exists(current)):
+                yield current
+                index += 1
+            elif finished:
+                break
+            else:
+                await asyncio.wait({process}, timeout=POLL_INTERVAL)
+        returncode, _, stderr = process.result()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg could not split {path}: {stderr.decode(errors='ignore')}")
+    finally:
+        if not process.done():
+            # run_subprocess kills ffmpeg when cancelled
+            process.cancel()
+            await asyncio.gather(process, return_exceptions=True)
+
+
+async def _video_parts(path, duration, max_size, part_size, depth=0):
+    size = os.path.getsize(path)
+    segment_time = max(1.0, duration * part_size / size * SEGMENT_SAFETY)
+    async for segment in split_video(path, segment_time):
+        segment_size = os.path.getsize(segment)
+        if segment_size <= max_size:
+            yield segment, True
+            continue
+        # A bitrate spike: cut this segment again, shorter, or give up and send it in bytes
+        probe = await probe_media(segment)
+        if depth < MAX_RESPLITS and probe["duration"] > 1:
+            logger.info(f"Segment {segment} is {segment_size} bytes, splitting it again")
+            async for part in _video_parts(segment, probe["duration"], max_size, part_size, depth + 1):
+                yield part
+        else:
+            async for part in split_bytes(segment, part_size):
+                yield part, False
+        os.remove(segment)
+
+
+async def _parts(path, max_size, part_size):
+    duration = 0
+    if path.lower().endswith(VIDEO_EXTS):
+        duration = (await probe_media(path))["duration"]
+    if duration:
+        async for part in _video_parts(path, duration, max_size, part_size):
+            yield part
+    else:
+        async for part in split_bytes(path, part_size):
+            yield part, False
+
+
+async def iter_upload_parts(path, max_size, part_size, ahead=1):
+    """Yield (part_path, playable) for every part of `path` no larger than `max_size`.
+
+    Videos are cut into playable keyframe-aligned segments without re-encoding, anything
+    else (or a video without a known duration) into byte-range parts. The next part is cut
+    while the caller uploads the current one; at most `ahead` finished parts wait.
+    """
+    queue = asyncio.Queue(maxsize=ahead)
+
+    async def produce():
+        try:
+            async for item in _parts(path, max_size, part_size):
+                await queue.put(item)
+        except Exception:
+            await queue.put(None)
+            raise
+        await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            yield item
+        # Re-raises a splitting error after the parts that did work were sent
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
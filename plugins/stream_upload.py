@@ -0,0 +1,104 @@
+import logging
+import os
+
+from pyrogram import raw, types, utils
+
+from config import Config
+from plugins.segmented_download import find_direct_http_format, get_content_length, get_http_session
+from plugins.upload_engine import PartUploader, upload_part_size
+
+logger = logging.getLogger(__name__)
+
+# MIME types of audio-only streams whose extension is registered as video (or not at all)
+AUDIO_MIME_TYPES = {"mp4": "audio/mp4", "webm": "audio/webm", "mkv": "audio/x-matroska", "opus": "audio/ogg"}
+
+# Return the format dict of `format_id` if it can be piped straight into Telegram:
+# a single progressive HTTP(S) file that already has the target extension.
+def find_streamable_format(info_dict, format_id, target_ext):
+    fmt = find_direct_http_format(info_dict, format_id)
+    if fmt is None or (fmt.get("ext") or "").lower() != target_ext.lower():
+        return None
+    return fmt
+
+
+async def _http_parts(response, part_size):
+    index = 0
+    buffer = bytearray()
+    async for data in response.content.iter_chunked(64 * 1024):
+        buffer.extend(data)
+        while len(buffer) >= part_size:
+            yield index, bytes(buffer[:part_size])
+            del buffer[:part_size]
+            index += 1
+    if buffer:
+        yield index, bytes(buffer)
+
+
+async def send_uploaded_media(client, chat_id, media, caption, reply_to_message_id):
+    r = await client.invoke(
+        raw.functions.messages.SendMedia(
+            peer=await client.resolve_peer(chat_id),
+            media=media,
+            reply_to_msg_id=reply_to_message_id,
+            random_id=client.rnd_id(),
+            **await utils.parse_text_entities(client, caption, None, None)
+        )
+    )
+    for update in r.updates:
+        if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(
+                client, update.message,
+                {u.id: u for u in r.users},
+                {c.id: c for c in r.chats},
+            )
+    return None
+
+
+# Pipe a progressive HTTP format straight into Telegram's chunked upload.
+# Only `STREAM_BUFFER_PARTS` upload parts are held in memory and nothing touches the disk.
+async def stream_url_to_telegram(client, chat_id, fmt, info_dict, file_name, caption, reply_to_message_id,
+                                 thumb_path=None, progress=None, progress_args=()):
+    headers = fmt.get("http_headers") or {}
+    session = get_http_session()
+    total_size = fmt.get("filesize") or await get_content_length(session, fmt["url"], headers)
+    if not total_size or total_size > Config.TECH_VJ_TG_MAX_FILE_SIZE:
+        return None
+
+    async with session.get(fmt["url"], headers=headers) as response:
+        response.raise_for_status()
+        uploader = PartUploader(client, total_size, upload_part_size(), Config.TECH_VJ_STREAM_UPLOAD_WORKERS,
+                                sessions=getattr(client, "upload_sessions", None),
+                                progress=progress, progress_args=progress_args)
+        if uploader.sessions is not None:
+            await uploader.sessions.start()
+        input_file = await uploader.upload(
+            _http_parts(response, uploader.part_size), file_name, Config.TECH_VJ_STREAM_BUFFER_PARTS
+        )
+    if uploader.uploaded != total_size:
+        raise IOError(f"Stream ended after {uploader.uploaded} of {total_size} bytes")
+
+    thumb = await client.save_file(thumb_path) if thumb_path and os.path.exists(thumb_path) else None
+    ext = os.path.splitext(file_name)[1].lstrip(".").lower()
+    guessed = client.guess_mime_type(file_name) or ""
+    if fmt.get("vcodec") not in (None, "none"):
+        attributes = [
+            raw.types.DocumentAttributeVideo(
+                duration=int(info_dict.get("duration") or 0),
+                w=fmt.get("width") or 0,
+                h=fmt.get("height") or 0,
+                supports_streaming=True,
+            ),
+            raw.types.DocumentAttributeFilename(file_name=file_name),
+        ]
+        mime_type = guessed if guessed.startswith("video/") else "video/mp4"
+    else:
+        attributes = [
+            raw.types.DocumentAttributeAudio(duration=int(info_dict.get("duration") or 0)),
+            raw.types.DocumentAttributeFilename(file_name=file_name),
+        ]
+        mime_type = guessed if guessed.startswith("audio/") else AUDIO_MIME_TYPES.get(ext, "audio/mpeg")
+
+    media = raw.types.InputMediaUploadedDocument(
+        file=input_file, mime_type=mime_type, attributes=attributes, thumb=thumb
+    )
+    return await send_uploaded_media(client, chat_id, media, caption, reply_to_message_id)
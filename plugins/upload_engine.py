@@ -0,0 +1,209 @@
+import asyncio
+import inspect
+import itertools
+import logging
+import os
+import time
+
+from pyrogram import raw
+from pyrogram.errors import FloodWait
+from pyrogram.session import Session
+
+from config import Config
+from plugins.bandwidth import bandwidth, UPLOAD
+from plugins.metrics import record_flood_wait
+from plugins.api_scheduler import ScheduledClient
+
+logger = logging.getLogger(__name__)
+
+# Telegram accepts parts of at most 512 KiB whose size divides 512 KiB; files above 10 MiB use "big" parts
+MAX_PART_SIZE = 512 * 1024
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024
+PART_RETRIES = 5
+
+
+def upload_part_size():
+    size = Config.TECH_VJ_UPLOAD_PART_SIZE_KB * 1024
+    if size <= 0 or MAX_PART_SIZE % size:
+        logger.warning(f"Invalid UPLOAD_PART_SIZE_KB={Config.TECH_VJ_UPLOAD_PART_SIZE_KB}, using 512")
+        return MAX_PART_SIZE
+    return size
+
+
+# A small pool of extra MTProto media sessions of one client, started lazily and kept
+# open between jobs, so file parts travel over several connections in parallel.
+class UploadSessionPool(object):
+    def __init__(self, client, size):
+        self.client = client
+        self.size = size
+        self._sessions = []
+        self._lock = asyncio.Lock()
+        self._next = itertools.cycle(range(size))
+
+    async def start(self):
+        async with self._lock:
+            if self._sessions:
+                return
+            dc_id = await self.client.storage.dc_id()
+            auth_key = await self.client.storage.auth_key()
+            test_mode = await self.client.storage.test_mode()
+            for _ in range(self.size):
+                session = Session(self.client, dc_id, auth_key, test_mode, is_media=True)
+                await session.start()
+                self._sessions.append(session)
+            logger.info(f"Started {self.size} upload sessions")
+
+    def next_session(self):
+        return self._sessions[next(self._next)]
+
+    async def stop(self):
+        async with self._lock:
+            for session in self._sessions:
+                await session.stop()
+            self._sessions = []
+
+
+# Uploads file parts from an async source of (index, bytes) pairs, keeping up to
+# `in_flight` parts in transfer across the session pool and retrying failed parts alone.
+class PartUploader(object):
+    def __init__(self, client, total_size, part_size, in_flight, sessions=None, progress=None, progress_args=()):
+        self.client = client
+        self.total_size = total_size
+        self.part_size = part_size
+        self.in_flight = in_flight
+        self.sessions = sessions
+        self.progress = progress
+        self.progress_args = progress_args
+        self.is_big = total_size > BIG_FILE_THRESHOLD
+        self.total_parts = max(1, (total_size + part_size - 1) // part_size)
+        self.file_id = client.rnd_id()
+        self.uploaded = 0
+        self.retried_parts = 0
+        self.started = None
+        self.finished = None
+
+    @property
+    def throughput(self):
+        """Average upload speed of this job in bytes per second."""
+        end = self.finished or time.monotonic()
+        return self.uploaded / max(end - (self.started or end), 0.001)
+
+    async def _invoke(self, request):
+        if self.sessions is not None:
+            return await self.sessions.next_session().invoke(request)
+        return await self.client.invoke(request)
+
+    async def _save_part(self, index, chunk):
+        if self.is_big:
+            request = raw.functions.upload.SaveBigFilePart(
+                file_id=self.file_id, file_part=index, file_total_parts=self.total_parts, bytes=chunk
+            )
+        else:
+            request = raw.functions.upload.SaveFilePart(file_id=self.file_id, file_part=index, bytes=chunk)
+
+        await bandwidth.consume(UPLOAD, len(chunk))
+        for attempt in range(1, PART_RETRIES + 1):
+            try:
+                await self._invoke(request)
+                break
+            except FloodWait as e:
+                logger.warning(f"FloodWait while uploading part {index}: {e.value} seconds")
+                record_flood_wait("upload", e.value)
+                await asyncio.sleep(e.value)
+            except (OSError, asyncio.TimeoutError) as e:
+                if attempt == PART_RETRIES:
+                    raise
+                logger.warning(f"Upload of part {index} failed (attempt {attempt}), retrying: {e}")
+                await asyncio.sleep(attempt)
+            self.retried_parts += 1
+        else:
+            raise IOError(f"Part {index} could not be uploaded")
+
+        self.uploaded += len(chunk)
+        if self.progress:
+            result = self.progress(self.uploaded, self.total_size, *self.progress_args)
+            if inspect.isawaitable(result):
+                await result
+
+    async def _worker(self, queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            await self._save_part(*item)
+
+    @staticmethod
+    async def _put(queue, item, workers):
+        """queue.put that fails as soon as a worker does: with the workers dead nothing
+        would ever make room in the queue again."""
+        put = asyncio.ensure_future(queue.put(item))
+        try:
+            while not put.done():
+                await asyncio.wait([put, *[w for w in workers if not w.done()]], return_when=asyncio.FIRST_COMPLETED)
+                for task in workers:
+                    if task.done() and not task.cancelled() and task.exception():
+                        raise task.exception()
+        finally:
+            put.cancel()
+
+    async def upload(self, parts, file_name, buffer_parts=None):
+        with bandwidth.active(UPLOAD):
+            return await self._upload(parts, file_name, buffer_parts)
+
+    async def _upload(self, parts, file_name, buffer_parts):
+        self.started = time.monotonic()
+        queue = asyncio.Queue(maxsize=buffer_parts or self.in_flight)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.in_flight)]
+        try:
+            async for index, chunk in parts:
+                await self._put(queue, (index, chunk), workers)
+            for _ in workers:
+                await self._put(queue, None, workers)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+        self.finished = time.monotonic()
+
+        logger.info(f"Uploaded {file_name}: {self.uploaded} bytes in {self.total_parts} parts at "
+                    f"{self.throughput / 1024 / 1024:.2f} MiB/s ({self.retried_parts} retried parts)")
+        if self.is_big:
+            return raw.types.InputFileBig(id=self.file_id, parts=self.total_parts, name=file_name)
+        return raw.types.InputFile(id=self.file_id, parts=self.total_parts, name=file_name, md5_checksum="")
+
+
+async def _file_parts(file_path, part_size):
+    with open(file_path, "rb") as fp:
+        index = 0
+        while True:
+            chunk = await asyncio.to_thread(fp.read, part_size)
+            if not chunk:
+                return
+            yield index, chunk
+            index += 1
+
+
+# Client whose uploads of big local files go through the parallel upload engine.
+# Every send_* method uses save_file, so progress_for_pyrogram keeps working unchanged.
+# Chat-bound API calls go through the outbound scheduler of ScheduledClient.
+class ParallelUploadClient(ScheduledClient):
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("max_concurrent_transmissions", Config.TECH_VJ_UPLOAD_WORKERS)
+        super().__init__(*args, **kwargs)
+        self.upload_sessions = UploadSessionPool(self, Config.TECH_VJ_UPLOAD_SESSIONS)
+
+    async def save_file(self, path, file_id=None, file_part=0, progress=None, progress_args=()):
+        if not isinstance(path, str) or file_id is not None or os.path.getsize(path) <= BIG_FILE_THRESHOLD:
+            return await super().save_file(path, file_id, file_part, progress, progress_args)
+
+        await self.upload_sessions.start()
+        uploader = PartUploader(
+            self, os.path.getsize(path), upload_part_size(), Config.TECH_VJ_UPLOAD_PARTS_IN_FLIGHT,
+            sessions=self.upload_sessions, progress=progress, progress_args=progress_args
+        )
+        async with self.save_file_semaphore:
+            return await uploader.upload(_file_parts(path, uploader.part_size), os.path.basename(path))
+
+    async def stop(self, *args, **kwargs):
+        await self.upload_sessions.stop()
+        return await super().stop(*args, **kwargs)
@@ -0,0 +1,410 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor
+
+import yt_dlp as youtube_dl
+
+from config import Config
+from plugins.metrics import stage_seconds
+
+logger = logging.getLogger(__name__)
+
+# Options that only make sense in the calling process and are re-created by the executor
+LOCAL_OPTIONS = ("logger", "progress_hooks")
+
+# Progress fields forwarded from worker processes (the full dict is not picklable)
+PROGRESS_FIELDS = (
+    "status", "downloaded_bytes", "total_bytes", "total_bytes_estimate", "speed", "eta",
+    "elapsed", "filename", "tmpfilename", "fragment_index", "fragment_count",
+)
+PROGRESS_INTERVAL = 0.5
+# The cancel flag of process workers is a manager proxy, so it is polled at most this often
+CANCEL_CHECK_INTERVAL = 0.5
+
+# Options that differ per call and are set on a pooled instance for each call instead of
+# being part of its key; yt-dlp reads them when it needs them (the format selector is rebuilt)
+CALL_OPTIONS = ("format", "paths", "merge_output_format")
+# Distinct option sets kept warm, least recently used dropped first
+MAX_POOL_KEYS = 16
+
+
+class DownloadTooLarge(youtube_dl.utils.DownloadError):
+    """Raised when a download grows past its size limit mid-stream."""
+
+
+# Set in every worker process by _init_worker
+_progress_queue = None
+
+
+def _init_worker(progress_queue, warm_options):
+    global _progress_queue
+    _progress_queue = progress_queue
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logging.getLogger("yt_dlp").setLevel(logging.WARNING)
+    # Every (re)started worker builds its instances before taking its first job
+    _warm_pool(warm_options)
+
+
+def _forward_progress(job_id):
+    last_sent = [0.0]
+
+    def hook(d):
+        now = time.monotonic()
+        if d.get("status") == "downloading" and now - last_sent[0] < PROGRESS_INTERVAL:
+            return
+        last_sent[0] = now
+        _progress_queue.put((job_id, {k: d[k] for k in PROGRESS_FIELDS if k in d}))
+
+    return hook
+
+
+def _size_guard_hook(max_bytes):
+    # Runs in the thread/process that runs yt-dlp, so raising here stops the download
+    downloaded = {}
+
+    def hook(d):
+        if d.get("status") != "downloading":
+            return
+        downloaded[d.get("filename")] = d.get("downloaded_bytes") or 0
+        total = sum(downloaded.values())
+        if total > max_bytes:
+            raise DownloadTooLarge(f"Download aborted: {total} bytes exceeds the limit of {max_bytes} bytes")
+
+    return hook
+
+
+def _cancel_hook(cancel_event):
+    # yt-dlp cannot be interrupted from outside its thread, so a cancelled job stops at the next progress event
+    last_check = [0.0]
+
+    def hook(d):
+        now = time.monotonic()
+        if d.get("status") == "downloading" and now - last_check[0] < CANCEL_CHECK_INTERVAL:
+            return
+        last_check[0] = now
+        if cancel_event.is_set():
+            raise youtube_dl.utils.DownloadCancelled("Job cancelled")
+
+    return hook
+
+
+def _throttle_hook(hold, cancel_event):
+    # The parent charges the downloaded bytes to its rate limiter and pushes `hold.value`
+    # (a wall-clock time, shared with worker processes) forward; yt-dlp sleeps until then
+    last_check = [0.0]
+
+    def hook(d):
+        now = time.monotonic()
+        if d.get("status") != "downloading" or now - last_check[0] < CANCEL_CHECK_INTERVAL:
+            return
+        last_check[0] = now
+        while True:
+            wait = hold.value - time.time()
+            if wait <= 0:
+                return
+            if cancel_event is not None and cancel_event.is_set():
+                raise youtube_dl.utils.DownloadCancelled("Job cancelled")
+            time.sleep(min(wait, CANCEL_CHECK_INTERVAL))
+
+    return hook
+
+
+def _charge_progress(progress_hook, throttle, hold):
+    # Runs on the event loop: passes each newly downloaded delta to `throttle`
+    downloaded = {}
+
+    def hook(d):
+        if d.get("status") == "downloading":
+            name = d.get("filename")
+            delta = (d.get("downloaded_bytes") or 0) - downloaded.get(name, 0)
+            downloaded[name] = d.get("downloaded_bytes") or 0
+            wait = throttle(delta) if delta > 0 else 0
+            if wait > 0:
+                hold.value = max(hold.value, time.time() + wait)
+        if progress_hook is not None:
+            progress_hook(d)
+
+    return hook
+
+
+def _pool_key(opts):
+    return repr(sorted((k, v) for k, v in opts.items() if k not in CALL_OPTIONS))
+
+
+# A YoutubeDL built once and reused: its extractors, cookie jar and HTTP handlers stay
+# initialized. The progress hooks of the current call are swapped in through `hooks`.
+class _PooledYdl(object):
+    def __init__(self, opts):
+        self.hooks = []
+        self._selectors = {}
+        opts = {k: v for k, v in opts.items() if k not in CALL_OPTIONS}
+        self.ydl = youtube_dl.YoutubeDL(dict(opts, logger=logging.getLogger("yt_dlp"), progress_hooks=[self._dispatch]))
+
+    def _dispatch(self, d):
+        for hook in self.hooks:
+            hook(d)
+
+    def prepare(self, opts, hooks):
+        params = self.ydl.params
+        for key in CALL_OPTIONS:
+            if opts.get(key) is not None:
+                params[key] = opts[key]
+            else:
+                params.pop(key, None)
+        fmt = params.get("format")
+        if fmt in (None, "-"):
+            self.ydl.format_selector = fmt
+        else:
+            if fmt not in self._selectors:
+                self._selectors[fmt] = self.ydl.build_format_selector(fmt)
+            self.ydl.format_selector = self._selectors[fmt]
+        self.hooks = hooks
+
+    def close(self):
+        try:
+            self.ydl.close()
+        except Exception as e:
+            logger.warning(f"Closing a pooled YoutubeDL failed: {e}")
+
+
+# Idle YoutubeDL instances keyed by their options; one per process, so in process mode
+# every worker keeps its own warm instances
+class YdlPool(object):
+    def __init__(self, max_idle_per_key):
+        self.max_idle_per_key = max_idle_per_key
+        self._idle = OrderedDict()  # key -> [_PooledYdl, ...]
+        self._lock = threading.Lock()
+
+    def checkout(self, opts, hooks=(), timings=None):
+        """Take an idle instance for `opts` (or build one); the setup time is observed, or
+        appended as (stage, seconds) to `timings` in a worker process."""
+        start = time.monotonic()
+        key = _pool_key(opts)
+        with self._lock:
+            instances = self._idle.get(key)
+            pooled = instances.pop() if instances else None
+            if key in self._idle:
+                self._idle.move_to_end(key)
+        cold = pooled is None
+        if cold:
+            pooled = _PooledYdl(opts)
+        pooled.prepare(opts, list(hooks))
+        stage = "ytdl_setup_cold" if cold else "ytdl_setup_warm"
+        if timings is None:
+            stage_seconds.observe(time.monotonic() - start, stage=stage)
+        else:
+            timings.append((stage, time.monotonic() - start))
+        return key, pooled
+
+    def checkin(self, key, pooled):
+        pooled.hooks = []
+        evicted = []
+        with self._lock:
+            instances = self._idle.setdefault(key, [])
+            self._idle.move_to_end(key)
+            if len(instances) < self.max_idle_per_key:
+                instances.append(pooled)
+            else:
+                evicted.append(pooled)
+            while len(self._idle) > MAX_POOL_KEYS:
+                evicted.extend(self._idle.popitem(last=False)[1])
+        for instance in evicted:
+            instance.close()
+
+    def warm(self, opts):
+        """Build an instance for `opts` ahead of the first call; returns (cold, warm) setup seconds."""
+        start = time.monotonic()
+        key, pooled = self.checkout(opts)
+        cold = time.monotonic() - start
+        self.checkin(key, pooled)
+        start = time.monotonic()
+        key, pooled = self.checkout(opts)
+        warm = time.monotonic() - start
+        self.checkin(key, pooled)
+        return cold, warm
+
+    def close(self):
+        with self._lock:
+            instances = [p for idle in self._idle.values() for p in idle]
+            self._idle.clear()
+        for pooled in instances:
+            pooled.close()
+
+
+_ydl_pool = YdlPool(Config.TECH_VJ_YTDL_WARM_INSTANCES)
+
+
+def _run_ytdl(url, opts, download, info_dict, progress_hook, max_bytes=None, cancel_event=None, timings=None,
+              hold=None):
+    hooks = []
+    if cancel_event is not None:
+        hooks.append(_cancel_hook(cancel_event))
+    if hold is not None:
+        hooks.append(_throttle_hook(hold, cancel_event))
+    if max_bytes:
+        hooks.append(_size_guard_hook(max_bytes))
+    if progress_hook is not None:
+        hooks.append(progress_hook)
+    key, pooled = _ydl_pool.checkout(opts, hooks, timings)
+    ydl = pooled.ydl
+    try:
+        if info_dict is not None:
+            result = ydl.process_ie_result(info_dict, download=download)
+        else:
+            result = ydl.extract_info(url, download=download)
+        if download and not result.get("requested_downloads"):
+            result["_filename"] = ydl.prepare_filename(result)
+        result = ydl.sanitize_info(result)
+    except BaseException:
+        # A call that failed may have stopped half-way through; do not hand the instance out again
+        pooled.close()
+        raise
+    _ydl_pool.checkin(key, pooled)
+    return result
+
+
+def _warm_pool(option_sets):
+    return [_ydl_pool.warm(opts) for opts in option_sets]
+
+
+# Returns (result, timings): metrics observed in a worker process stay in its own
+# registry, which is never scraped, so the parent records them
+def _worker_job(job_id, url, opts, download, info_dict, max_bytes, cancel_event, hold=None):
+    hook = _forward_progress(job_id) if download else None
+    timings = []
+    try:
+        return _run_ytdl(url, opts, download, info_dict, hook, max_bytes, cancel_event, timings, hold), timings
+    except youtube_dl.utils.DownloadError as e:
+        # The original carries a traceback in exc_info, which cannot be pickled back
+        error_type = DownloadTooLarge if isinstance(e, DownloadTooLarge) else youtube_dl.utils.DownloadError
+        raise error_type(str(e)) from None
+
+
+# Runs yt-dlp extraction/download either in threads (default) or in a pool of
+# worker processes, so heavy extractor work does not compete with the event loop.
+class YtdlExecutor(object):
+    def __init__(self, mode, pool_size, max_jobs_per_worker):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown yt-dlp executor mode: {mode}")
+        self.mode = mode
+        self.pool_size = pool_size
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self._pool = None
+        self._manager = None
+        self._progress_queue = None
+        self._hooks = {}  # job_id -> (loop, callback)
+        self._job_ids = itertools.count(1)
+        self._warm_options = []
+
+    def _ensure_pool(self):
+        if self._pool is not None:
+            return
+        ctx = multiprocessing.get_context("spawn")
+        self._progress_queue = ctx.Queue()
+        self._manager = ctx.Manager()
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.pool_size,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(self._progress_queue, self._warm_options),
+            max_tasks_per_child=self.max_jobs_per_worker or None,
+        )
+        threading.Thread(target=self._pump_progress, name="ytdl-progress", daemon=True).start()
+        logger.info(f"Started yt-dlp process pool with {self.pool_size} workers "
+                    f"(recycled after {self.max_jobs_per_worker} jobs)")
+
+    def _pump_progress(self):
+        while True:
+            try:
+                job_id, d = self._progress_queue.get()
+            except (EOFError, OSError):
+                return
+            target = self._hooks.get(job_id)
+            if target is not None:
+                loop, callback = target
+                loop.call_soon_threadsafe(callback, d)
+
+    async def run(self, url, opts, download=False, info_dict=None, progress_hook=None, max_bytes=None, throttle=None):
+        """Extract (and optionally download) `url`, or re-process a cached `info_dict`.
+
+        `progress_hook(d)` is called on the event loop with yt-dlp progress dicts.
+        Downloads growing past `max_bytes` are aborted with DownloadTooLarge.
+        `throttle(nbytes)` is called on the event loop with every newly downloaded amount and
+        returns the seconds the download must pause (a rate limiter that can change live).
+        Cancelling the caller stops the download at its next progress event and frees the worker.
+        """
+        opts = {k: v for k, v in opts.items() if k not in LOCAL_OPTIONS}
+        loop = asyncio.get_running_loop()
+
+        if self.mode == "thread":
+            hold = None
+            if throttle is not None:
+                hold = SimpleNamespace(value=0.0)
+                progress_hook = _charge_progress(progress_hook, throttle, hold)
+            hook = None
+            if progress_hook is not None:
+                hook = lambda d: loop.call_soon_threadsafe(progress_hook, d)
+            cancel_event = threading.Event()
+            try:
+                return await asyncio.to_thread(_run_ytdl, url, opts, download, info_dict, hook, max_bytes, cancel_event,
+                                               None, hold)
+            except asyncio.CancelledError:
+                cancel_event.set()
+                raise
+
+        self._ensure_pool()
+        job_id = next(self._job_ids)
+        hold = None
+        if throttle is not None:
+            hold = self._manager.Value("d", 0.0)
+            progress_hook = _charge_progress(progress_hook, throttle, hold)
+        if progress_hook is not None:
+            self._hooks[job_id] = (loop, progress_hook)
+        cancel_event = self._manager.Event()
+        try:
+            result, timings = await loop.run_in_executor(self._pool, _worker_job, job_id, url, opts, download,
+                                                         info_dict, max_bytes, cancel_event, hold)
+        except asyncio.CancelledError:
+            cancel_event.set()
+            raise
+        finally:
+            self._hooks.pop(job_id, None)
+        for stage, seconds in timings:
+            stage_seconds.observe(seconds, stage=stage)
+        return result
+
+    async def warm_up(self, *option_sets):
+        """Build pooled YoutubeDL instances for `option_sets` before the first request.
+
+        Returns (cold, warm) setup seconds per option set: building an instance versus
+        taking an idle one from the pool.
+        """
+        option_sets = [{k: v for k, v in opts.items() if k not in LOCAL_OPTIONS} for opts in option_sets]
+        if self.mode == "thread":
+            return await asyncio.to_thread(_warm_pool, option_sets)
+        self._warm_options.extend(option_sets)
+        self._ensure_pool()
+        # Measured in one worker; the others warm up in their initializer
+        return await asyncio.get_running_loop().run_in_executor(self._pool, _warm_pool, option_sets)
+
+    def shutdown(self):
+        _ydl_pool.close()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._manager.shutdown()
+            self._manager = None
+
+
+ydl_executor = YtdlExecutor(
+    Config.TECH_VJ_YTDL_EXECUTOR,
+    Config.TECH_VJ_YTDL_POOL_SIZE,
+    Config.TECH_VJ_YTDL_WORKER_MAX_JOBS,
+)
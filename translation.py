@@ -7,3 +7,36 @@ class Translation(object):
     TECH_VJ_NO_VOID_FORMAT_FOUND = "خطا: {reason}. هیچ فرمت قابل دانلودی یافت نشد."
     TECH_VJ_AFTER_SUCCESSFUL_UPLOAD_MSG_WITH_TS = "دانلود در {} ثانیه کامل شد.\nآپلود در {} ثانیه کامل شد."
     TECH_VJ_UPLOAD_START = "در حال آپلود..."
+    TECH_VJ_QUEUE_POSITION = "درخواست شما در صف قرار گرفت.\nجایگاه شما در صف: {position}"
+    TECH_VJ_POSTPROCESS_START = "در حال پردازش فایل..."
+    TECH_VJ_AFTER_SUCCESSFUL_STREAM_MSG_WITH_TS = "دانلود و آپلود به صورت همزمان در {} ثانیه کامل شد."
+    TECH_VJ_WAITING_FOR_IDENTICAL_JOB = "همین فایل هم‌اکنون در حال آماده‌سازی است، لطفاً صبر کنید..."
+    TECH_VJ_SENT_FROM_FILE_INDEX = "فایل بلافاصله از آرشیو ارسال شد."
+    TECH_VJ_WAITING_FOR_DISK = "فضای دیسک سرور در حال حاضر پر است. درخواست شما پس از آزاد شدن فضا شروع می‌شود..."
+    TECH_VJ_CANCEL_BUTTON = "❌ لغو"
+    TECH_VJ_CANCEL_REQUESTED = "در حال لغو عملیات..."
+    TECH_VJ_CANCEL_NOT_ALLOWED = "این عملیات متعلق به شما نیست."
+    TECH_VJ_CANCEL_NOT_FOUND = "این عملیات دیگر در حال اجرا نیست."
+    TECH_VJ_JOB_CANCELLED = "عملیات توسط شما لغو شد."
+    TECH_VJ_JOB_TIMED_OUT = "زمان مجاز این عملیات به پایان رسید و عملیات لغو شد."
+    TECH_VJ_DISK_FULL = "فضای دیسک سرور برای ادامه‌ی دانلود این فایل کافی نیست و عملیات لغو شد."
+    TECH_VJ_BATCH_START = "پردازش دسته‌ای شروع شد، در حال آماده‌سازی لینک‌ها..."
+    TECH_VJ_BATCH_PROGRESS = "📦 پردازش دسته‌ای: {done} از {total} ارسال شد، {failed} ناموفق"
+    TECH_VJ_BATCH_DONE = "پردازش دسته‌ای به پایان رسید: {done} از {total} ارسال شد، {failed} ناموفق."
+    TECH_VJ_BATCH_CANCELLED = "پردازش دسته‌ای لغو شد: {done} از {total} ارسال شده بود."
+    TECH_VJ_BATCH_FAILED_ENTRIES = "موارد ناموفق:"
+    TECH_VJ_JOB_QUEUED_FOR_WORKER = "درخواست شما ثبت شد و به زودی پردازش می‌شود..."
+    TECH_VJ_SPLITTING = "حجم فایل از محدودیت تلگرام بیشتر است؛ فایل در چند بخش ارسال می‌شود..."
+    TECH_VJ_SPLIT_UPLOAD_PART = "در حال آپلود بخش {index}..."
+    TECH_VJ_SPLIT_PART_CAPTION = "{caption}\n\n📦 بخش {index}"
+    TECH_VJ_SPLIT_DONE = "فایل در {parts} بخش ارسال شد."
+    TECH_VJ_FAST_PATH_START = "کیفیت {label} بر اساس ترجیح شما ({preference}) انتخاب شد و دانلود شروع می‌شود...\nبرای انتخاب دستی کیفیت: /quality off"
+    TECH_VJ_QUALITY_HELP = "تنظیم کیفیت پیش‌فرض:\n/quality 720 mp4 smallest — حداکثر 720p با فرمت mp4، کم‌حجم‌ترین\n/quality audio m4a — فقط صدا\n/quality auto — یادگیری از انتخاب‌های شما\n/quality off — همیشه فهرست کیفیت‌ها نمایش داده شود"
+    TECH_VJ_QUALITY_CURRENT = "کیفیت پیش‌فرض فعلی شما: {preference}"
+    TECH_VJ_QUALITY_NONE = "کیفیت پیش‌فرضی تنظیم نشده است؛ فهرست کیفیت‌ها نمایش داده می‌شود."
+    TECH_VJ_QUALITY_SET = "کیفیت پیش‌فرض شما تنظیم شد: {preference}\nاز این پس لینک‌ها بدون نمایش فهرست کیفیت‌ها دانلود می‌شوند."
+    TECH_VJ_QUALITY_AUTO = "کیفیت پیش‌فرض پاک شد؛ اگر چند بار پشت سر هم یک کیفیت را انتخاب کنید، همان به طور خودکار انتخاب می‌شود."
+    TECH_VJ_QUALITY_OFF = "انتخاب خودکار کیفیت خاموش شد؛ فهرست کیفیت‌ها همیشه نمایش داده می‌شود."
+    TECH_VJ_QUALITY_INVALID = "گزینه نامعتبر: {word}"
+    TECH_VJ_JOB_RESUMED = "ربات دوباره راه‌اندازی شد؛ دانلود شما از همان‌جایی که متوقف شده بود ادامه پیدا می‌کند..."
+    TECH_VJ_JOB_LOST = "پردازش این درخواست چند بار با خطای سرور متوقف شد. لطفاً دوباره امتحان کنید."